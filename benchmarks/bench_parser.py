@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Compare the streaming parser with the xmltodict conversion it replaced
+
+Usage: python -m benchmarks.bench_parser [--number N]
+"""
+
+import argparse
+import os
+import timeit
+import tracemalloc
+from luascli.parser import parse_stops, parse_forecast
+from luascli.util import xml_to_dict
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+FORECAST_XML = """<stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
+<message>Green Line services operating normally</message>
+<direction name="Inbound">
+    <tram dueMins="2" destination="Broombridge" />
+    <tram dueMins="14" destination="Broombridge" />
+</direction>
+<direction name="Outbound"><tram dueMins="7" destination="Bride's Glen" /></direction>
+</stopInfo>
+"""
+
+
+def xmltodict_stops(xmldata):
+    """The stops parsing of luascli 0.10.0: xmltodict plus a copy into records"""
+    output = {}
+    for line in xml_to_dict(xmldata)["stops"]["line"]:
+        output[line["@name"]] = [
+            {
+                "abrev": stop["@abrev"],
+                "text": stop["@pronunciation"],
+                "park_ride": stop["@isParkRide"],
+                "cycle_ride": stop["@isCycleRide"],
+                "lat": stop["@lat"],
+                "lon": stop["@long"],
+            }
+            for stop in line["stop"]
+        ]
+    return output
+
+
+def xmltodict_forecast(xmldata):
+    """The forecast parsing of luascli 0.10.0: xmltodict plus a copy"""
+    doc = xml_to_dict(xmldata)
+    timetable = {}
+    for direction in doc["stopInfo"]["direction"]:
+        trams = direction["tram"]
+        if not isinstance(trams, list):
+            trams = [trams]
+        timetable[direction["@name"].lower()] = [
+            {"dueMins": t.get("@dueMins", ""), "destination": t.get("@destination", "")}
+            for t in trams
+        ]
+    return doc["stopInfo"]["message"], timetable
+
+
+def measure(func, xmldata, number):
+    """Return the mean time in microseconds and the peak memory in KiB"""
+    func(xmldata)
+    seconds = min(timeit.repeat(lambda: func(xmldata), number=number, repeat=5))
+
+    tracemalloc.start()
+    func(xmldata)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds / number * 1e6, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(os.path.join(DATA, "stops.xml"), "r", encoding="utf-8") as f:
+        stops_xml = f.read()
+
+    cases = [
+        ("stops", "xmltodict", xmltodict_stops, stops_xml),
+        ("stops", "expat", parse_stops, stops_xml),
+        ("forecast", "xmltodict", xmltodict_forecast, FORECAST_XML),
+        ("forecast", "expat", parse_forecast, FORECAST_XML),
+    ]
+
+    print(
+        "{:<10}{:<12}{:>12}{:>14}".format(
+            "document", "parser", "time (us)", "peak (KiB)"
+        )
+    )
+    for document, name, func, xmldata in cases:
+        elapsed, peak = measure(func, xmldata, args.number)
+        print("{:<10}{:<12}{:>12.1f}{:>14.1f}".format(document, name, elapsed, peak))
+
+
+if __name__ == "__main__":
+    main()
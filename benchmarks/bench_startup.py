@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Measure the start-up time of the luas command with python -X importtime
+
+Usage: python -m benchmarks.bench_startup [--number N]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("requests", "luascli.luas", "luascli.transport", "pprint")
+
+COMMANDS = [
+    ("import", "import luascli.main"),
+    ("--help", "from luascli.main import luas; luas(['--help'])"),
+    ("--version", "from luascli.main import luas; luas(['--version'])"),
+]
+
+
+def import_times(code):
+    """Run code in a new interpreter and return the -X importtime report
+
+    Returns:
+        A dictionary keyed by module name with the cumulative import time in
+        microseconds, the wall time of the interpreter in seconds and what
+        the code printed
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+
+    return modules, elapsed, result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+
+    print(
+        "{:<12}{:>16}{:>14}  {}".format(
+            "command", "luascli (ms)", "wall (ms)", "heavy modules"
+        )
+    )
+    for name, code in COMMANDS:
+        runs = [import_times(code) for _ in range(args.number)]
+        modules = runs[0][0]
+        heavy = [module for module in HEAVY_MODULES if module in modules]
+        print(
+            "{:<12}{:>16.1f}{:>14.1f}  {}".format(
+                name,
+                statistics.median(r[0].get("luascli.main", 0) for r in runs) / 1000,
+                statistics.median(r[1] for r in runs) * 1000,
+                ", ".join(heavy) or "-",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""Time the luascli commands and library functions against the stub APIs
+
+Every case runs against benchmarks.stub_server with a temporary cache
+directory, and reports its wall time, the requests it sent per endpoint and
+its peak traced memory. Results are printed as JSON (or a text table) and
+can be compared with a previous JSON run.
+
+Usage: python -m benchmarks.bench_suite [--repeat N] [--latency SECONDS]
+           [--only NAME] [--format json|text] [--output FILE]
+           [--compare FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from click.testing import CliRunner
+from luascli import config, luas as library, transport
+from luascli.__version__ import __version__
+from luascli.fares import reset_fare_matrix
+from luascli.main import luas
+from luascli.util import reset_address_cache
+from benchmarks.stub_server import StubServer
+
+RED_STOPS = ["tpt", "sdk", "mys", "gdk", "con", "bus", "abb", "jer"]
+
+
+def reset():
+    """Forget every cached stop, address and fare, on disk and in memory"""
+    shutil.rmtree(config.cache["dir"], ignore_errors=True)
+    library.reset_stop_index()
+    reset_address_cache()
+    reset_fare_matrix()
+    transport.reset_breakers()
+    transport.reset_hedges()
+
+
+def with_catalog():
+    """Start from a stored stop catalog and nothing else"""
+    reset()
+    library.get_catalog()
+
+
+def warm():
+    """Keep whatever the previous run of the case stored"""
+    pass
+
+
+def command(*args):
+    """Run a luas command in-process, returning its exit code"""
+    runner = CliRunner()
+    return lambda: runner.invoke(luas, list(args)).exit_code
+
+
+def case(name, kind, func, setup=with_catalog, prime=False, heavy=False):
+    """Describe a benchmark case
+
+    Args:
+        name: name of the case in the results
+        kind: "library" or "cli"
+        func: function to time, without arguments
+        setup: function run before each measured call
+        prime: call func once before measuring, to time cached calls
+        heavy: measure a single call whatever the --repeat setting
+    """
+    return {
+        "name": name,
+        "kind": kind,
+        "func": func,
+        "setup": setup,
+        "prime": prime,
+        "heavy": heavy,
+    }
+
+
+CASES = [
+    case("get_catalog", "library", lambda: library.get_catalog(True), reset),
+    case("get_stops", "library", lambda: library.get_stops("red")),
+    case("find_line_by_stop", "library", lambda: library.find_line_by_stop("jer")),
+    case("get_stop_detail", "library", lambda: library.get_stop_detail("jer", "red")),
+    case("get_forecast", "library", lambda: library.get_forecast("jer"), warm),
+    case("get_timetable", "library", lambda: library.get_timetable("jer"), warm),
+    case("get_timetables", "library", lambda: library.get_timetables(RED_STOPS), warm),
+    case("get_network", "library", lambda: library.get_network("red"), warm),
+    case("get_fare", "library", lambda: library.get_fare("tpt", "jer", 2, 1)),
+    case("get_address (cold)", "library", lambda: library.get_address("jer")),
+    case(
+        "get_address (cached)",
+        "library",
+        lambda: library.get_address("jer"),
+        warm,
+        prime=True,
+    ),
+    case("precompute_addresses", "library", library.precompute_addresses, heavy=True),
+    case("build_fare_matrix", "library", library.build_fare_matrix, heavy=True),
+    case("luas --help", "cli", command("--help"), warm),
+    case("luas refresh", "cli", command("refresh"), reset),
+    case("luas stops", "cli", command("stops", "red")),
+    case("luas status", "cli", command("status", "jer"), warm),
+    case("luas info", "cli", command("info", "jer"), warm),
+    case("luas time", "cli", command("time", "jer")),
+    case("luas time (8 stops)", "cli", command("time", *RED_STOPS)),
+    case("luas network", "cli", command("network", "red"), warm),
+    case("luas fare", "cli", command("fare", "tpt", "jer", "-a", "2")),
+    case("luas address", "cli", command("address", "jer")),
+    case("luas address --all", "cli", command("address", "--all"), heavy=True),
+    case("luas fare-matrix", "cli", command("fare-matrix"), heavy=True),
+    case("luas catalog build", "cli", command("catalog", "build", "-o", os.devnull)),
+]
+
+
+def request_delta(before, after):
+    """Count the requests sent between two stub counter snapshots"""
+    return {
+        endpoint: count - before.get(endpoint, 0)
+        for endpoint, count in sorted(after.items())
+        if count != before.get(endpoint, 0)
+    }
+
+
+def run_case(stub, case, repeat):
+    """Measure one case and return its result record"""
+    name, kind, func, setup = case["name"], case["kind"], case["func"], case["setup"]
+    repeat = 1 if case["heavy"] else repeat
+    if case["prime"]:
+        setup()
+        func()
+
+    timings = []
+    requests = None
+    outcome = None
+    for _ in range(repeat):
+        setup()
+        before = stub.request_counts()
+        start = time.perf_counter()
+        outcome = func()
+        timings.append(time.perf_counter() - start)
+        if requests is None:
+            requests = request_delta(before, stub.request_counts())
+
+    setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "kind": kind,
+        "repeat": repeat,
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+        "requests": requests,
+        "requests_total": sum(requests.values()),
+        "peak_kib": round(peak / 1024, 1),
+    }
+    if kind == "cli":
+        result["exit_code"] = outcome
+
+    return result
+
+
+def run(latency, jitter, repeat, only=None):
+    """Run every case against a fresh stub server
+
+    Returns:
+        A dictionary with the run settings and the result of every case
+    """
+    stub = StubServer(latency=latency, jitter=jitter).start()
+    saved = (
+        config.forecast_api["url"],
+        config.address_api["url"],
+        config.cache["dir"],
+        config.addresses["min_interval"],
+    )
+    cache_dir = tempfile.mkdtemp(prefix="luascli-bench-")
+    config.forecast_api["url"] = stub.url
+    config.address_api["url"] = stub.url
+    config.cache["dir"] = os.path.join(cache_dir, "cache")
+    config.addresses["min_interval"] = 0
+
+    try:
+        results = [
+            run_case(stub, case, repeat)
+            for case in CASES
+            if only is None or only in case["name"]
+        ]
+    finally:
+        (
+            config.forecast_api["url"],
+            config.address_api["url"],
+            config.cache["dir"],
+            config.addresses["min_interval"],
+        ) = saved
+        transport.close_session()
+        stub.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        "luascli": __version__,
+        "python": platform.python_version(),
+        "latency": latency,
+        "jitter": jitter,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def print_table(report, baseline=None):
+    """Print the results as a text table, with the ratio to a baseline run"""
+    previous = {}
+    if baseline is not None:
+        previous = {r["name"]: r for r in baseline["results"]}
+
+    print(
+        "{:<24}{:>12}{:>12}{:>10}{:>12}{:>10}".format(
+            "case", "median (ms)", "min (ms)", "requests", "peak (KiB)", "vs base"
+        )
+    )
+    for result in report["results"]:
+        ratio = "-"
+        if result["name"] in previous and previous[result["name"]]["median_ms"]:
+            ratio = "{:.2f}x".format(
+                result["median_ms"] / previous[result["name"]]["median_ms"]
+            )
+        print(
+            "{:<24}{:>12.1f}{:>12.1f}{:>10}{:>12.1f}{:>10}".format(
+                result["name"],
+                result["median_ms"],
+                result["min_ms"],
+                result["requests_total"],
+                result["peak_kib"],
+                ratio,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--only", help="Run the cases whose name contains ONLY")
+    parser.add_argument("--format", choices=("json", "text"), default="json")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    report = run(args.latency, args.jitter, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.format == "text" or baseline is not None:
+        print_table(report, baseline)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Luas forecast API and the Nominatim reverse API
+
+The stub answers the stops, forecast and farecalc actions of get.ashx and
+the reverse geocoding endpoint with the recorded documents of
+benchmarks/data, after a configurable latency, and counts the requests it
+served per endpoint.
+
+Usage: python -m benchmarks.stub_server [--port PORT] [--latency SECONDS]
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import quoteattr
+from luascli.parser import parse_stops
+from luascli.server import ThreadingHTTPServer
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+ADULT_FARE = (Decimal("2.10"), Decimal("1.90"))
+CHILD_FARE = (Decimal("1.00"), Decimal("1.00"))
+
+
+def read_data(name):
+    """Read a recorded document of benchmarks/data"""
+    with open(os.path.join(DATA, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer a request with the recorded document of its endpoint"""
+
+    # keep-alive, so pooled clients reuse their connections like upstream,
+    # without Nagle delaying the body behind the headers
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/xml/get.ashx":
+            endpoint = query.get("action", "")
+            body = {
+                "stops": self.server.stops_document,
+                "forecast": self.forecast,
+                "farecalc": self.farecalc,
+            }.get(endpoint)
+        elif url.path == "/reverse":
+            endpoint = "reverse"
+            body = self.reverse
+        else:
+            endpoint, body = url.path, None
+
+        self.server.count(endpoint)
+        self.server.wait()
+
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if callable(body):
+            body = body(query)
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def forecast(self, query):
+        """The recorded forecast with the name of the requested stop"""
+        stop = self.server.stops.get(query.get("stop", "").upper())
+        if stop is None:
+            return self.server.documents["forecast_unknown.xml"]
+
+        return self.server.documents["forecast.xml"].format(
+            stop=quoteattr(stop)[1:-1], abrev=query["stop"].upper()
+        )
+
+    def farecalc(self, query):
+        """A fare that grows with the number of adults and children"""
+        adults = int(query.get("adults", 0))
+        children = int(query.get("children", 0))
+        peak = ADULT_FARE[0] * adults + CHILD_FARE[0] * children
+        offpeak = ADULT_FARE[1] * adults + CHILD_FARE[1] * children
+        return self.server.documents["farecalc.xml"].format(
+            peak="{:.2f}".format(peak), offpeak="{:.2f}".format(offpeak)
+        )
+
+    def reverse(self, query):
+        """The recorded address at the requested coordinates"""
+        return self.server.documents["reverse.xml"].format(
+            lat=quoteattr(query.get("lat", ""))[1:-1],
+            lon=quoteattr(query.get("lon", ""))[1:-1],
+        )
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serve the recorded documents on a local port
+
+    Args:
+        host: address to listen on
+        port: port to listen on, 0 picks a free one
+        latency: seconds to wait before answering each request
+        jitter: extra random wait of up to this many seconds
+    """
+
+    # the default backlog of 5 makes concurrent clients wait for a SYN retry
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.documents = {
+            name: read_data(name)
+            for name in (
+                "forecast.xml",
+                "forecast_unknown.xml",
+                "farecalc.xml",
+                "reverse.xml",
+            )
+        }
+        self.stops_document = read_data("stops.xml")
+        self.stops = {
+            stop["abrev"]: stop["text"]
+            for line in parse_stops(self.stops_document).values()
+            for stop in line
+        }
+        self.requests = Counter()
+        self.requests_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://" + self.server_address[0] + ":" + str(self.server_port)
+
+    def count(self, endpoint):
+        with self.requests_lock:
+            self.requests[endpoint] += 1
+
+    def wait(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def request_counts(self):
+        """Get the number of requests served per endpoint"""
+        with self.requests_lock:
+            return dict(self.requests)
+
+    def start(self):
+        """Serve requests from a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, args.latency, args.jitter)
+    print("Serving the stub APIs on " + server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import functools
+import gzip
+import random
+import re
+import socket
+import time
+import urllib.request
+import weakref
+from collections import deque
+from urllib.parse import unquote, urldefrag, urljoin, urlsplit
+from xml.parsers.expat import ExpatError
+from luascli import config, fares, luas, trace
+from luascli.__version__ import __version__
+from luascli.exceptions import (
+    LuasStopNotFound,
+    LuasCatalogNotFound,
+    LuasServiceUnavailable,
+)
+from luascli.parser import parse_forecast, parse_fare
+from luascli.records import timetable_records
+from luascli.util import get_cached_address, parse_address, store_address
+
+_inflight = {}
+_limits = weakref.WeakKeyDictionary()
+_pools = weakref.WeakKeyDictionary()
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+def _coalesce(key, func, *args):
+    """Share one task between the concurrent calls with the same key
+
+    The shared task is shielded, so a caller that is cancelled doesn't
+    cancel it for the others.
+
+    Args:
+        key: hashable key of the call, e.g. a URL
+        func: coroutine function
+        args: positional arguments of func
+
+    Returns:
+        An awaitable with the result of func(*args)
+    """
+    loop = asyncio.get_running_loop()
+    task = _inflight.get((loop, key))
+    if task is None:
+        task = asyncio.ensure_future(func(*args))
+        _inflight[(loop, key)] = task
+        task.add_done_callback(lambda done: _forget(loop, key, done))
+
+    return asyncio.shield(task)
+
+
+def _forget(loop, key, task):
+    """Drop a finished task of _coalesce(), marking its error as retrieved"""
+    _inflight.pop((loop, key), None)
+    if not task.cancelled():
+        task.exception()
+
+
+async def _in_thread(func, *args):
+    """Run blocking disk I/O on the default executor, off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args)
+    )
+
+
+def _connections():
+    """Get the semaphore limiting the busy connections of the running loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _limits.get(loop)
+    if semaphore is None:
+        semaphore = _limits[loop] = asyncio.Semaphore(config.aio["max_connections"])
+    return semaphore
+
+
+def _pool():
+    """Get the idle keep-alive connections of the running loop, per origin"""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = {}
+    return pool
+
+
+def _checkout(origin):
+    """Take the most recently used idle connection to an origin, if any"""
+    idle = _pool().get(origin)
+    now = time.monotonic()
+    while idle:
+        reader, writer, since = idle.pop()
+        if now - since < config.aio["idle_timeout"] and not reader.at_eof():
+            return reader, writer
+        writer.close()
+
+    return None
+
+
+def _checkin(origin, reader, writer):
+    """Keep a connection for the next request to its origin"""
+    idle = _pool().setdefault(origin, deque())
+    idle.append((reader, writer, time.monotonic()))
+    while len(idle) > config.aio["max_idle"]:
+        idle.popleft()[1].close()
+
+
+async def close():
+    """Close the idle keep-alive connections of the running event loop
+
+    Await it before the event loop ends, e.g. at the end of the coroutine
+    given to asyncio.run(), so no connection is left open.
+
+    Returns:
+        None
+    """
+    pool = _pools.pop(asyncio.get_running_loop(), {})
+    writers = [writer for idle in pool.values() for reader, writer, since in idle]
+    for writer in writers:
+        writer.close()
+    for writer in writers:
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    return None
+
+
+def _proxy(parts):
+    """Get the proxy of a URL from HTTP_PROXY/HTTPS_PROXY and NO_PROXY
+
+    Returns:
+        The proxy URL, or None for a direct connection
+    """
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.hostname):
+        return None
+
+    return proxy if "://" in proxy else "http://" + proxy
+
+
+def _proxy_authorization(proxy):
+    """Get the Proxy-Authorization header line of a proxy URL, if any"""
+    if proxy is None or urlsplit(proxy).username is None:
+        return ""
+
+    proxy = urlsplit(proxy)
+    credentials = unquote(proxy.username) + ":" + unquote(proxy.password or "")
+    return (
+        "Proxy-Authorization: Basic "
+        + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        + "\r\n"
+    )
+
+
+async def fetch(url, timeout=None):
+    """Send a GET request without blocking the event loop
+
+    Requests use asyncio streams over keep-alive connections, pooled per
+    event loop and origin (see close()), at most
+    config.aio["max_connections"] busy at a time. Redirects are followed and
+    HTTP_PROXY/HTTPS_PROXY/NO_PROXY are honoured, and concurrent requests for
+    the same URL share one response. Connection errors, timeouts and 429/5xx
+    responses are retried like luascli.transport.get() does.
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds, defaults to
+            config.http["connect_timeout"] and config.http["read_timeout"]
+
+    Returns:
+        A (status code, body text) tuple
+    """
+    if timeout is None:
+        timeout = (config.http["connect_timeout"], config.http["read_timeout"])
+    elif not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+
+    return await _coalesce(url, _fetch, url, timeout)
+
+
+async def _fetch(url, timeout):
+    """Send a GET request with retries - see fetch()"""
+    host = urlsplit(url).netloc
+    attempts = config.http["retries"] + 1
+    cause = None
+    for attempt in range(attempts):
+        start = time.monotonic()
+        try:
+            async with _connections():
+                status, text = await _request(url, timeout)
+            if trace.active():
+                trace.record(
+                    "http",
+                    url=url,
+                    status=status,
+                    bytes=len(text),
+                    duration=time.monotonic() - start,
+                )
+            if status != 429 and status < 500:
+                return status, text
+            cause = None
+        except (OSError, asyncio.TimeoutError, EOFError, ValueError) as e:
+            trace.record(
+                "http",
+                url=url,
+                status=type(e).__name__,
+                bytes=0,
+                duration=time.monotonic() - start,
+            )
+            cause = e
+
+        if attempt + 1 < attempts:
+            await asyncio.sleep(
+                random.uniform(
+                    0,
+                    min(
+                        config.http["max_backoff"], config.http["backoff"] * 2**attempt
+                    ),
+                )
+            )
+
+    raise LuasServiceUnavailable(host) from cause
+
+
+async def _request(url, timeout):
+    """Send one GET request, following redirects
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds
+
+    Returns:
+        A (status code, body text) tuple
+    """
+    for _ in range(config.aio["max_redirects"] + 1):
+        status, headers, body = await _exchange(url, timeout)
+        if status not in REDIRECTS or "location" not in headers:
+            return status, _decode(headers, body)
+        url = urljoin(url, headers["location"])
+
+    raise ValueError("More than " + str(config.aio["max_redirects"]) + " redirects")
+
+
+async def _exchange(url, timeout, reuse=True):
+    """Send one HTTP/1.1 GET request over a pooled or new connection
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds
+        reuse: take an idle connection from the pool if there is one
+
+    Returns:
+        A (status code, headers, body bytes) tuple
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    proxy = _proxy(parts)
+    origin = (parts.scheme, parts.hostname, port, proxy)
+
+    connection = _checkout(origin) if reuse else None
+    reused = connection is not None
+    if connection is None:
+        connection = await asyncio.wait_for(
+            _connect(parts.hostname, port, https, proxy), timeout[0]
+        )
+    reader, writer = connection
+
+    if proxy is not None and not https:
+        target = urldefrag(url)[0]
+        authorization = _proxy_authorization(proxy)
+    else:
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        authorization = ""
+
+    try:
+        writer.write(
+            (
+                "GET " + target + " HTTP/1.1\r\n"
+                "Host: " + parts.netloc.rpartition("@")[2] + "\r\n"
+                "User-Agent: luascli/" + __version__ + "\r\n"
+                "Accept-Encoding: gzip\r\n" + authorization + "\r\n"
+            ).encode("ascii")
+        )
+        status, headers, body, keep_alive = await asyncio.wait_for(
+            _read_response(reader), timeout[1]
+        )
+    except (ConnectionError, EOFError):
+        writer.close()
+        if reused:
+            # the server closed the idle connection in the meantime
+            return await _exchange(url, timeout, reuse=False)
+        raise
+    except BaseException:
+        writer.close()
+        raise
+
+    if keep_alive:
+        _checkin(origin, reader, writer)
+    else:
+        writer.close()
+
+    return status, headers, body
+
+
+async def _connect(host, port, https, proxy):
+    """Open a connection to a host, directly or through an HTTP proxy
+
+    Returns:
+        A (reader, writer) tuple of asyncio streams
+    """
+    if proxy is None:
+        return await asyncio.open_connection(host, port, ssl=True if https else None)
+
+    proxy_parts = urlsplit(proxy)
+    if not https:
+        return await asyncio.open_connection(
+            proxy_parts.hostname, proxy_parts.port or 80
+        )
+
+    sock = await _tunnel(proxy, host, port)
+    return await asyncio.open_connection(sock=sock, ssl=True, server_hostname=host)
+
+
+async def _tunnel(proxy, host, port):
+    """Open a CONNECT tunnel to host:port through an HTTP proxy
+
+    Returns:
+        The connected non-blocking socket
+    """
+    loop = asyncio.get_running_loop()
+    proxy_parts = urlsplit(proxy)
+    error = OSError("Can't connect to " + proxy_parts.netloc)
+    for family, kind, protocol, _, address in await loop.getaddrinfo(
+        proxy_parts.hostname, proxy_parts.port or 80, type=socket.SOCK_STREAM
+    ):
+        sock = socket.socket(family, kind, protocol)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            break
+        except OSError as e:
+            sock.close()
+            error = e
+    else:
+        raise error
+
+    try:
+        authority = host + ":" + str(port)
+        await loop.sock_sendall(
+            sock,
+            (
+                "CONNECT " + authority + " HTTP/1.1\r\n"
+                "Host: " + authority + "\r\n" + _proxy_authorization(proxy) + "\r\n"
+            ).encode("ascii"),
+        )
+        response = b""
+        while b"\r\n\r\n" not in response:
+            data = await loop.sock_recv(sock, 4096)
+            if not data:
+                raise EOFError("The proxy closed the tunnel")
+            response += data
+        status = int(response.partition(b" ")[2][:3])
+        if status != 200:
+            raise OSError("The proxy refused the tunnel: " + str(status))
+    except BaseException:
+        sock.close()
+        raise
+
+    return sock
+
+
+async def _read_response(reader):
+    """Read the status, headers and body of an HTTP/1.1 response
+
+    Returns:
+        A (status code, headers, body bytes, keep-alive) tuple, keep-alive
+        being True if the connection can be used for another request
+    """
+    version, _, status = (await reader.readline()).partition(b" ")
+    if not version:
+        raise EOFError("The server closed the connection")
+    status = int(status[:3])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = (
+        version == b"HTTP/1.1" and "close" not in headers.get("connection", "").lower()
+    )
+    if status < 200 or status in (204, 304):
+        body = b""
+    elif "chunked" in headers.get("transfer-encoding", "").lower():
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = bytes(body)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    return status, headers, body, keep_alive
+
+
+def _decode(headers, body):
+    """Decompress a gzip body and decode it with the charset of its headers"""
+    if headers.get("content-encoding", "").lower() == "gzip":
+        body = gzip.decompress(body)
+
+    charset = re.search(r"charset=\"?([\w.:-]+)", headers.get("content-type", ""))
+    return body.decode(charset.group(1) if charset else "utf-8", "replace")
+
+
+async def _stop_index(refresh=False):
+    """Load the catalog and the stop index shared with luascli.luas
+
+    The local catalog is read off the event loop, and the stops feed is only
+    downloaded, without blocking the event loop, when neither the in-memory
+    nor the local catalog can be used.
+
+    Returns:
+        A (catalog, stop index) tuple
+    """
+    loaded = None if refresh else luas._loaded_stop_index()
+    if loaded is None:
+        loaded = await _in_thread(luas._load_stop_index, refresh, None, False)
+    if loaded is None:
+        status, text = await fetch(
+            config.forecast_api["url"] + "/xml/get.ashx?action=stops&encrypt=false"
+        )
+        loaded = await _in_thread(luas._load_stop_index, True, text)
+
+    return loaded
+
+
+async def get_catalog(refresh=False):
+    """Asyncio version of luascli.luas.get_catalog()"""
+    return (await _stop_index(refresh))[0]
+
+
+async def get_forecast(stop):
+    """Asyncio version of luascli.luas.get_forecast()
+
+    Concurrent calls for the same stop share one request and one parsed
+    result, which callers must not modify.
+    """
+    return await _coalesce(("forecast", stop.lower()), _fetch_forecast, stop)
+
+
+async def _fetch_forecast(stop):
+    """Download and parse the forecast of a stop"""
+    status, text = await fetch(
+        config.forecast_api["url"]
+        + "/xml/get.ashx?action=forecast&stop="
+        + stop
+        + "&encrypt=false"
+    )
+
+    try:
+        forecast = parse_forecast(text)
+    except ExpatError:
+        raise LuasStopNotFound(stop)
+
+    if forecast is None or forecast["message"] is None or not forecast["timetable"]:
+        raise LuasStopNotFound(stop)
+
+    return forecast
+
+
+async def get_status(stop):
+    """Asyncio version of luascli.luas.get_status()"""
+    return (await get_forecast(stop))["message"]
+
+
+async def get_timetable(stop):
+    """Asyncio version of luascli.luas.get_timetable()"""
+    return (await get_forecast(stop))["timetable"]
+
+
+async def get_timetable_records(stop):
+    """Asyncio version of luascli.luas.get_timetable_records()"""
+    return timetable_records(await get_timetable(stop))
+
+
+async def get_timetables(stops, max_workers=None):
+    """Asyncio version of luascli.luas.get_timetables()
+
+    Args:
+        stops: list of LUAS abbreviated stop names
+        max_workers: maximum number of concurrent requests, defaults to
+            config.concurrency["max_workers"]
+
+    Returns:
+        A list with one dictionary per stop, in the same order as stops, with
+        the keys stop, timetable (None on failure) and error (None on success)
+    """
+    if max_workers is None:
+        max_workers = config.concurrency["max_workers"]
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def fetch_stop(stop):
+        async with semaphore:
+            try:
+                timetable = await get_timetable(stop)
+                return {"stop": stop, "timetable": timetable, "error": None}
+            except Exception as e:
+                return {"stop": stop, "timetable": None, "error": e}
+
+    return list(await asyncio.gather(*[fetch_stop(stop) for stop in stops]))
+
+
+async def get_network(line_name, max_workers=None, deadline=None):
+    """Asyncio version of luascli.luas.get_network()
+
+    Args:
+        line_name: LUAS line (red/green)
+        max_workers: maximum number of concurrent requests, defaults to
+            config.network["max_workers"]
+        deadline: seconds to wait for the forecasts, defaults to
+            config.network["deadline"] (None there waits for every stop)
+
+    Returns:
+        The snapshot of the line - see luascli.luas.get_network()
+    """
+    stops = await get_stops(line_name)
+    if max_workers is None:
+        max_workers = config.network["max_workers"]
+    if deadline is None:
+        deadline = config.network["deadline"]
+
+    results = [
+        {
+            "stop": stop["abrev"],
+            "name": stop["text"],
+            "timetable": None,
+            "error": None,
+            "missed": False,
+        }
+        for stop in stops
+    ]
+    network = {"line": line_name, "messages": [], "stops": results}
+    if not results:
+        return network
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def fetch_stop(stop):
+        async with semaphore:
+            return await get_forecast(stop)
+
+    tasks = [asyncio.ensure_future(fetch_stop(result["stop"])) for result in results]
+    not_done = (await asyncio.wait(tasks, timeout=deadline))[1]
+    for task in not_done:
+        task.cancel()
+
+    messages = {}
+    for task, result in zip(tasks, results):
+        if task in not_done:
+            result["missed"] = True
+            continue
+        try:
+            forecast = task.result()
+        except Exception as e:
+            result["error"] = e
+            continue
+        result["timetable"] = forecast["timetable"]
+        messages.setdefault(forecast["message"], []).append(result["stop"])
+
+    network["messages"] = [
+        {"message": message, "stops": stops} for message, stops in messages.items()
+    ]
+    return network
+
+
+async def get_stops(line_name):
+    """Asyncio version of luascli.luas.get_stops()"""
+    if line_name not in config.luas:
+        raise KeyError(line_name)
+
+    return list((await get_catalog()).get(line_name, []))
+
+
+async def get_stop_records(line_name):
+    """Asyncio version of luascli.luas.get_stop_records()"""
+    await _stop_index()
+    return luas.get_stop_records(line_name)
+
+
+async def get_nearest_stops(lat, lon, count=None, max_distance=None):
+    """Asyncio version of luascli.luas.get_nearest_stops()"""
+    await _stop_index()
+    return luas.get_nearest_stops(lat, lon, count, max_distance)
+
+
+async def get_stop_detail(stop, line_name):
+    """Asyncio version of luascli.luas.get_stop_detail()"""
+    await _stop_index()
+    return luas.get_stop_detail(stop, line_name)
+
+
+async def find_line_by_stop(stop):
+    """Asyncio version of luascli.luas.find_line_by_stop()"""
+    await _stop_index()
+    return luas.find_line_by_stop(stop)
+
+
+async def get_fare(begin_journey, end_journey, num_adults=0, num_children=0):
+    """Asyncio version of luascli.luas.get_fare()"""
+    fares.validate_counts(num_adults, num_children)
+    await _stop_index()
+    line, begin, end = luas.resolve_journey(begin_journey, end_journey)
+
+    output = {}
+    output["from"] = begin_journey
+    output["to"] = end_journey
+    output["adults"] = num_adults
+    output["children"] = num_children
+
+    fare = await _in_thread(
+        fares.lookup_fare, begin_journey, end_journey, num_adults, num_children
+    )
+    if fare is None:
+        if config.catalog["offline"]:
+            raise LuasCatalogNotFound
+        status, text = await fetch(
+            config.forecast_api["url"]
+            + "/xml/get.ashx?action=farecalc&from="
+            + begin_journey
+            + "&to="
+            + end_journey
+            + "&adults="
+            + str(num_adults)
+            + "&children="
+            + str(num_children)
+            + "&encrypt=false"
+        )
+        fare = parse_fare(text) or {
+            "fare_peak": "",
+            "fare_offpeak": "",
+            "zones_travelled": "",
+        }
+    output.update(fare)
+
+    return output, begin, end
+
+
+async def calculate_fare(begin_journey, end_journey, num_adults=0, num_children=0):
+    """Asyncio version of luascli.luas.calculate_fare()"""
+    return (await get_fare(begin_journey, end_journey, num_adults, num_children))[0]
+
+
+async def get_address(stop):
+    """Asyncio version of luascli.luas.get_address()"""
+    line_name = await find_line_by_stop(stop)
+    detail = luas.get_stop_detail(stop, line_name)
+    lat, lon = detail["lat"], detail["lon"]
+
+    address = await _in_thread(get_cached_address, lat, lon)
+    if address is not None:
+        return address
+
+    if config.catalog["offline"]:
+        raise LuasCatalogNotFound
+
+    status, text = await fetch(
+        config.address_api["url"]
+        + "/reverse?format=xml&lat="
+        + lat
+        + "&lon="
+        + lon
+        + "&zoom=18&addressdetails=1"
+    )
+    address = parse_address(text, lat, lon)
+    await _in_thread(store_address, lat, lon, address)
+
+    return address
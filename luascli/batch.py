@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import itertools
+import json
+from luascli import config
+from luascli.exceptions import (
+    LuasStopNotFound,
+    LuasStopsNotOnSameLine,
+    LuasCatalogNotFound,
+)
+
+FIELDS = [
+    "from",
+    "to",
+    "adults",
+    "children",
+    "fare_peak",
+    "fare_offpeak",
+    "zones_travelled",
+    "error",
+]
+
+
+def _parse_count(value):
+    """Convert a number of adults or children, 0 when it is missing
+
+    Only whole numbers and strings of digits are counts. Anything else,
+    e.g. 1.9 or true, is returned as it is, so the journey fails its
+    validation instead of the whole batch.
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+
+    return value
+
+
+def _csv_journeys(lines):
+    """Read (from, to, adults, children) rows, with an optional header"""
+    first = True
+    for row in csv.reader(lines):
+        if not row or not "".join(row).strip():
+            continue
+        if first and row[0].strip().lower() == "from":
+            first = False
+            continue
+        first = False
+
+        row = [value.strip() for value in row] + [""] * (4 - len(row))
+        if not row[0] or not row[1] or len(row) > 4:
+            yield ("", "", None, None)
+            continue
+        yield (row[0], row[1], _parse_count(row[2]), _parse_count(row[3]))
+
+
+def _ndjson_journeys(lines):
+    """Read one {"from": ..., "to": ..., "adults": ..., "children": ...} per line"""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            journey = json.loads(line)
+        except ValueError:
+            journey = None
+        if (
+            not isinstance(journey, dict)
+            or not isinstance(journey.get("from"), str)
+            or not isinstance(journey.get("to"), str)
+        ):
+            yield ("", "", None, None)
+            continue
+        yield (
+            journey["from"],
+            journey["to"],
+            _parse_count(journey.get("adults")),
+            _parse_count(journey.get("children")),
+        )
+
+
+def read_journeys(lines, input_format=None):
+    """Read journeys from a CSV or NDJSON file, one line at a time
+
+    Args:
+        lines: iterable of lines, e.g. an open file
+        input_format: "csv" or "ndjson", guessed from the first line when
+            None (NDJSON lines start with "{")
+
+    Returns:
+        A generator of (begin stop, end stop, adults, children) tuples. A
+        malformed line gives ("", "", None, None) so it is reported as an
+        invalid journey - see luascli.luas.calculate_fares()
+    """
+    lines = iter(lines)
+    if input_format is None:
+        head = []
+        for line in lines:
+            head.append(line)
+            if line.strip():
+                break
+        input_format = "ndjson" if "".join(head).lstrip().startswith("{") else "csv"
+        lines = itertools.chain(head, lines)
+
+    if input_format == "ndjson":
+        return _ndjson_journeys(lines)
+
+    return _csv_journeys(lines)
+
+
+def describe_error(error):
+    """Get the message of a journey that failed
+
+    Args:
+        error: exception of a result of luascli.luas.calculate_fares()
+
+    Returns:
+        A message in the words of the luas fare command
+    """
+    if isinstance(error, LuasStopNotFound):
+        return "The Luas stop " + error.stop + " doesn't exist."
+    if isinstance(error, LuasStopsNotOnSameLine):
+        return (
+            "The Luas stops "
+            + error.first_stop
+            + " and "
+            + error.second_stop
+            + " are not on the same line."
+        )
+    if isinstance(error, LuasCatalogNotFound):
+        return "No local fare available, run 'luas fare-matrix' while online"
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return "Can't connect to " + config.forecast_api["url"]
+    if isinstance(error, ValueError) and not error.args:
+        return "Invalid journey or number of adults or children"
+
+    return str(error)
+
+
+def write_results(results, file, output_format="csv"):
+    """Write fare results as they come
+
+    Args:
+        results: iterable of results - from luascli.luas.calculate_fares()
+        file: writable text file
+        output_format: "csv" (with a header line) or "ndjson"
+
+    Returns:
+        A dictionary with the number of journeys written and failed
+    """
+    summary = {"journeys": 0, "failed": 0}
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(FIELDS)
+
+    for result in results:
+        summary["journeys"] += 1
+        row = dict(result)
+        if row["error"] is not None:
+            summary["failed"] += 1
+            row["error"] = describe_error(row["error"])
+
+        if writer is not None:
+            writer.writerow(["" if row[f] is None else row[f] for f in FIELDS])
+        else:
+            file.write(json.dumps(row) + "\n")
+
+    return summary
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import gzip
+import hashlib
+import json
+from luascli import cache, config, fares, luas
+from luascli.exceptions import LuasBundleInvalid
+from luascli.util import get_cached_address, store_addresses
+
+BUNDLE_FORMAT = "luascli-catalog"
+BUNDLE_VERSION = 1
+
+
+def _checksum(content):
+    """Compute the SHA-256 checksum of the bundle content
+
+    Args:
+        content: dictionary with the stops, addresses and fares of the bundle
+
+    Returns:
+        Hexadecimal digest of the canonical JSON form of content
+    """
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def build_bundle(path, addresses=False, fares_matrix=False):
+    """Write the stop catalog, and optionally addresses and fares, to a bundle
+
+    A bundle is a gzip compressed JSON document that can be imported on a
+    device without network access.
+
+    Args:
+        path: output file
+        addresses: also store the address of every stop, fetching the ones
+            that are not cached yet
+        fares_matrix: also store the fare matrix, fetching the stop pairs
+            that are not cached yet
+
+    Returns:
+        A summary of the bundle - from verify_bundle()
+    """
+    catalog = luas.get_catalog()
+    content = {"stops": catalog, "addresses": {}, "fares": {}}
+
+    if addresses:
+        if not config.catalog["offline"]:
+            luas.precompute_addresses()
+        for stops in catalog.values():
+            for stop in stops:
+                address = get_cached_address(stop["lat"], stop["lon"])
+                if address is not None:
+                    content["addresses"][stop["lat"] + "," + stop["lon"]] = address
+
+    if fares_matrix:
+        if not config.catalog["offline"]:
+            luas.build_fare_matrix()
+        content["fares"] = dict(fares.get_fare_matrix())
+
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        ),
+        "checksum": _checksum(content),
+    }
+    bundle.update(content)
+
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(bundle, f, separators=(",", ":"))
+
+    return _summary(bundle)
+
+
+def read_bundle(path):
+    """Read and validate a bundle
+
+    Args:
+        path: bundle file
+
+    Returns:
+        The bundle content as a dictionary
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            bundle = json.load(f)
+    except (OSError, EOFError, ValueError) as e:
+        raise LuasBundleInvalid(path, str(e))
+
+    if not isinstance(bundle, dict) or bundle.get("format") != BUNDLE_FORMAT:
+        raise LuasBundleInvalid(path, "not a luascli catalog bundle")
+
+    if bundle.get("version") != BUNDLE_VERSION:
+        raise LuasBundleInvalid(
+            path, "unsupported bundle version " + str(bundle.get("version"))
+        )
+
+    content = {key: bundle.get(key) for key in ("stops", "addresses", "fares")}
+    if not all(isinstance(value, dict) for value in content.values()):
+        raise LuasBundleInvalid(path, "missing stops, addresses or fares")
+
+    if bundle.get("checksum") != _checksum(content):
+        raise LuasBundleInvalid(path, "checksum mismatch")
+
+    return bundle
+
+
+def verify_bundle(path):
+    """Validate a bundle and summarise its content
+
+    Args:
+        path: bundle file
+
+    Returns:
+        A dictionary with the bundle version, creation date and the number of
+        stops per line, of addresses and of fare matrix entries
+    """
+    return _summary(read_bundle(path))
+
+
+def _summary(bundle):
+    """Summarise the content of a bundle
+
+    Args:
+        bundle: bundle content - from read_bundle()
+
+    Returns:
+        A dictionary with the bundle version, creation date and the number of
+        stops per line, of addresses and of fare matrix entries
+    """
+    return {
+        "version": bundle["version"],
+        "created": bundle["created"],
+        "stops": {line: len(stops) for line, stops in bundle["stops"].items()},
+        "addresses": len(bundle["addresses"]),
+        "fares": len(bundle["fares"]),
+    }
+
+
+def import_bundle(path):
+    """Install the catalog, addresses and fares of a bundle in the local cache
+
+    Args:
+        path: bundle file
+
+    Returns:
+        A summary of the bundle - from verify_bundle()
+    """
+    bundle = read_bundle(path)
+
+    cache.store(luas.CATALOG_FILE, bundle["stops"])
+    if bundle["addresses"]:
+        store_addresses(bundle["addresses"])
+    if bundle["fares"]:
+        fares.store_fares(bundle["fares"])
+    luas.reset_stop_index()
+
+    return _summary(bundle)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+import time
+from luascli import config, trace
+
+
+def cache_path(name):
+    """Get the full path of a file in the local cache directory
+
+    Args:
+        name: file name inside the cache directory
+
+    Returns:
+        Absolute path of the cached file
+    """
+    return os.path.join(config.cache["dir"], name)
+
+
+def load(name, ttl=None):
+    """Load a JSON document from the local cache
+
+    Args:
+        name: file name inside the cache directory
+        ttl: maximum age in seconds, or None to accept any age
+
+    Returns:
+        The cached data, or None if it is missing, expired or unreadable
+    """
+    try:
+        with open(cache_path(name), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        created = entry["created"]
+        data = entry["data"]
+    except (OSError, ValueError, KeyError, TypeError):
+        trace.record("cache", name="disk", key=name, result="miss")
+        return None
+
+    if ttl is not None and time.time() - created > ttl:
+        trace.record("cache", name="disk", key=name, result="expired")
+        return None
+
+    trace.record("cache", name="disk", key=name, result="hit")
+    return data
+
+
+def store(name, data):
+    """Store a JSON document in the local cache
+
+    The file is written to a temporary name and then renamed, so concurrent
+    readers never see a partially written document. A cache directory that
+    can't be created or written only means the document isn't cached.
+
+    Args:
+        name: file name inside the cache directory
+        data: JSON serialisable data
+
+    Returns:
+        None
+    """
+    path = cache_path(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:
+        return None
+
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "data": data}, f)
+        os.replace(tmp, path)
+    except OSError:
+        os.unlink(tmp)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return None
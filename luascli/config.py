@@ -1,8 +1,77 @@
 # -*- coding: utf-8 -*-
 
+import os
+
 luas = {
     "red": {"full_name": "Luas Red Line", "short_name": "red"},
     "green": {"full_name": "Luas Green Line", "short_name": "green"},
 }
 
 forecast_api = {"url": "https://luasforecasts.rpa.ie"}
+
+cache = {
+    "dir": os.environ.get(
+        "LUASCLI_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "luascli"),
+    )
+}
+
+catalog = {"ttl": 7 * 24 * 60 * 60, "offline": False}
+
+address_api = {"url": "https://nominatim.openstreetmap.org"}
+
+http = {
+    "pool_connections": 4,
+    "pool_size": 10,
+    "connect_timeout": 3.05,
+    "read_timeout": 10,
+    "retries": 2,
+    "backoff": 0.5,
+    "max_backoff": 5,
+    "breaker_threshold": 5,
+    "breaker_reset": 30,
+    "serve_stale": True,
+    "stale_entries": 256,
+    "stale_max_age": 24 * 60 * 60,
+    "forecast_stale_max_age": 60,
+    "hedge": False,
+    "hedge_percentile": 95,
+    "hedge_delay": 0.5,
+    "hedge_min_samples": 20,
+    "hedge_window": 200,
+    "hedge_ratio": 0.1,
+}
+
+http_cache = {"enabled": True, "max_bytes": 32 * 1024 * 1024}
+
+concurrency = {"max_workers": 8}
+
+network = {"max_workers": 8, "deadline": 10.0}
+
+aio = {
+    "max_connections": 100,
+    "max_idle": 10,
+    "idle_timeout": 30,
+    "max_redirects": 10,
+}
+
+addresses = {"max_workers": 2, "min_interval": 1.0}
+
+watch = {"interval": 30, "max_interval": 300}
+
+fares = {
+    "max_workers": 4,
+    "save_every": 50,
+    "batch_window": 256,
+    "ttl": 30 * 24 * 60 * 60,
+}
+
+server = {
+    "host": "127.0.0.1",
+    "port": 8080,
+    "forecast_ttl": 15,
+    "fare_ttl": 24 * 60 * 60,
+    "max_entries": 1024,
+}
+
+nearest = {"count": 3, "cell_size": 0.02}
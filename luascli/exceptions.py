@@ -18,3 +18,18 @@ class LuasStopsNotOnSameLine(Exception):
     def __init__(self, first_stop="", second_stop=""):
         self.first_stop = first_stop
         self.second_stop = second_stop
+
+
+class LuasCatalogNotFound(Exception):
+    pass
+
+
+class LuasBundleInvalid(Exception):
+    def __init__(self, path="", reason=""):
+        self.path = path
+        self.reason = reason
+
+
+class LuasServiceUnavailable(ConnectionError):
+    def __init__(self, host=""):
+        self.host = host
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from luascli import cache, config, trace
+
+FARES_FILE = "fares.json"
+
+_fares = {"entries": None}
+_fares_lock = threading.Lock()
+
+
+def fare_key(first_stop, second_stop):
+    """Get the key of a stop pair in the fare matrix
+
+    Fares are zone based, so both directions of a journey share one entry.
+
+    Args:
+        first_stop: LUAS stop abbreviated name
+        second_stop: LUAS stop abbreviated name
+
+    Returns:
+        A string key such as "CIT:JER"
+    """
+    return ":".join(sorted([first_stop.upper(), second_stop.upper()]))
+
+
+def get_fare_matrix():
+    """Get the precomputed fare matrix from the local cache
+
+    Returns:
+        A dictionary mapping fare_key() to a list with the adult peak, adult
+        off-peak, child peak and child off-peak fares, the zones travelled
+        and the timestamp the fares were fetched at
+    """
+    with _fares_lock:
+        if _fares["entries"] is None:
+            _fares["entries"] = cache.load(FARES_FILE) or {}
+
+        return _fares["entries"]
+
+
+def store_fares(entries):
+    """Store fare matrix entries in the local cache
+
+    Entries written by other processes in the meantime are kept.
+
+    Args:
+        entries: dictionary of fare matrix entries keyed by fare_key()
+
+    Returns:
+        None
+    """
+    with _fares_lock:
+        matrix = cache.load(FARES_FILE) or {}
+        matrix.update(_fares["entries"] or {})
+        matrix.update(entries)
+        cache.store(FARES_FILE, matrix)
+        _fares["entries"] = matrix
+
+    return None
+
+
+def reset_fare_matrix():
+    """Drop the in-memory fare matrix so the next lookup reads the cache again
+
+    Returns:
+        None
+    """
+    with _fares_lock:
+        _fares["entries"] = None
+
+    return None
+
+
+def validate_counts(num_adults, num_children):
+    """Check the numbers of adults and children of a journey
+
+    Counts must be ints, not bools, and not negative.
+
+    Args:
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        None, or raises ValueError
+    """
+    for count in (num_adults, num_children):
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise ValueError
+
+    return None
+
+
+def is_fresh(entry):
+    """Check if a fare matrix entry can be used without asking farecalc
+
+    Fares change over time, so entries expire config.fares["ttl"] seconds
+    after they were fetched. Entries without a timestamp, e.g. from an older
+    matrix, are expired. In offline mode any entry is used.
+
+    Args:
+        entry: fare matrix entry - see get_fare_matrix() - or None
+
+    Returns:
+        True if the entry can be used
+    """
+    if entry is None:
+        return False
+    if config.catalog["offline"]:
+        return True
+
+    try:
+        return time.time() - float(entry[5]) <= config.fares["ttl"]
+    except (IndexError, TypeError, ValueError):
+        return False
+
+
+def lookup_fare(begin_journey, end_journey, num_adults, num_children):
+    """Calculate a fare from the precomputed fare matrix
+
+    Args:
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        A dictionary with the peak/off-peak fares and the zones travelled, or
+        None if the stop pair isn't in the matrix or has expired
+    """
+    key = fare_key(begin_journey, end_journey)
+    entry = get_fare_matrix().get(key)
+    if entry is None:
+        trace.record("cache", name="fares", key=key, result="miss")
+        return None
+    if not is_fresh(entry):
+        trace.record("cache", name="fares", key=key, result="expired")
+        return None
+
+    trace.record("cache", name="fares", key=key, result="hit")
+
+    return fare_from_entry(entry, num_adults, num_children)
+
+
+def fare_from_entry(entry, num_adults, num_children):
+    """Calculate a fare from the adult and child fares of a stop pair
+
+    Args:
+        entry: fare matrix entry - see get_fare_matrix()
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        A dictionary with the peak/off-peak fares and the zones travelled, or
+        None if the entry is malformed
+    """
+    try:
+        adult_peak, adult_offpeak, child_peak, child_offpeak, zones = entry[:5]
+        peak = Decimal(adult_peak) * num_adults + Decimal(child_peak) * num_children
+        offpeak = (
+            Decimal(adult_offpeak) * num_adults + Decimal(child_offpeak) * num_children
+        )
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+
+    return {
+        "fare_peak": "{:.2f}".format(peak),
+        "fare_offpeak": "{:.2f}".format(offpeak),
+        "zones_travelled": zones,
+    }
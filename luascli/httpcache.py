@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from luascli import cache, config
+
+HTTP_DIR = "http"
+KEPT_HEADERS = (
+    "Cache-Control",
+    "Content-Type",
+    "Date",
+    "ETag",
+    "Expires",
+    "Last-Modified",
+)
+
+_written = {"bytes": None}
+_written_lock = threading.Lock()
+
+
+def entry_path(url):
+    """Get the path of the cached response of a URL
+
+    Args:
+        url: full URL of the request
+
+    Returns:
+        Absolute path of the entry inside the http cache directory
+    """
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return cache.cache_path(os.path.join(HTTP_DIR, name))
+
+
+def _parse_date(value):
+    """Convert an HTTP date to a timestamp, None when it can't be parsed"""
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def freshness(headers, now):
+    """Get until when a response can be used without asking the server again
+
+    Only the server's Cache-Control, Expires and Age headers are used;
+    responses without them are stale straight away and only kept if they
+    can be revalidated.
+
+    Args:
+        headers: response headers
+        now: timestamp of the response
+
+    Returns:
+        The timestamp the response expires at, or None if it must not be
+        stored (no-store, or Vary: *)
+    """
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip().strip('"')
+
+    if "no-store" in directives or headers.get("Vary", "").strip() == "*":
+        return None
+    if "no-cache" in directives:
+        return now
+
+    try:
+        age = max(0, int(headers.get("Age", "0")))
+    except ValueError:
+        age = 0
+
+    if "max-age" in directives:
+        try:
+            return now + int(directives["max-age"]) - age
+        except ValueError:
+            return now
+
+    if "Expires" in headers:
+        expires = _parse_date(headers["Expires"])
+        if expires is None:
+            return now
+        date = _parse_date(headers.get("Date", "")) or now
+        return now + expires - date - age
+
+    return now
+
+
+def load(url):
+    """Read the cached response of a URL
+
+    Args:
+        url: full URL of the request
+
+    Returns:
+        A dictionary with the url, the kept headers, the encoding, the
+        timestamps the response expires at and was received or revalidated
+        at ("stored"), the compressed body ("data") and the body
+        ("content"), or None if there is no readable entry
+    """
+    try:
+        with open(entry_path(url), "rb") as f:
+            entry = json.loads(f.readline().decode("utf-8"))
+            entry["data"] = f.read()
+        if entry["url"] != url:
+            return None
+        entry["content"] = gzip.decompress(entry["data"])
+    except (OSError, EOFError, ValueError, KeyError, TypeError):
+        return None
+
+    return entry
+
+
+def is_fresh(entry, now):
+    """Check if a cached response can be used without asking the server"""
+    return entry["expires"] > now
+
+
+def validators(entry):
+    """Get the conditional request headers that revalidate a cached response
+
+    Returns:
+        A dictionary with If-None-Match and/or If-Modified-Since, empty if
+        the response has neither an ETag nor a Last-Modified header
+    """
+    headers = {}
+    if entry["headers"].get("ETag"):
+        headers["If-None-Match"] = entry["headers"]["ETag"]
+    if entry["headers"].get("Last-Modified"):
+        headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+    return headers
+
+
+def touch(url):
+    """Mark the cached response of a URL as recently used, for eviction"""
+    try:
+        os.utime(entry_path(url))
+    except OSError:
+        pass
+
+
+def store(url, response, now):
+    """Store a 200 response in the cache, compressed
+
+    Responses that are neither fresh nor revalidatable aren't stored, and
+    no-store responses drop the previous entry of the URL.
+
+    Args:
+        url: full URL of the request
+        response: requests.Response object
+        now: timestamp of the response
+
+    Returns:
+        The stored entry - see load() - or None
+    """
+    expires = freshness(response.headers, now)
+    if expires is None:
+        remove(url)
+        return None
+
+    headers = {
+        name: response.headers[name]
+        for name in KEPT_HEADERS
+        if response.headers.get(name)
+    }
+    entry = {
+        "url": url,
+        "headers": headers,
+        "encoding": response.encoding,
+        "expires": expires,
+        "stored": now,
+    }
+    if expires <= now and not validators(entry):
+        return None
+
+    entry["data"] = gzip.compress(response.content)
+    entry["content"] = response.content
+    _write(entry)
+    return entry
+
+
+def revalidated(entry, response, now):
+    """Refresh a cached response after a 304 Not Modified
+
+    Args:
+        entry: cached response - from load()
+        response: the 304 requests.Response object
+        now: timestamp of the response
+
+    Returns:
+        The updated entry
+    """
+    headers = dict(entry["headers"])
+    for name in KEPT_HEADERS:
+        if response.headers.get(name):
+            headers[name] = response.headers[name]
+
+    expires = freshness(CaseInsensitiveDict(headers), now)
+    if expires is None:
+        remove(entry["url"])
+        return entry
+
+    entry = dict(entry, headers=headers, expires=expires, stored=now)
+    _write(entry)
+    return entry
+
+
+def to_response(entry):
+    """Build a 200 requests.Response object from a cached response"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = entry["url"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response._content = entry["content"]
+    return response
+
+
+def remove(url):
+    """Drop the cached response of a URL, if any"""
+    try:
+        os.unlink(entry_path(url))
+    except OSError:
+        pass
+
+
+def _write(entry):
+    """Write an entry to a temporary file and rename it over the old one
+
+    Readers in this or another process see either the old or the new entry,
+    never a partial one. Write errors only mean the response isn't cached.
+    """
+    path = entry_path(entry["url"])
+    header = {
+        key: value for key, value in entry.items() if key not in ("data", "content")
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:
+        return None
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(entry["data"])
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return None
+
+    _account(len(entry["data"]))
+    return None
+
+
+def _account(size):
+    """Count the bytes written and evict entries once enough were added
+
+    The cache directory is scanned on the first write of the process and
+    then every time a tenth of config.http_cache["max_bytes"] has been
+    written, rather than on every write.
+    """
+    with _written_lock:
+        if _written["bytes"] is not None:
+            _written["bytes"] += size
+            if _written["bytes"] < config.http_cache["max_bytes"] // 10:
+                return None
+        _written["bytes"] = 0
+
+    evict()
+    return None
+
+
+def evict(max_bytes=None):
+    """Delete the least recently used entries until the cache fits its size
+
+    Other processes may delete or replace entries at the same time, so
+    missing files are skipped.
+
+    Args:
+        max_bytes: size limit, defaults to config.http_cache["max_bytes"]
+
+    Returns:
+        The number of entries deleted
+    """
+    if max_bytes is None:
+        max_bytes = config.http_cache["max_bytes"]
+
+    entries = []
+    total = 0
+    try:
+        with os.scandir(cache.cache_path(HTTP_DIR)) as scan:
+            for item in scan:
+                try:
+                    stat = item.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+                total += stat.st_size
+    except OSError:
+        return 0
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+
+    return removed
+
+
+def clear():
+    """Delete every cached response
+
+    Returns:
+        None
+    """
+    evict(0)
+    with _written_lock:
+        _written["bytes"] = None
+
+    return None
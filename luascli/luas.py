@@ -1,46 +1,104 @@
 # -*- coding: utf-8 -*-
 
 import click
-import requests
-from luascli.util import xml_to_dict, get_address_by_coordinates
+import threading
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from luascli.util import get_address_by_coordinates, get_cached_address
+from luascli.parser import parse_stops, parse_forecast, parse_fare
+from luascli.records import Stop, timetable_records
+from luascli.spatial import StopGrid
 from luascli.exceptions import (
     LuasStopNotFound,
     LuasLineNotFound,
     LuasStopsNotOnSameLine,
+    LuasCatalogNotFound,
+    LuasServiceUnavailable,
 )
+from urllib.parse import urlsplit
 from xml.parsers.expat import ExpatError
-from luascli import config
+from luascli import cache, config, fares, metrics, singleflight, transport
 
+CATALOG_FILE = "stops.json"
 
-def get_status(stop):
-    """Get the operational status information of a LUAS stop
+_stop_index = {
+    "catalog": None,
+    "stops": {},
+    "records": {},
+    "grid": None,
+    "loaded": 0.0,
+}
+_stop_index_lock = threading.RLock()
+_forecasts = singleflight.Group("forecast")
+
+
+@metrics.instrumented
+def get_forecast(stop, timeout=None):
+    """Get the status message and the timetable of a Luas stop in one request
 
     Args:
         stop: LUAS abbreviated stop name
+        timeout: (connect, read) timeout in seconds of the request, defaults
+            to the timeouts of config.http
 
     Returns:
-        Operational status information
+        A dictionary with the stop name, its abbreviation, the creation
+        timestamp of the forecast, the status message and the inbound/outbound
+        timetable. Concurrent calls for the same stop share one request and one
+        parsed result, which callers must not modify
     """
 
-    ops = requests.get(
-        "https://luasforecasts.rpa.ie/xml/get.ashx?action=forecast&stop="
+    return _forecasts.do(stop.lower(), _fetch_forecast, stop, timeout)
+
+
+def _fetch_forecast(stop, timeout=None):
+    """Download and parse the forecast of a stop
+
+    Args:
+        stop: LUAS abbreviated stop name
+        timeout: (connect, read) timeout in seconds of the request
+
+    Returns:
+        The forecast of the stop - see get_forecast()
+    """
+
+    ops = transport.get(
+        config.forecast_api["url"]
+        + "/xml/get.ashx?action=forecast&stop="
         + stop
-        + "&encrypt=false"
+        + "&encrypt=false",
+        timeout=timeout,
+        hedge=True,
     )
 
     try:
-        doc = xml_to_dict(ops.text)
+        forecast = parse_forecast(ops.text)
     except ExpatError:
-        raise LuasStopNotFound
+        raise LuasStopNotFound(stop)
 
-    try:
-        stop_status = doc["stopInfo"]["message"]
-    except KeyError:
-        raise LuasStopNotFound
+    if forecast is None or forecast["message"] is None or not forecast["timetable"]:
+        raise LuasStopNotFound(stop)
+
+    return forecast
+
+
+@metrics.instrumented
+def get_status(stop):
+    """Get the operational status information of a LUAS stop
+
+    Args:
+        stop: LUAS abbreviated stop name
+
+    Returns:
+        Operational status information
+    """
 
-    return stop_status
+    return get_forecast(stop)["message"]
 
 
+@metrics.instrumented
 def get_timetable(stop):
     """Get the operational timetable of a particular Luas stop
 
@@ -51,44 +109,292 @@ def get_timetable(stop):
         List of inbound/outbound timetable of a particular luas stopp
     """
 
-    timetable = {}
+    return get_forecast(stop)["timetable"]
 
-    ops = requests.get(
-        "https://luasforecasts.rpa.ie/xml/get.ashx?action=forecast&stop="
-        + stop
-        + "&encrypt=false"
-    )
 
-    try:
-        doc = xml_to_dict(ops.text)
-    except ExpatError:
-        raise LuasStopNotFound
+@metrics.instrumented
+def get_timetable_records(stop):
+    """Get the timetable of a Luas stop as Tram records
 
-    try:
-        for direction in doc["stopInfo"]["direction"]:
-            d = direction["@name"].lower()
-            timetable[d] = []
-            if isinstance(direction["tram"], list):
-                for tram in direction["tram"]:
-                    timetable[d].append(
-                        {
-                            "dueMins": tram.get("@dueMins", ""),
-                            "destination": tram.get("@destination", ""),
-                        }
-                    )
-            else:
-                tram = direction["tram"]
-                timetable[d].append(
-                    {
-                        "dueMins": tram.get("@dueMins", ""),
-                        "destination": tram.get("@destination", ""),
-                    }
-                )
-        return timetable
-    except KeyError:
-        raise LuasStopNotFound
+    Args:
+        stop: LUAS abbreviated stop name
+
+    Returns:
+        A dictionary with the list of Tram records of each direction, with
+        the due minutes as integers (DUE is 0)
+    """
+
+    return timetable_records(get_timetable(stop))
+
+
+@metrics.instrumented
+def get_timetables(stops, max_workers=None):
+    """Get the timetable of several Luas stops concurrently
+
+    Args:
+        stops: list of LUAS abbreviated stop names
+        max_workers: maximum number of concurrent requests, defaults to
+            config.concurrency["max_workers"]
+
+    Returns:
+        A list with one dictionary per stop, in the same order as stops, with
+        the keys stop, timetable (None on failure) and error (None on success)
+    """
+
+    def fetch(stop):
+        try:
+            return {"stop": stop, "timetable": get_timetable(stop), "error": None}
+        except Exception as e:
+            return {"stop": stop, "timetable": None, "error": e}
+
+    stops = list(stops)
+    if not stops:
+        return []
+
+    if max_workers is None:
+        max_workers = config.concurrency["max_workers"]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stops))) as executor:
+        return list(executor.map(fetch, stops))
+
+
+@metrics.instrumented
+def get_network(line_name, max_workers=None, deadline=None):
+    """Get the status and the timetable of every stop of a line at once
+
+    The stops come from the catalog and their forecasts are fetched
+    concurrently. Stops that haven't answered when the deadline passes are
+    marked as missed rather than holding up the whole snapshot.
+
+    Args:
+        line_name: LUAS line (red/green)
+        max_workers: maximum number of concurrent requests, defaults to
+            config.network["max_workers"]
+        deadline: seconds to wait for the forecasts, defaults to
+            config.network["deadline"] (None there waits for every stop)
+
+    Returns:
+        A dictionary with the line, the distinct status messages, each with
+        the stops reporting it, and one dictionary per stop in line order
+        with the keys stop, name, timetable (None on failure), error (None
+        on success) and missed (True if the stop missed the deadline)
+    """
+
+    stops = get_stops(line_name)
+    if max_workers is None:
+        max_workers = config.network["max_workers"]
+    if deadline is None:
+        deadline = config.network["deadline"]
+
+    results = [
+        {
+            "stop": stop["abrev"],
+            "name": stop["text"],
+            "timetable": None,
+            "error": None,
+            "missed": False,
+        }
+        for stop in stops
+    ]
+    network = {"line": line_name, "messages": [], "stops": results}
+    if not results:
+        return network
+
+    # daemon threads, so late stops don't keep the process alive once the
+    # snapshot is printed, each request getting the time left as its timeout
+    ends = None if deadline is None else time.monotonic() + deadline
+    pending = deque(range(len(results)))
+    outcomes = {}
+    finished = threading.Condition()
+
+    def fetch():
+        while True:
+            with finished:
+                if not pending:
+                    return
+                index = pending.popleft()
+            timeout = None
+            if ends is not None:
+                timeout = ends - time.monotonic()
+                if timeout <= 0:
+                    return
+                timeout = (timeout, timeout)
+            try:
+                outcome = (get_forecast(results[index]["stop"], timeout), None)
+            except Exception as e:
+                outcome = (None, e)
+            with finished:
+                outcomes[index] = outcome
+                finished.notify_all()
+
+    for _ in range(min(max_workers, len(results))):
+        threading.Thread(target=fetch, daemon=True).start()
+
+    with finished:
+        finished.wait_for(lambda: len(outcomes) == len(results), deadline)
+        outcomes = dict(outcomes)
+
+    messages = {}
+    for index, result in enumerate(results):
+        if index not in outcomes:
+            result["missed"] = True
+            continue
+        forecast, error = outcomes[index]
+        if error is not None:
+            result["error"] = error
+            continue
+        result["timetable"] = forecast["timetable"]
+        messages.setdefault(forecast["message"], []).append(result["stop"])
+
+    network["messages"] = [
+        {"message": message, "stops": stops} for message, stops in messages.items()
+    ]
+    return network
+
+
+@metrics.instrumented
+def get_catalog(refresh=False):
+    """Get the stop catalog of all LUAS lines
+
+    The catalog is read from the local cache while it is younger than
+    config.catalog["ttl"]. In offline mode the cached catalog is used
+    regardless of its age and the network is never touched. Once loaded, the
+    catalog and its stop index are kept in memory until the TTL expires.
+
+    Args:
+        refresh: download the stops feed even if the cached catalog is fresh
+
+    Returns:
+        A dictionary with the list of stops of each line, keyed by the line
+        short name (red/green)
+    """
+    return _load_stop_index(refresh)[0]
+
+
+def get_stop_index():
+    """Get the in-memory index of all LUAS stops
+
+    Returns:
+        A dictionary mapping the lower case abbreviated stop name to a
+        (line short name, stop details) tuple
+    """
+    return _load_stop_index(False)[1]
+
+
+def reset_stop_index():
+    """Drop the in-memory catalog so the next lookup loads it again
+
+    Returns:
+        None
+    """
+    with _stop_index_lock:
+        _stop_index["catalog"] = None
+        _stop_index["stops"] = {}
+        _stop_index["records"] = {}
+        _stop_index["grid"] = None
+        _stop_index["loaded"] = 0.0
+
+    return None
+
+
+def _load_stop_index(refresh, stops_xml=None, download=True):
+    """Load the catalog into memory and index it by abbreviated stop name
+
+    Args:
+        refresh: download the stops feed even if the cached catalog is fresh
+        stops_xml: stops feed already downloaded, e.g. by luascli.aio
+        download: download the stops feed when it is needed
+
+    Returns:
+        A (catalog, stop index) tuple, or None if the stops feed is needed
+        and download is False
+    """
+    with _stop_index_lock:
+        loaded = None if refresh else _loaded_stop_index()
+        if loaded is not None:
+            return loaded
+
+        catalog = _load_catalog(refresh, stops_xml, download)
+        if catalog is None:
+            return None
+
+        _stop_index["stops"] = {
+            stop["abrev"].lower(): (line, stop)
+            for line, stops in catalog.items()
+            for stop in stops
+        }
+        _stop_index["records"] = {}
+        _stop_index["grid"] = None
+        _stop_index["catalog"] = catalog
+        _stop_index["loaded"] = time.time()
+
+        return catalog, _stop_index["stops"]
 
 
+def _loaded_stop_index():
+    """Get the catalog and stop index already in memory, without any I/O
+
+    Returns:
+        A (catalog, stop index) tuple, or None if the catalog isn't loaded
+        or is older than config.catalog["ttl"]
+    """
+    with _stop_index_lock:
+        if _stop_index["catalog"] is not None and (
+            config.catalog["offline"]
+            or time.time() - _stop_index["loaded"] < config.catalog["ttl"]
+        ):
+            return _stop_index["catalog"], _stop_index["stops"]
+
+    return None
+
+
+def _load_catalog(refresh, stops_xml=None, download=True):
+    """Read the catalog from the local cache or download the stops feed
+
+    Args:
+        refresh: download the stops feed even if the cached catalog is fresh
+        stops_xml: stops feed already downloaded, used instead of a request
+        download: download the stops feed when it is needed
+
+    Returns:
+        A dictionary with the list of stops of each line, or None if the
+        stops feed is needed and download is False
+    """
+    offline = config.catalog["offline"]
+
+    if not refresh or offline:
+        catalog = cache.load(CATALOG_FILE, None if offline else config.catalog["ttl"])
+        if catalog is not None:
+            return catalog
+
+    if offline:
+        raise LuasCatalogNotFound
+
+    if stops_xml is None:
+        if not download:
+            return None
+        stops_xml = transport.get(
+            config.forecast_api["url"] + "/xml/get.ashx?action=stops&encrypt=false",
+            hedge=True,
+            revalidate=refresh,
+        ).text
+    lines = parse_stops(stops_xml)
+    catalog = {
+        short_name: lines[line["full_name"]]
+        for short_name, line in config.luas.items()
+        if line["full_name"] in lines
+    }
+
+    # a truncated or empty feed must not replace the cached catalog for a
+    # whole TTL
+    if set(catalog) != set(config.luas) or not all(catalog.values()):
+        raise LuasServiceUnavailable(urlsplit(config.forecast_api["url"]).netloc)
+
+    cache.store(CATALOG_FILE, catalog)
+    return catalog
+
+
+@metrics.instrumented
 def get_stops(line_name):
     """Get the list of stops and their details
 
@@ -99,28 +405,113 @@ def get_stops(line_name):
         A list of LUAS stops of a particular line with their details:
         abbreviated name, full name, park and ride support, cycle and ride support, location (lat/lon).
     """
-    res = requests.get(
-        "https://luasforecasts.rpa.ie/xml/get.ashx?action=stops&encrypt=false"
-    )
-    output = []
-    stops = xml_to_dict(res.text)
-    lines = stops["stops"]["line"]
-    for line in lines:
-        if line["@name"] == config.luas[line_name]["full_name"]:
-            for stop in line["stop"]:
-                output.append(
-                    {
-                        "abrev": stop["@abrev"],
-                        "text": stop["@pronunciation"],
-                        "park_ride": stop["@isParkRide"],
-                        "cycle_ride": stop["@isCycleRide"],
-                        "lat": stop["@lat"],
-                        "lon": stop["@long"],
-                    }
-                )
-    return output
+    if line_name not in config.luas:
+        raise KeyError(line_name)
+
+    return list(get_catalog().get(line_name, []))
+
+
+@metrics.instrumented
+def get_stop_records(line_name):
+    """Get the stops of a line as Stop records
+
+    The records are built once per catalog load and shared between calls.
+    They are kept alongside the stop dictionaries of the catalog, not
+    instead of them - see luascli.records.Stop.
+
+    Args:
+        line_name: LUAS line (red/green)
+
+    Returns:
+        A list of Stop records with float coordinates and bool facilities
+    """
+    if line_name not in config.luas:
+        raise KeyError(line_name)
+
+    catalog = get_catalog()
+    with _stop_index_lock:
+        if _stop_index["catalog"] is not catalog:
+            return [Stop.from_dict(stop) for stop in catalog.get(line_name, [])]
+
+        records = _stop_index["records"].get(line_name)
+        if records is None:
+            records = _stop_index["records"][line_name] = tuple(
+                Stop.from_dict(stop) for stop in catalog.get(line_name, [])
+            )
+
+    return list(records)
 
 
+def get_stop_grid():
+    """Get the spatial index of the stops of every line
+
+    The index is built once per catalog load and shared between calls.
+
+    Returns:
+        A luascli.spatial.StopGrid
+    """
+    catalog = get_catalog()
+    with _stop_index_lock:
+        grid = _stop_index["grid"]
+        if grid is None or _stop_index["catalog"] is not catalog:
+            grid = StopGrid(
+                (
+                    (line, Stop.from_dict(stop))
+                    for line, stops in catalog.items()
+                    for stop in stops
+                ),
+                config.nearest["cell_size"],
+            )
+            if _stop_index["catalog"] is catalog:
+                _stop_index["grid"] = grid
+
+    return grid
+
+
+@metrics.instrumented
+def get_nearest_stops(lat, lon, count=None, max_distance=None):
+    """Get the stops closest to a coordinate, on any line
+
+    Args:
+        lat: latitude in degrees
+        lon: longitude in degrees
+        count: maximum number of stops, defaults to config.nearest["count"]
+        max_distance: ignore stops further than this many metres
+
+    Returns:
+        A list of NearbyStop records (distance in metres, line short name,
+        Stop record), closest first
+    """
+    if count is None:
+        count = config.nearest["count"]
+
+    return get_stop_grid().nearest(lat, lon, count, max_distance)
+
+
+@metrics.instrumented
+def get_nearest_stops_batch(points, count=None, max_distance=None):
+    """Get the stops closest to each of many coordinates
+
+    The spatial index is looked up once for the whole batch.
+
+    Args:
+        points: iterable of (lat, lon) tuples
+        count: maximum number of stops per point, defaults to
+            config.nearest["count"]
+        max_distance: ignore stops further than this many metres
+
+    Returns:
+        A list with the NearbyStop records of each point, in the same order
+        as points - see get_nearest_stops()
+    """
+    if count is None:
+        count = config.nearest["count"]
+
+    grid = get_stop_grid()
+    return [grid.nearest(lat, lon, count, max_distance) for lat, lon in points]
+
+
+@metrics.instrumented
 def get_stop_detail(stop, line_name):
     """Get the details of one
 
@@ -131,12 +522,11 @@ def get_stop_detail(stop, line_name):
     Returns:
         A dictionary with the stop details or None otherwise
     """
-    all_stops = get_stops(line_name)
-    for s in all_stops:
-        if s["abrev"].lower() == stop.lower():
-            return s
+    entry = get_stop_index().get(stop.lower())
+    if entry is None or entry[0] != line_name:
+        raise LuasStopNotFound
 
-    raise LuasStopNotFound
+    return dict(entry[1])
 
 
 def print_stops(stops):
@@ -158,6 +548,103 @@ def print_stops(stops):
     return None
 
 
+def format_timetable(timetable):
+    """Format the inbound/outbound timetable of a stop as lines of text
+
+    Args:
+        timetable: timetable of a stop - from get_timetable()
+
+    Returns:
+        A list of lines, one per direction and one per tram
+    """
+    lines = []
+    for dest in timetable.keys():
+        lines.append(dest.capitalize())
+        for tram in timetable[dest]:
+            lines.append(
+                "\tDestination: " + tram["destination"] + " - Due: " + tram["dueMins"]
+            )
+
+    return lines
+
+
+def format_timetables(results):
+    """Format the timetables of several stops as lines of text
+
+    Args:
+        results: list of timetables - from get_timetables()
+
+    Returns:
+        A list of lines, with a header per stop when there are several stops
+        and an error message for the stops that failed
+    """
+    lines = []
+    for result in results:
+        if len(results) > 1:
+            lines.append(result["stop"].upper())
+        if isinstance(result["error"], LuasStopNotFound):
+            lines.append("The Luas stop " + result["stop"] + " doesn't exist.")
+        elif result["error"] is not None:
+            lines.append(
+                "Couldn't get the timetable of the Luas stop "
+                + result["stop"]
+                + ": "
+                + str(result["error"])
+            )
+        else:
+            lines.extend(format_timetable(result["timetable"]))
+
+    return lines
+
+
+def format_network(network):
+    """Format the snapshot of a line as lines of text
+
+    Args:
+        network: snapshot of a line - from get_network()
+
+    Returns:
+        A list of lines with the status messages, then the timetable or the
+        error of each stop
+    """
+    lines = []
+    for message in network["messages"]:
+        if len(message["stops"]) == len(network["stops"]):
+            lines.append(message["message"] + " (all stops)")
+        else:
+            lines.append(message["message"] + " (" + ", ".join(message["stops"]) + ")")
+
+    for result in network["stops"]:
+        lines.append("")
+        lines.append(result["stop"] + " - " + result["name"])
+        if result["missed"]:
+            lines.append("No forecast before the deadline")
+        elif isinstance(result["error"], LuasStopNotFound):
+            lines.append("No forecast available for this stop")
+        elif result["error"] is not None:
+            lines.append("Couldn't get the forecast: " + str(result["error"]))
+        else:
+            lines.extend(format_timetable(result["timetable"]))
+
+    return lines
+
+
+def print_timetable(timetable):
+    """Print the inbound/outbound timetable of a stop
+
+    Args:
+        timetable: timetable of a stop - from get_timetable()
+
+    Returns:
+        None
+    """
+    for line in format_timetable(timetable):
+        click.echo(line)
+
+    return None
+
+
+@metrics.instrumented
 def get_address(stop):
     """Get the address of a LUAS stop, according to its lat/lon information
     Args:
@@ -174,6 +661,55 @@ def get_address(stop):
     return address
 
 
+@metrics.instrumented
+def precompute_addresses(max_workers=None):
+    """Store the address of every stop of the catalog in the address cache
+
+    Stops that are already cached are skipped, so an interrupted run can be
+    started again. Requests to Nominatim are spread at least
+    config.addresses["min_interval"] seconds apart, across all workers.
+
+    Args:
+        max_workers: maximum number of concurrent requests, defaults to
+            config.addresses["max_workers"]
+
+    Returns:
+        A list with one dictionary per stop, in catalog order, with the keys
+        stop, address (None on failure) and error (None on success)
+    """
+
+    if max_workers is None:
+        max_workers = config.addresses["max_workers"]
+
+    pace = {"next": 0.0}
+    pace_lock = threading.Lock()
+
+    def fetch(stop):
+        try:
+            address = get_cached_address(stop["lat"], stop["lon"])
+            if address is None:
+                with pace_lock:
+                    now = time.monotonic()
+                    wait = pace["next"] - now
+                    pace["next"] = max(pace["next"], now) + (
+                        config.addresses["min_interval"]
+                    )
+                if wait > 0:
+                    time.sleep(wait)
+                address = get_address_by_coordinates(stop["lat"], stop["lon"])
+            return {"stop": stop["abrev"], "address": address, "error": None}
+        except Exception as e:
+            return {"stop": stop["abrev"], "address": None, "error": e}
+
+    stops = [stop for line in get_catalog().values() for stop in line]
+    if not stops:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stops))) as executor:
+        return list(executor.map(fetch, stops))
+
+
+@metrics.instrumented
 def find_line_by_stop(stop):
     """Return the abbreviated name (e.g. gree/red) of the Luas Line
 
@@ -184,13 +720,11 @@ def find_line_by_stop(stop):
         The address of a Luas stop, in dict format
     """
 
-    for line in config.luas.keys():
-        stops = get_stops(line)
-        for s in stops:
-            if s["abrev"].lower() == stop.lower():
-                return line
+    entry = get_stop_index().get(stop.lower())
+    if entry is None:
+        raise LuasLineNotFound
 
-    raise LuasLineNotFound
+    return entry[0]
 
 
 def is_not_valid_stop(stop):
@@ -232,56 +766,327 @@ def are_stops_on_same_line(first_stop, second_stop):
     return False
 
 
-def calculate_fare(begin_journey, end_journey, num_adults=0, num_children=0):
-    """Calculates the fare between two stops
+def resolve_journey(begin_journey, end_journey):
+    """Validate both stops of a journey in one pass over the stop index
 
     Args:
-        stop: stop: LUAS stop abbreviated name
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
 
     Returns:
-        True if stops exists or False otherwise
+        A (line short name, begin stop details, end stop details) tuple
     """
 
-    if (
-        num_adults < 0
-        or not isinstance(num_adults, int)
-        or num_children < 0
-        or not isinstance(num_children, int)
-    ):
-        raise ValueError
+    index = get_stop_index()
 
-    if is_not_valid_stop(begin_journey):
+    begin = index.get(begin_journey.lower())
+    if begin is None:
         raise LuasStopNotFound(begin_journey)
-    elif is_not_valid_stop(end_journey):
+
+    end = index.get(end_journey.lower())
+    if end is None:
         raise LuasStopNotFound(end_journey)
 
-    if are_stops_on_same_line(begin_journey, end_journey):
-
-        response = requests.get(
-            "https://luasforecasts.rpa.ie/xml/get.ashx?action=farecalc&from="
-            + begin_journey
-            + "&to="
-            + end_journey
-            + "&adults="
-            + str(num_adults)
-            + "&children="
-            + str(num_children)
-            + "&encrypt=false"
-        )
-
-        output = {}
-        fare_dict = xml_to_dict(response.text)
-        output["from"] = begin_journey
-        output["to"] = end_journey
-        output["adults"] = num_adults
-        output["children"] = num_children
-        output["fare_peak"] = fare_dict["farecalc"]["result"].get("@peak", "")
-        output["fare_offpeak"] = fare_dict["farecalc"]["result"].get("@offpeak", "")
-        output["zones_travelled"] = fare_dict["farecalc"]["result"].get(
-            "@zonesTravelled", ""
-        )
-
-        return output
-
-    else:
+    if begin[0] != end[0]:
         raise LuasStopsNotOnSameLine(begin_journey, end_journey)
+
+    return begin[0], dict(begin[1]), dict(end[1])
+
+
+@metrics.instrumented
+def get_fare(begin_journey, end_journey, num_adults=0, num_children=0):
+    """Calculates the fare between two stops and resolves their details
+
+    Args:
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        A (fare, begin stop details, end stop details) tuple, where fare is
+        the dictionary returned by calculate_fare()
+    """
+
+    fares.validate_counts(num_adults, num_children)
+    line, begin, end = resolve_journey(begin_journey, end_journey)
+
+    output = {}
+    output["from"] = begin_journey
+    output["to"] = end_journey
+    output["adults"] = num_adults
+    output["children"] = num_children
+
+    fare = fares.lookup_fare(begin_journey, end_journey, num_adults, num_children)
+    if fare is None:
+        if config.catalog["offline"]:
+            raise LuasCatalogNotFound
+        fare = _request_fare(begin_journey, end_journey, num_adults, num_children)
+    output.update(fare)
+
+    return output, begin, end
+
+
+def _request_fare(begin_journey, end_journey, num_adults, num_children):
+    """Ask the fare calculator for the fare of a journey
+
+    Args:
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        A dictionary with the peak/off-peak fares and the zones travelled
+    """
+    response = transport.get(
+        config.forecast_api["url"]
+        + "/xml/get.ashx?action=farecalc&from="
+        + begin_journey
+        + "&to="
+        + end_journey
+        + "&adults="
+        + str(num_adults)
+        + "&children="
+        + str(num_children)
+        + "&encrypt=false"
+    )
+
+    return parse_fare(response.text) or {
+        "fare_peak": "",
+        "fare_offpeak": "",
+        "zones_travelled": "",
+    }
+
+
+def _request_fare_entry(begin_journey, end_journey):
+    """Download the adult and child fares of a stop pair
+
+    Args:
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
+
+    Returns:
+        A fare matrix entry - see luascli.fares.get_fare_matrix()
+    """
+    adult = _request_fare(begin_journey, end_journey, 1, 0)
+    child = _request_fare(begin_journey, end_journey, 0, 1)
+    return [
+        adult["fare_peak"],
+        adult["fare_offpeak"],
+        child["fare_peak"],
+        child["fare_offpeak"],
+        adult["zones_travelled"],
+        time.time(),
+    ]
+
+
+@metrics.instrumented
+def build_fare_matrix(max_workers=None, refresh=False):
+    """Precompute the adult and child fares of every same-line stop pair
+
+    Each pair costs two farecalc requests, one for an adult and one for a
+    child. Progress is saved to the local fare matrix every
+    config.fares["save_every"] pairs and pairs already in the matrix, and not
+    expired, are skipped, so an interrupted build carries on where it
+    stopped.
+
+    Args:
+        max_workers: maximum number of concurrent pairs, defaults to
+            config.fares["max_workers"]
+        refresh: fetch every pair again, even the ones already stored
+
+    Returns:
+        A dictionary with the number of pairs of the catalog and the number
+        of pairs fetched, skipped and failed
+    """
+
+    if max_workers is None:
+        max_workers = config.fares["max_workers"]
+
+    matrix = fares.get_fare_matrix()
+    pairs = {}
+    for stops in get_catalog().values():
+        for first, second in itertools.combinations(stops, 2):
+            pairs[fares.fare_key(first["abrev"], second["abrev"])] = (
+                first["abrev"],
+                second["abrev"],
+            )
+    todo = [key for key in pairs if refresh or not fares.is_fresh(matrix.get(key))]
+
+    summary = {
+        "pairs": len(pairs),
+        "fetched": 0,
+        "skipped": len(pairs) - len(todo),
+        "failed": 0,
+    }
+    if not todo:
+        return summary
+
+    done = {}
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(todo))) as executor:
+            futures = {
+                executor.submit(_request_fare_entry, *pairs[key]): key for key in todo
+            }
+            try:
+                for future in as_completed(futures):
+                    try:
+                        entry = future.result()
+                    except Exception:
+                        summary["failed"] += 1
+                        continue
+                    if "" in entry:
+                        summary["failed"] += 1
+                        continue
+                    done[futures[future]] = entry
+                    summary["fetched"] += 1
+                    if len(done) >= config.fares["save_every"]:
+                        fares.store_fares(done)
+                        done = {}
+            except BaseException:
+                # don't wait for the pairs that haven't started yet
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if done:
+            fares.store_fares(done)
+
+    return summary
+
+
+@metrics.instrumented
+def calculate_fare(begin_journey, end_journey, num_adults=0, num_children=0):
+    """Calculates the fare between two stops
+
+    Args:
+        begin_journey: LUAS stop abbreviated name
+        end_journey: LUAS stop abbreviated name
+        num_adults: number of adults
+        num_children: number of children
+
+    Returns:
+        A dictionary with the peak/off-peak fares and the zones travelled
+    """
+
+    return get_fare(begin_journey, end_journey, num_adults, num_children)[0]
+
+
+@metrics.instrumented
+def calculate_fares(journeys, max_workers=None, window=None):
+    """Calculates the fares of many journeys, streaming the results
+
+    Every journey is validated against the same stop index. Fares come from
+    the fare matrix when possible; otherwise the adult and child fares of
+    the stop pair are fetched once, however many journeys share the pair,
+    and saved to the fare matrix. At most window journeys are held in memory
+    while their fares are being fetched.
+
+    Args:
+        journeys: iterable of (begin stop, end stop, adults, children) tuples
+        max_workers: maximum number of stop pairs fetched at the same time,
+            defaults to config.fares["max_workers"]
+        window: maximum number of journeys waiting for a fare, defaults to
+            config.fares["batch_window"]
+
+    Returns:
+        A generator of dictionaries, one per journey and in the same order,
+        with the keys of calculate_fare() and error (None on success)
+    """
+
+    if max_workers is None:
+        max_workers = config.fares["max_workers"]
+    if window is None:
+        window = config.fares["batch_window"]
+
+    # fail early, not once per journey, when there's no catalog at all
+    get_stop_index()
+    matrix = fares.get_fare_matrix()
+    inflight = {}
+    saved = set()
+    fetched = {}
+    pending = deque()
+
+    def start(journey):
+        begin, end, num_adults, num_children = journey
+        result = {
+            "from": begin,
+            "to": end,
+            "adults": num_adults,
+            "children": num_children,
+            "fare_peak": None,
+            "fare_offpeak": None,
+            "zones_travelled": None,
+            "error": None,
+        }
+        try:
+            fares.validate_counts(num_adults, num_children)
+            resolve_journey(begin, end)
+            key = fares.fare_key(begin, end)
+            entry = matrix.get(key)
+            fare = None
+            if fares.is_fresh(entry):
+                fare = fares.fare_from_entry(entry, num_adults, num_children)
+            if fare is not None:
+                result.update(fare)
+                return result, None, None
+
+            future = inflight.get(key)
+            if future is None:
+                if config.catalog["offline"]:
+                    raise LuasCatalogNotFound
+                future = executor.submit(_request_fare_entry, begin, end)
+                inflight[key] = future
+            return result, key, future
+        except Exception as e:
+            result["error"] = e
+            return result, None, None
+
+    def finish(result, key, future):
+        if future is None:
+            return result
+
+        try:
+            entry = future.result()
+        except Exception as e:
+            result["error"] = e
+            return result
+
+        fare = None
+        if "" not in entry:
+            fare = fares.fare_from_entry(entry, result["adults"], result["children"])
+        if fare is None:
+            result["error"] = ValueError("No fare returned for this journey")
+            return result
+
+        result.update(fare)
+        if key not in saved:
+            saved.add(key)
+            fetched[key] = entry
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for journey in journeys:
+            pending.append(start(journey))
+            while pending and (len(pending) > window or _is_done(pending[0][2])):
+                yield finish(*pending.popleft())
+                if len(fetched) >= config.fares["save_every"]:
+                    fares.store_fares(fetched)
+                    fetched.clear()
+
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        # don't wait for the pairs that haven't started yet
+        for future in inflight.values():
+            future.cancel()
+        executor.shutdown()
+        if fetched:
+            fares.store_fares(fetched)
+
+
+def _is_done(future):
+    """Check if a journey of calculate_fares() can be written out"""
+    return future is None or future.done()
@@ -1,37 +1,162 @@
 # -*- coding: utf-8 -*-
 
 import click
-from luascli.luas import (
-    get_stops,
-    get_stop_detail,
-    get_status,
-    print_stops,
-    get_address,
-    find_line_by_stop,
-    get_timetable,
-    calculate_fare,
-)
 from luascli import config
+from luascli.__version__ import __version__
 from luascli.exceptions import (
     LuasStopNotFound,
     LuasLineNotFound,
     AddressLocationNotFound,
+    LuasCatalogNotFound,
+    LuasStopsNotOnSameLine,
+    LuasBundleInvalid,
 )
 import sys
-import pprint
+
+CATALOG_NOT_FOUND = "No local stop catalog available, run 'luas refresh' while online"
+ADDRESS_NOT_FOUND = (
+    "No local address available, run 'luas refresh' and 'luas address --all' "
+    "while online"
+)
+FARE_NOT_FOUND = (
+    "No local fare available, run 'luas refresh' and 'luas fare-matrix' while online"
+)
 
 
 @click.group()
-@click.version_option()
-def luas():
+@click.version_option(version=__version__)
+@click.option(
+    "--offline",
+    is_flag=True,
+    default=False,
+    help="Use only the local stop catalog and never download it",
+)
+@click.option(
+    "--trace",
+    is_flag=True,
+    default=False,
+    help="Print the HTTP calls, parse times, cache hits and total time to stderr",
+)
+@click.pass_context
+def luas(ctx, offline, trace):
+    config.catalog["offline"] = offline
+
+    from luascli import trace as tracing
+
+    if trace or tracing.enabled():
+        tracing.enable(at_exit=False)
+        ctx.call_on_close(tracing.report)
+
+
+@luas.command()
+def refresh():
+    """Download the stop catalog and store it locally"""
+
+    from luascli.luas import get_catalog
+
+    if config.catalog["offline"]:
+        click.echo("Can't refresh the stop catalog in offline mode")
+        sys.exit(4)
+
+    catalog = get_catalog(refresh=True)
+    count = sum(len(stops) for stops in catalog.values())
+    click.echo("Stop catalog refreshed: " + str(count) + " stops")
+
+
+@luas.group()
+def catalog():
+    """Build, verify and import offline catalog bundles"""
     pass
 
 
+@catalog.command()
+@click.option(
+    "--output",
+    "-o",
+    default="luas-catalog.json.gz",
+    nargs=1,
+    show_default=True,
+    help="Bundle file to write",
+)
+@click.option(
+    "--addresses",
+    is_flag=True,
+    default=False,
+    help="Include the address of every stop",
+)
+@click.option(
+    "--fares",
+    is_flag=True,
+    default=False,
+    help="Include the fare matrix",
+)
+def build(output, addresses, fares):
+    """Snapshot the stop catalog into a bundle file"""
+
+    from luascli.bundle import build_bundle
+
+    try:
+        summary = build_bundle(output, addresses, fares)
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
+
+    click.echo("Catalog bundle written to " + output)
+    print_bundle_summary(summary)
+
+
+@catalog.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def verify(path):
+    """Check that a bundle file is complete and valid"""
+
+    from luascli.bundle import verify_bundle
+
+    try:
+        summary = verify_bundle(path)
+    except LuasBundleInvalid as lbi:
+        click.echo("Invalid catalog bundle " + lbi.path + ": " + lbi.reason)
+        sys.exit(1)
+
+    click.echo("Catalog bundle " + path + " is valid")
+    print_bundle_summary(summary)
+
+
+@catalog.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_(path):
+    """Install a bundle file as the local catalog"""
+
+    from luascli.bundle import import_bundle
+
+    try:
+        summary = import_bundle(path)
+    except LuasBundleInvalid as lbi:
+        click.echo("Invalid catalog bundle " + lbi.path + ": " + lbi.reason)
+        sys.exit(1)
+
+    click.echo("Catalog bundle " + path + " imported")
+    print_bundle_summary(summary)
+
+
+def print_bundle_summary(summary):
+    """Print the content of a bundle - from verify_bundle()"""
+
+    click.echo("Version: " + str(summary["version"]))
+    click.echo("Created: " + summary["created"])
+    for line, count in summary["stops"].items():
+        click.echo(line.capitalize() + " line stops: " + str(count))
+    click.echo("Addresses: " + str(summary["addresses"]))
+    click.echo("Fares: " + str(summary["fares"]))
+
+
 @luas.command()
 @click.argument("line")
 def stops(line):
     """List luas line stop names and its abbreviations (used in other commands)"""
 
+    from luascli.luas import get_stops, print_stops
+
     try:
         s = get_stops(line)
         click.echo("\n" + config.luas[line]["full_name"] + "\n")
@@ -39,12 +164,18 @@ def stops(line):
     except KeyError:
         click.echo("The line " + line + " doesn't exist")
         sys.exit(1)
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
 
 
 @luas.command()
 @click.argument("stop")
 def status(stop):
     """Check if the Luas stop is operational"""
+
+    from luascli.luas import get_status
+
     try:
         click.echo(get_status(stop))
     except LuasStopNotFound:
@@ -55,16 +186,72 @@ def status(stop):
         sys.exit(2)
 
 
+@luas.command(context_settings={"ignore_unknown_options": True})
+@click.argument("lat", type=float)
+@click.argument("lon", type=float)
+@click.option(
+    "--count",
+    "-n",
+    default=config.nearest["count"],
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Number of stops to list",
+)
+@click.option(
+    "--format",
+    "-f",
+    default="text",
+    nargs=1,
+    show_default=True,
+    help="Output format (Valid options: json/text)",
+)
+def nearest(lat, lon, count, format):
+    """List the luas stops closest to a location"""
+
+    import pprint
+    from luascli.luas import get_nearest_stops
+
+    if format not in ("text", "json"):
+        click.echo("Format " + format + " is not valid.")
+        sys.exit(3)
+
+    try:
+        stops = get_nearest_stops(lat, lon, count)
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
+
+    if format == "text":
+        for found in stops:
+            click.echo(
+                "{:>7.0f} m  {:<4} {} ({} line)".format(
+                    found.distance, found.stop.abrev, found.stop.name, found.line
+                )
+            )
+    else:
+        pprint.pprint(
+            [
+                dict(found.stop.as_dict(), line=found.line, distance=found.distance)
+                for found in stops
+            ]
+        )
+
+
 @luas.command()
 @click.argument("stop")
 def map(stop):
     """Launch Openstreet map URL with the stop location"""
 
+    from luascli.luas import find_line_by_stop, get_stop_detail
+
     try:
         line_short_name = find_line_by_stop(stop)
     except LuasLineNotFound:
         click.echo("Couldn't find luas line for the stop " + stop)
         sys.exit(1)
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
 
     try:
         s = get_stop_detail(stop, line_short_name)
@@ -94,10 +281,27 @@ def map(stop):
     show_default=True,
     help="Output format (Valid options: json/text)",
 )
-@click.argument("stop")
-def address(stop, format):
+@click.option(
+    "--all",
+    "all_stops",
+    is_flag=True,
+    default=False,
+    help="Store the address of every stop locally for offline use",
+)
+@click.argument("stop", required=False)
+def address(stop, format, all_stops):
     """Display the address of the Luas stop"""
 
+    import pprint
+    from luascli.luas import get_address
+
+    if all_stops:
+        store_all_addresses()
+        return
+
+    if stop is None:
+        raise click.UsageError("Missing argument 'STOP' (or use --all).")
+
     try:
         address = get_address(stop)
         if format == "text":
@@ -113,6 +317,129 @@ def address(stop, format):
             "Address location not found at lat=" + alnf.lat + "lon=" + alnf.lon + ""
         )
         sys.exit(2)
+    except LuasCatalogNotFound:
+        click.echo(ADDRESS_NOT_FOUND)
+        sys.exit(4)
+
+
+def store_all_addresses():
+    """Fill the local address cache for every stop and report each result"""
+
+    from luascli.luas import precompute_addresses
+
+    if config.catalog["offline"]:
+        click.echo("Can't store addresses in offline mode")
+        sys.exit(4)
+
+    try:
+        results = precompute_addresses()
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
+
+    failed = 0
+    for result in results:
+        if result["error"] is None:
+            click.echo(result["stop"] + ": " + result["address"]["full_address"])
+        elif isinstance(result["error"], AddressLocationNotFound):
+            click.echo(result["stop"] + ": Address location not found")
+            failed += 1
+        else:
+            click.echo(result["stop"] + ": " + str(result["error"]))
+            failed += 1
+
+    click.echo(
+        "Addresses stored: " + str(len(results) - failed) + ", failed: " + str(failed)
+    )
+    if failed:
+        sys.exit(2)
+
+
+@luas.command()
+@click.argument("stops", nargs=-1, required=True)
+@click.option(
+    "--format",
+    "-f",
+    default="text",
+    nargs=1,
+    show_default=True,
+    help="Output format (Valid options: json/text)",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=config.concurrency["max_workers"],
+    nargs=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Maximum number of stops fetched at the same time",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    default=False,
+    help="Keep running and redraw the timetable when it changes",
+)
+@click.option(
+    "--interval",
+    "-i",
+    default=config.watch["interval"],
+    type=click.FloatRange(min=1),
+    show_default=True,
+    help="Seconds between updates in watch mode",
+)
+@click.option(
+    "--max-interval",
+    default=config.watch["max_interval"],
+    type=click.FloatRange(min=1),
+    show_default=True,
+    help="Longest wait between updates while the timetable doesn't change",
+)
+def time(stops, format, workers, watch, interval, max_interval):
+    """Display the the inbound/outbout timetable of one or more luas stops"""
+
+    import pprint
+    from luascli.luas import get_timetables, format_timetables
+    from luascli.watch import watch_timetables
+
+    if format not in ("text", "json"):
+        click.echo("Format " + format + " is not valid.")
+        sys.exit(3)
+
+    if watch:
+        if format != "text":
+            click.echo("Format " + format + " is not valid with --watch.")
+            sys.exit(3)
+        try:
+            watch_timetables(
+                stops,
+                lambda output: click.echo(output, nl=False),
+                interval,
+                max_interval,
+                workers,
+            )
+        except KeyboardInterrupt:
+            pass
+        return
+
+    results = get_timetables(stops, workers)
+    failed = any(result["error"] is not None for result in results)
+    if format == "text":
+        for line in format_timetables(results):
+            click.echo(line)
+    else:
+        # keep stdout to the timetables, so it stays parseable
+        for result in results:
+            if result["error"] is not None:
+                for line in format_timetables([result]):
+                    click.echo(line, err=True)
+
+    timetables = {r["stop"]: r["timetable"] for r in results if r["error"] is None}
+    if format == "json" and timetables:
+        pprint.pprint(timetables[stops[0]] if len(results) == 1 else timetables)
+
+    if failed:
+        sys.exit(1)
 
 
 @luas.command()
@@ -125,34 +452,105 @@ def address(stop, format):
     show_default=True,
     help="Output format (Valid options: json/text)",
 )
-def time(stop, format):
-    """Display the the inbound/outbout timetable of a particualr luas stop"""
+def info(stop, format):
+    """Display the status and the timetable of a luas stop"""
+
+    import pprint
+    from luascli.luas import get_forecast, print_timetable
+
+    if format not in ("text", "json"):
+        click.echo("Format " + format + " is not valid.")
+        sys.exit(3)
 
     try:
-        timetable = get_timetable(stop)
+        forecast = get_forecast(stop)
         if format == "text":
-            for dest in timetable.keys():
-                click.echo(dest.capitalize())
-                for tram in timetable[dest]:
-                    click.echo(
-                        "\tDestination: "
-                        + tram["destination"]
-                        + " - Due: "
-                        + tram["dueMins"]
-                    )
-        elif format == "json":
-            pprint.pprint(timetable)
+            click.echo(forecast["message"])
+            print_timetable(forecast["timetable"])
         else:
-            click.echo("Format " + format + " is not valid.")
-            sys.exit(3)
+            pprint.pprint(forecast)
     except LuasStopNotFound:
         click.echo("The Luas stop " + stop + " doesn't exist.")
         sys.exit(1)
+    except (ConnectionError, TimeoutError):
+        click.echo("Can't connect to " + config.forecast_api["url"])
+        sys.exit(2)
 
 
 @luas.command()
-@click.argument("begin_journey")
-@click.argument("end_journey")
+@click.argument("line")
+@click.option(
+    "--format",
+    "-f",
+    default="text",
+    nargs=1,
+    show_default=True,
+    help="Output format (Valid options: json/text)",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=config.network["max_workers"],
+    nargs=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Maximum number of stops fetched at the same time",
+)
+@click.option(
+    "--deadline",
+    "-d",
+    default=config.network["deadline"],
+    type=click.FloatRange(min=0),
+    show_default=True,
+    help="Seconds to wait for the stops before reporting the late ones as missed",
+)
+def network(line, format, workers, deadline):
+    """Display the status and the timetable of every stop of a luas line"""
+
+    import pprint
+    from luascli.luas import get_network, format_network
+
+    if format not in ("text", "json"):
+        click.echo("Format " + format + " is not valid.")
+        sys.exit(3)
+
+    try:
+        snapshot = get_network(line, workers, deadline)
+    except KeyError:
+        click.echo("The line " + line + " doesn't exist")
+        sys.exit(1)
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND)
+        sys.exit(4)
+    except (ConnectionError, TimeoutError):
+        click.echo("Can't connect to " + config.forecast_api["url"])
+        sys.exit(2)
+
+    if format == "text":
+        click.echo("\n" + config.luas[line]["full_name"] + "\n")
+        for output in format_network(snapshot):
+            click.echo(output)
+    else:
+        pprint.pprint(
+            dict(
+                snapshot,
+                stops=[
+                    dict(
+                        result,
+                        error=None if result["error"] is None else str(result["error"]),
+                    )
+                    for result in snapshot["stops"]
+                ],
+            )
+        )
+
+    if any(r["error"] is not None or r["missed"] for r in snapshot["stops"]):
+        sys.exit(1)
+
+
+@luas.command()
+@click.argument("begin_journey", required=False)
+@click.argument("end_journey", required=False)
 @click.option(
     "--adults", "-a", nargs=1, default=0, show_default=True, help="Number of adults"
 )
@@ -167,13 +565,37 @@ def time(stop, format):
     show_default=True,
     help="Output format (Valid options: json/text)",
 )
-def fare(begin_journey, end_journey, adults, children, format):
+@click.option(
+    "--batch",
+    type=click.File("r"),
+    default=None,
+    help="CSV or NDJSON file of journeys (from, to, adults, children), - for "
+    "stdin. Results are written as CSV, or as NDJSON with -f json",
+)
+@click.option(
+    "--workers",
+    "-w",
+    default=config.fares["max_workers"],
+    nargs=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Maximum number of stop pairs fetched at the same time with --batch",
+)
+def fare(begin_journey, end_journey, adults, children, format, batch, workers):
     """Calculate the fare price for adults and child between stops"""
+
+    import pprint
+    from luascli.luas import get_fare
+
+    if batch is not None:
+        fare_batch(batch, format, workers)
+        return
+
+    if begin_journey is None or end_journey is None:
+        raise click.UsageError("Missing the BEGIN_JOURNEY and END_JOURNEY stops")
+
     try:
-        fare = calculate_fare(begin_journey, end_journey, adults, children)
-        line = find_line_by_stop(begin_journey)
-        s1 = get_stop_detail(begin_journey, line)
-        s2 = get_stop_detail(end_journey, line)
+        fare, s1, s2 = get_fare(begin_journey, end_journey, adults, children)
         if format == "text":
             for key, value in fare.items():
                 if key == "from":
@@ -194,6 +616,133 @@ def fare(begin_journey, end_journey, adults, children, format):
     except LuasStopNotFound as lsnf:
         click.echo("The Luas stop " + lsnf.stop + " doesn't exist.")
         sys.exit(1)
+    except LuasStopsNotOnSameLine as lsnsl:
+        click.echo(
+            "The Luas stops "
+            + lsnsl.first_stop
+            + " and "
+            + lsnsl.second_stop
+            + " are not on the same line."
+        )
+        sys.exit(1)
+    except LuasCatalogNotFound:
+        click.echo(FARE_NOT_FOUND)
+        sys.exit(4)
+    except (ConnectionError, TimeoutError):
+        click.echo("Can't connect to " + config.forecast_api["url"])
+        sys.exit(2)
+
+
+def fare_batch(file, format, workers):
+    """Calculate the fares of the journeys of a file, writing them to stdout"""
+
+    from luascli.batch import read_journeys, write_results
+    from luascli.luas import calculate_fares
+
+    if format not in ("text", "json"):
+        click.echo("Format " + format + " is not valid.")
+        sys.exit(3)
+
+    try:
+        summary = write_results(
+            calculate_fares(read_journeys(file), workers),
+            sys.stdout,
+            "csv" if format == "text" else "ndjson",
+        )
+    except LuasCatalogNotFound:
+        click.echo(CATALOG_NOT_FOUND, err=True)
+        sys.exit(4)
+
+    click.echo(
+        "Journeys: " + str(summary["journeys"]) + ", failed: " + str(summary["failed"]),
+        err=True,
+    )
+    if summary["failed"]:
+        sys.exit(1)
+
+
+@luas.command("fare-matrix")
+@click.option(
+    "--workers",
+    "-w",
+    default=config.fares["max_workers"],
+    nargs=1,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help="Maximum number of stop pairs fetched at the same time",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Fetch the fares of the stop pairs that are already stored",
+)
+def fare_matrix(workers, refresh):
+    """Store the fares between every pair of stops for offline use"""
+
+    from luascli.luas import build_fare_matrix
+
+    if config.catalog["offline"]:
+        click.echo("Can't build the fare matrix in offline mode")
+        sys.exit(4)
+
+    summary = build_fare_matrix(workers, refresh)
+    click.echo(
+        "Stop pairs: "
+        + str(summary["pairs"])
+        + ", fetched: "
+        + str(summary["fetched"])
+        + ", already stored: "
+        + str(summary["skipped"])
+        + ", failed: "
+        + str(summary["failed"])
+    )
+    if summary["failed"]:
+        sys.exit(2)
+
+
+@luas.command()
+@click.option(
+    "--host",
+    default=config.server["host"],
+    nargs=1,
+    show_default=True,
+    help="Address to listen on",
+)
+@click.option(
+    "--port",
+    "-p",
+    default=config.server["port"],
+    nargs=1,
+    show_default=True,
+    help="Port to listen on",
+)
+@click.option(
+    "--metrics",
+    is_flag=True,
+    default=False,
+    help="Collect metrics and serve them on /metrics",
+)
+def serve(host, port, metrics):
+    """Serve stops, status, timetable, fare and address as JSON over HTTP"""
+
+    from luascli.server import make_server
+
+    if metrics:
+        from luascli import metrics as registry
+
+        registry.enable()
+
+    server = make_server(host, port)
+    click.echo(
+        "Serving on http://" + server.server_address[0] + ":" + str(server.server_port)
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    "luascli_calls_total": ("counter", "Calls of the luascli functions"),
+    "luascli_errors_total": ("counter", "Exceptions raised by the luascli functions"),
+    "luascli_call_duration_seconds": (
+        "histogram",
+        "Duration of the luascli function calls",
+    ),
+    "luascli_http_requests_total": ("counter", "HTTP requests sent per endpoint"),
+    "luascli_http_request_duration_seconds": (
+        "histogram",
+        "Duration of the HTTP requests per endpoint",
+    ),
+    "luascli_parse_duration_seconds": ("histogram", "Parse time per document"),
+    "luascli_cache_lookups_total": ("counter", "Cache lookups per cache and result"),
+}
+
+_metrics = {"enabled": False}
+
+
+class Registry:
+    """Thread safe store of labelled counters and histograms
+
+    Counters and histograms are keyed by metric name and a sorted tuple of
+    (label, value) pairs. Histograms use the cumulative BUCKETS upper bounds.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        """Add an observation to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                    "count": 0,
+                    "sum": 0.0,
+                }
+            histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def snapshot(self):
+        """Copy every counter and histogram
+
+        Returns:
+            A dictionary with the counters and the histograms, each a list of
+            {"labels": ..., "value": ...} or {"labels": ..., "buckets": ...,
+            "count": ..., "sum": ...} records keyed by metric name, and the
+            hit ratio of each cache
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: dict(value, buckets=list(value["buckets"]))
+                for key, value in self.histograms.items()
+            }
+
+        result = {"counters": {}, "histograms": {}, "cache_hit_ratio": {}}
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"].setdefault(name, []).append(
+                {"labels": dict(labels), "value": value}
+            )
+
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            result["histograms"].setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "buckets": buckets,
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                }
+            )
+
+        lookups = {}
+        for record in result["counters"].get("luascli_cache_lookups_total", []):
+            hits, total = lookups.get(record["labels"]["cache"], (0, 0))
+            if record["labels"]["result"] == "hit":
+                hits += record["value"]
+            lookups[record["labels"]["cache"]] = (hits, total + record["value"])
+        for cache, (hits, total) in lookups.items():
+            result["cache_hit_ratio"][cache] = hits / total
+
+        return result
+
+    def reset(self):
+        """Drop every counter and histogram"""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+def enabled():
+    """Check if metrics are being collected
+
+    Returns:
+        True if the registry is updated
+    """
+    return _metrics["enabled"]
+
+
+def enable():
+    """Start collecting metrics into the registry
+
+    Returns:
+        None
+    """
+    _metrics["enabled"] = True
+
+    return None
+
+
+def disable():
+    """Stop collecting metrics, keeping the values collected so far
+
+    Returns:
+        None
+    """
+    _metrics["enabled"] = False
+
+    return None
+
+
+def reset():
+    """Set every metric back to zero
+
+    Returns:
+        None
+    """
+    registry.reset()
+
+    return None
+
+
+def endpoint(url):
+    """Get the endpoint name of an upstream URL
+
+    Args:
+        url: full URL of the request
+
+    Returns:
+        The action of get.ashx requests (stops, forecast, farecalc) or the
+        last path segment of other requests (e.g. reverse)
+    """
+    parts = urlsplit(url)
+    action = parse_qs(parts.query).get("action")
+    if action:
+        return action[0]
+
+    return parts.path.rstrip("/").rsplit("/", 1)[-1]
+
+
+def observe_event(kind, fields):
+    """Update the registry from a luascli.trace event
+
+    Args:
+        kind: "http", "parse" or "cache"
+        fields: details of the event
+
+    Returns:
+        None
+    """
+    if kind == "http":
+        labels = {"endpoint": endpoint(fields["url"])}
+        registry.inc(
+            "luascli_http_requests_total", dict(labels, status=str(fields["status"]))
+        )
+        registry.observe(
+            "luascli_http_request_duration_seconds", labels, fields["duration"]
+        )
+    elif kind == "parse":
+        registry.observe(
+            "luascli_parse_duration_seconds",
+            {"document": fields["name"]},
+            fields["duration"],
+        )
+    elif kind == "cache":
+        registry.inc(
+            "luascli_cache_lookups_total",
+            {"cache": fields["name"], "result": fields["result"]},
+        )
+
+    return None
+
+
+def instrumented(func):
+    """Count the calls, errors and duration of a function
+
+    Errors are counted by exception class name, e.g. LuasStopNotFound.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _metrics["enabled"]:
+            return func(*args, **kwargs)
+
+        labels = {"function": func.__name__}
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            registry.inc(
+                "luascli_errors_total", dict(labels, exception=type(e).__name__)
+            )
+            raise
+        finally:
+            registry.inc("luascli_calls_total", labels)
+            registry.observe(
+                "luascli_call_duration_seconds", labels, time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+def snapshot():
+    """Get the current value of every metric
+
+    Returns:
+        A JSON serialisable dictionary - see Registry.snapshot()
+    """
+    return registry.snapshot()
+
+
+def to_json():
+    """Format the current value of every metric as a JSON document
+
+    Returns:
+        A JSON string
+    """
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+
+def _format_labels(labels):
+    """Format labels as {name="value",...} for the Prometheus text format"""
+    if not labels:
+        return ""
+
+    return (
+        "{"
+        + ",".join(
+            name
+            + '="'
+            + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            + '"'
+            for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def to_prometheus():
+    """Format the current value of every metric in the Prometheus text format
+
+    Returns:
+        A string in the Prometheus exposition format, version 0.0.4
+    """
+    data = snapshot()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        records = data["counters" if kind == "counter" else "histograms"].get(name)
+        if not records:
+            continue
+
+        lines.append("# HELP " + name + " " + description)
+        lines.append("# TYPE " + name + " " + kind)
+        for record in records:
+            if kind == "counter":
+                lines.append(
+                    name + _format_labels(record["labels"]) + " " + str(record["value"])
+                )
+                continue
+
+            for bound, count in record["buckets"].items():
+                labels = dict(record["labels"], le=bound)
+                lines.append(
+                    name + "_bucket" + _format_labels(labels) + " " + str(count)
+                )
+            labels = _format_labels(record["labels"])
+            lines.append(name + "_sum" + labels + " " + repr(record["sum"]))
+            lines.append(name + "_count" + labels + " " + str(record["count"]))
+
+    return "\n".join(lines) + "\n"
+
+
+if os.environ.get("LUASCLI_METRICS", "") not in ("", "0"):
+    enable()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+from xml.parsers.expat import ParserCreate
+from luascli import trace
+
+
+def _parse(xmldata, start, end=None, text=None):
+    """Run an expat parser over a document with the given handlers
+
+    Args:
+        xmldata: xml string
+        start: handler called with (name, attributes) for each element
+        end: handler called with the name of each closed element
+        text: handler called with each chunk of character data
+
+    Returns:
+        None
+    """
+    parser = ParserCreate()
+    parser.StartElementHandler = start
+    if end is not None:
+        parser.EndElementHandler = end
+    if text is not None:
+        parser.CharacterDataHandler = text
+    parser.Parse(xmldata, True)
+
+    return None
+
+
+@trace.timed("parse", "stops")
+def parse_stops(xmldata):
+    """Parse the stops feed (action=stops) straight into stop records
+
+    Args:
+        xmldata: xml string
+
+    Returns:
+        A dictionary with the list of stops of each line, keyed by the line
+        full name (e.g. Luas Red Line)
+    """
+    lines = {}
+    state = {"stops": None}
+
+    def start(name, attrs):
+        if name == "line":
+            state["stops"] = lines.setdefault(attrs.get("name", ""), [])
+        elif name == "stop" and state["stops"] is not None:
+            state["stops"].append(
+                {
+                    "abrev": attrs.get("abrev", ""),
+                    "text": attrs.get("pronunciation", ""),
+                    "park_ride": attrs.get("isParkRide", ""),
+                    "cycle_ride": attrs.get("isCycleRide", ""),
+                    "lat": attrs.get("lat", ""),
+                    "lon": attrs.get("long", ""),
+                }
+            )
+
+    def end(name):
+        if name == "line":
+            state["stops"] = None
+
+    _parse(xmldata, start, end)
+    return lines
+
+
+@trace.timed("parse", "forecast")
+def parse_forecast(xmldata):
+    """Parse the forecast feed (action=forecast) of one stop
+
+    A direction with a single tram yields a list of one tram, the same as a
+    direction with many trams.
+
+    Args:
+        xmldata: xml string
+
+    Returns:
+        A dictionary with the stop name, its abbreviation, the creation
+        timestamp, the status message (None when missing) and the timetable
+        of each direction, or None if the document is not a stop forecast
+    """
+    forecast = {}
+    state = {"trams": None, "message": None}
+
+    def start(name, attrs):
+        if name == "stopInfo" and not forecast:
+            forecast["stop"] = attrs.get("stop", "")
+            forecast["stop_abrev"] = attrs.get("stopAbv", "")
+            forecast["created"] = attrs.get("created", "")
+            forecast["message"] = None
+            forecast["timetable"] = {}
+        elif not forecast:
+            return
+        elif name == "message":
+            state["message"] = []
+        elif name == "direction":
+            state["trams"] = forecast["timetable"].setdefault(
+                attrs.get("name", "").lower(), []
+            )
+        elif name == "tram" and state["trams"] is not None:
+            state["trams"].append(
+                {
+                    "dueMins": attrs.get("dueMins", ""),
+                    "destination": attrs.get("destination", ""),
+                }
+            )
+
+    def end(name):
+        if name == "message" and state["message"] is not None:
+            forecast["message"] = "".join(state["message"]).strip()
+            state["message"] = None
+        elif name == "direction":
+            state["trams"] = None
+
+    def text(data):
+        if state["message"] is not None:
+            state["message"].append(data)
+
+    _parse(xmldata, start, end, text)
+    return forecast or None
+
+
+@trace.timed("parse", "farecalc")
+def parse_fare(xmldata):
+    """Parse the fare calculator feed (action=farecalc)
+
+    Args:
+        xmldata: xml string
+
+    Returns:
+        A dictionary with the peak and off-peak fares and the zones travelled,
+        or None if the document has no result
+    """
+    result = {}
+
+    def start(name, attrs):
+        if name == "result" and not result:
+            result["fare_peak"] = attrs.get("peak", "")
+            result["fare_offpeak"] = attrs.get("offpeak", "")
+            result["zones_travelled"] = attrs.get("zonesTravelled", "")
+
+    _parse(xmldata, start)
+    return result or None
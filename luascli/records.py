@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+from typing import NamedTuple, Optional
+
+
+def _parse_flag(value):
+    """Convert an isParkRide/isCycleRide attribute ("0"/"1") to a bool"""
+    return value not in ("", "0", 0, False, None)
+
+
+def _parse_float(value):
+    """Convert a coordinate attribute to a float, 0.0 when it is missing"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _parse_due(value):
+    """Convert a dueMins attribute to minutes: DUE is 0, unknown is None"""
+    if value == "DUE":
+        return 0
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Stop(NamedTuple):
+    """A Luas stop with parsed fields
+
+    Records are immutable tuples that can be sorted or compared directly.
+    They are a parsed view of the catalog: the stop dictionaries stay the
+    cached form, as their exact coordinate strings key the address cache and
+    the reverse geocoding requests, which as_dict() can't always give back
+    (e.g. "53.28579800" reads as 53.285798).
+    """
+
+    abrev: str
+    name: str
+    park_ride: bool
+    cycle_ride: bool
+    lat: float
+    lon: float
+
+    @classmethod
+    def from_dict(cls, stop):
+        """Create a record from a stop dictionary of get_stops()"""
+        return cls(
+            stop.get("abrev", ""),
+            stop.get("text", ""),
+            _parse_flag(stop.get("park_ride")),
+            _parse_flag(stop.get("cycle_ride")),
+            _parse_float(stop.get("lat")),
+            _parse_float(stop.get("lon")),
+        )
+
+    def as_dict(self):
+        """Get the stop in the dictionary shape of get_stops()
+
+        The flags are "1"/"0" and the coordinates the shortest string that
+        reads back as the same float, e.g. "53.34835".
+        """
+        return {
+            "abrev": self.abrev,
+            "text": self.name,
+            "park_ride": "1" if self.park_ride else "0",
+            "cycle_ride": "1" if self.cycle_ride else "0",
+            "lat": repr(self.lat),
+            "lon": repr(self.lon),
+        }
+
+
+class Tram(NamedTuple):
+    """A tram of a forecast, ordered by due minutes
+
+    due is 0 for a tram announced as DUE and None when the feed has no
+    usable value. Trams without a due time sort after the others.
+    """
+
+    due: Optional[int]
+    destination: str
+
+    def sort_key(self):
+        """Get the key trams are ordered by, unknown due times last"""
+        return (self.due is None, self.due or 0, self.destination)
+
+    def __lt__(self, other):
+        if not isinstance(other, Tram):
+            return NotImplemented
+        return self.sort_key() < other.sort_key()
+
+    def __le__(self, other):
+        if not isinstance(other, Tram):
+            return NotImplemented
+        return self.sort_key() <= other.sort_key()
+
+    def __gt__(self, other):
+        if not isinstance(other, Tram):
+            return NotImplemented
+        return self.sort_key() > other.sort_key()
+
+    def __ge__(self, other):
+        if not isinstance(other, Tram):
+            return NotImplemented
+        return self.sort_key() >= other.sort_key()
+
+    @classmethod
+    def from_dict(cls, tram):
+        """Create a record from a tram dictionary of get_timetable()"""
+        return cls(_parse_due(tram.get("dueMins")), tram.get("destination", ""))
+
+    def as_dict(self):
+        """Get the tram in the dictionary shape of get_timetable()"""
+        if self.due is None:
+            due = ""
+        elif self.due == 0:
+            due = "DUE"
+        else:
+            due = str(self.due)
+
+        return {"dueMins": due, "destination": self.destination}
+
+
+class NearbyStop(NamedTuple):
+    """A stop found near a coordinate, ordered by distance"""
+
+    distance: float
+    line: str
+    stop: Stop
+
+
+def stop_records(stops):
+    """Convert stop dictionaries to Stop records
+
+    Args:
+        stops: list of stop dictionaries - see luascli.luas.get_stops()
+
+    Returns:
+        A list of Stop records, in the same order
+    """
+    return [Stop.from_dict(stop) for stop in stops]
+
+
+def timetable_records(timetable):
+    """Convert a timetable of tram dictionaries to Tram records
+
+    Args:
+        timetable: dictionary of tram lists keyed by direction - see
+            luascli.luas.get_timetable()
+
+    Returns:
+        A dictionary with the list of Tram records of each direction
+    """
+    return {
+        direction: [Tram.from_dict(tram) for tram in trams]
+        for direction, trams in timetable.items()
+    }
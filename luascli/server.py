@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs, unquote
+from luascli import config, luas, metrics
+from luascli.exceptions import (
+    LuasStopNotFound,
+    LuasLineNotFound,
+    LuasStopsNotOnSameLine,
+    AddressLocationNotFound,
+    LuasCatalogNotFound,
+    LuasServiceUnavailable,
+)
+
+
+class TTLCache:
+    """Thread safe cache of function results that expire after a while
+
+    The cache holds at most config.server["max_entries"] results and drops
+    the oldest ones first. Failed calls are never cached.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or config.server["max_entries"]
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, ttl, func, *args):
+        """Return the cached result of func(*args) or call it
+
+        Args:
+            key: cache key
+            ttl: seconds the result stays valid
+            func: function to call on a miss
+            args: positional arguments of func
+
+        Returns:
+            The return value of func
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        value = func(*args)
+
+        with self.lock:
+            self.entries[key] = (now + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return value
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the socketserver backlog of 5 makes bursts of clients wait for a SYN
+    # retry, about a second
+    request_queue_size = 128
+
+
+class LuasRequestHandler(BaseHTTPRequestHandler):
+    """Answer the JSON endpoints of luas serve
+
+    GET /stops/<line>
+    GET /forecast/<stop>
+    GET /status/<stop>
+    GET /timetable/<stop>
+    GET /address/<stop>
+    GET /fare?from=<stop>&to=<stop>&adults=<n>&children=<n>
+    GET /nearest?lat=<lat>&lon=<lon>&n=<count>
+    GET /metrics[?format=json], when luascli.metrics is enabled
+    """
+
+    cache = TTLCache()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        try:
+            if len(parts) == 2 and parts[0] in ("forecast", "status", "timetable"):
+                forecast = self.get_forecast(parts[1])
+                if parts[0] == "forecast":
+                    self.send_json(200, forecast)
+                elif parts[0] == "status":
+                    self.send_json(200, {"message": forecast["message"]})
+                else:
+                    self.send_json(200, forecast["timetable"])
+            elif len(parts) == 2 and parts[0] == "stops":
+                self.send_json(200, luas.get_stops(parts[1].lower()))
+            elif len(parts) == 2 and parts[0] == "address":
+                self.send_json(200, luas.get_address(parts[1]))
+            elif len(parts) == 1 and parts[0] == "fare":
+                self.send_json(200, self.get_fare(query))
+            elif len(parts) == 1 and parts[0] == "nearest":
+                self.send_json(200, self.get_nearest(query))
+            elif parts == ["metrics"] and metrics.enabled():
+                if query.get("format") == "json":
+                    self.send_json(200, metrics.snapshot())
+                else:
+                    self.send_text(200, metrics.to_prometheus())
+            else:
+                self.send_json(404, {"error": "Unknown endpoint " + url.path})
+        except (LuasStopNotFound, LuasLineNotFound, KeyError):
+            self.send_json(404, {"error": "Stop or line not found"})
+        except LuasStopsNotOnSameLine:
+            self.send_json(400, {"error": "The stops are not on the same line"})
+        except ValueError:
+            self.send_json(400, {"error": "Invalid parameters"})
+        except AddressLocationNotFound:
+            self.send_json(404, {"error": "Address location not found"})
+        except LuasCatalogNotFound:
+            self.send_json(503, {"error": "Not available offline"})
+        except LuasServiceUnavailable as e:
+            self.send_json(503, {"error": "Upstream unavailable: " + e.host})
+        except Exception as e:
+            self.send_json(502, {"error": "Upstream error: " + str(e)})
+
+    def get_forecast(self, stop):
+        """Get the forecast of a stop, cached for config.server["forecast_ttl"]"""
+        return self.cache.get(
+            ("forecast", stop.lower()),
+            config.server["forecast_ttl"],
+            luas.get_forecast,
+            stop,
+        )
+
+    def get_fare(self, query):
+        """Get a fare from the query string, cached for config.server["fare_ttl"]"""
+        if "from" not in query or "to" not in query:
+            raise ValueError
+
+        begin = query["from"]
+        end = query["to"]
+        adults = int(query.get("adults", "0"))
+        children = int(query.get("children", "0"))
+
+        return self.cache.get(
+            ("fare", begin.lower(), end.lower(), adults, children),
+            config.server["fare_ttl"],
+            luas.calculate_fare,
+            begin,
+            end,
+            adults,
+            children,
+        )
+
+    def get_nearest(self, query):
+        """Get the stops closest to the lat/lon of the query string"""
+        if "lat" not in query or "lon" not in query:
+            raise ValueError
+
+        count = int(query.get("n", config.nearest["count"]))
+        if count < 1:
+            raise ValueError
+
+        return [
+            dict(found.stop.as_dict(), line=found.line, distance=found.distance)
+            for found in luas.get_nearest_stops(
+                float(query["lat"]), float(query["lon"]), count
+            )
+        ]
+
+    def send_json(self, status, data):
+        """Send data as a JSON response"""
+        self.send_body(status, "application/json", json.dumps(data))
+
+    def send_text(self, status, text):
+        """Send text in the Prometheus exposition format"""
+        self.send_body(status, "text/plain; version=0.0.4; charset=utf-8", text)
+
+    def send_body(self, status, content_type, text):
+        """Send a response with the given content type"""
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host=None, port=None):
+    """Create the HTTP server of luas serve
+
+    Args:
+        host: address to listen on, defaults to config.server["host"]
+        port: port to listen on, defaults to config.server["port"]
+
+    Returns:
+        A ThreadingHTTPServer, not started yet
+    """
+    if host is None:
+        host = config.server["host"]
+    if port is None:
+        port = config.server["port"]
+
+    return ThreadingHTTPServer((host, port), LuasRequestHandler)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+class _Call:
+    """One in-flight call and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Group:
+    """Coalesce concurrent calls that share a key into a single call
+
+    While a call for a key is running, other callers with the same key wait
+    for it and receive its result (or its exception) instead of running the
+    function again. Results are not kept once the call has finished.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "executed": 0, "deduplicated": 0}
+        with _groups_lock:
+            _groups[name] = self
+
+    def do(self, key, func, *args):
+        """Run func(*args) unless a call with the same key is in flight
+
+        Args:
+            key: hashable key identifying the call
+            func: function to call
+            args: positional arguments of func
+
+        Returns:
+            The return value of func, shared by every coalesced caller
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.counters["executed"] += 1
+            else:
+                self.counters["deduplicated"] += 1
+
+        if leader:
+            try:
+                call.value = func(*args)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+
+        return call.value
+
+    def reset(self):
+        """Set the counters back to zero"""
+        with self.lock:
+            for counter in self.counters:
+                self.counters[counter] = 0
+
+
+def stats():
+    """Get the counters of every single-flight group
+
+    Returns:
+        A dictionary keyed by group name with the number of calls, of calls
+        actually executed and of calls that shared another call's result
+    """
+    with _groups_lock:
+        groups = list(_groups.values())
+
+    result = {}
+    for group in groups:
+        with group.lock:
+            result[group.name] = dict(group.counters)
+
+    return result
+
+
+def reset_stats():
+    """Set the counters of every single-flight group back to zero
+
+    Returns:
+        None
+    """
+    with _groups_lock:
+        groups = list(_groups.values())
+
+    for group in groups:
+        group.reset()
+
+    return None
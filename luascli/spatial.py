@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import math
+from luascli.records import NearbyStop
+
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Get the great-circle distance between two coordinates
+
+    Args:
+        lat1: latitude of the first point, in degrees
+        lon1: longitude of the first point, in degrees
+        lat2: latitude of the second point, in degrees
+        lon2: longitude of the second point, in degrees
+
+    Returns:
+        The distance in metres
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StopGrid:
+    """Spatial index of stops on a regular latitude/longitude grid
+
+    Stops are bucketed in square cells of cell_size degrees. A query scans
+    the cells around the point ring by ring and stops as soon as no stop in
+    an unscanned cell can be closer than the k-th stop found, so it only
+    computes the distance of the stops near the point.
+
+    Args:
+        stops: iterable of (line short name, Stop record) tuples
+        cell_size: size of a cell in degrees
+    """
+
+    def __init__(self, stops, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.size = 0
+        for line, stop in stops:
+            # radians and cosine are computed once per stop, not per query
+            entry = (
+                math.radians(stop.lat),
+                math.radians(stop.lon),
+                math.cos(math.radians(stop.lat)),
+                line,
+                stop,
+            )
+            self.cells.setdefault(self.cell(stop.lat, stop.lon), []).append(entry)
+            self.size += 1
+
+        rows = [row for row, _ in self.cells] or [0]
+        columns = [column for _, column in self.cells] or [0]
+        self.bounds = (min(rows), max(rows), min(columns), max(columns))
+
+    def cell(self, lat, lon):
+        """Get the (row, column) of the cell holding a coordinate"""
+        return (
+            int(math.floor(lat / self.cell_size)),
+            int(math.floor(lon / self.cell_size)),
+        )
+
+    def nearest(self, lat, lon, k=1, max_distance=None):
+        """Find the stops closest to a coordinate
+
+        Args:
+            lat: latitude in degrees
+            lon: longitude in degrees
+            k: maximum number of stops to return
+            max_distance: ignore stops further than this many metres
+
+        Returns:
+            A list of up to k NearbyStop records, closest first
+        """
+        if k <= 0 or not self.size:
+            return []
+
+        phi = math.radians(lat)
+        lam = math.radians(lon)
+        cos_phi = math.cos(phi)
+        row, column = self.cell(lat, lon)
+        min_row, max_row, min_column, max_column = self.bounds
+        ring = max(
+            0, min_row - row, row - max_row, min_column - column, column - max_column
+        )
+        last_ring = max(
+            abs(row - min_row),
+            abs(row - max_row),
+            abs(column - min_column),
+            abs(column - max_column),
+        )
+
+        # max-heap of the k closest (negated distance, tie breaker, entry)
+        found = []
+        while ring <= last_ring:
+            for cell in self._ring(row, column, ring):
+                for entry in self.cells.get(cell, ()):
+                    a = (
+                        math.sin((entry[0] - phi) / 2) ** 2
+                        + cos_phi * entry[2] * math.sin((entry[1] - lam) / 2) ** 2
+                    )
+                    distance = 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+                    if max_distance is not None and distance > max_distance:
+                        continue
+                    item = (-distance, -id(entry), entry)
+                    if len(found) < k:
+                        heapq.heappush(found, item)
+                    elif distance < -found[0][0]:
+                        heapq.heapreplace(found, item)
+
+            bound = self._bound(lat, lon, row, column, ring)
+            if max_distance is not None and bound > max_distance:
+                break
+            if len(found) == k and -found[0][0] <= bound:
+                break
+            ring += 1
+
+        return [
+            NearbyStop(-distance, entry[3], entry[4])
+            for distance, _, entry in sorted(found, reverse=True)
+        ]
+
+    def _ring(self, row, column, ring):
+        """Get the cells of the grid at Chebyshev distance ring from a cell"""
+        if ring == 0:
+            return [(row, column)]
+
+        min_row, max_row, min_column, max_column = self.bounds
+        first_column = max(column - ring, min_column)
+        last_column = min(column + ring, max_column)
+        first_row = max(row - ring + 1, min_row)
+        last_row = min(row + ring - 1, max_row)
+
+        cells = []
+        for edge in (row - ring, row + ring):
+            if min_row <= edge <= max_row:
+                cells.extend((edge, c) for c in range(first_column, last_column + 1))
+        for edge in (column - ring, column + ring):
+            if min_column <= edge <= max_column:
+                cells.extend((r, edge) for r in range(first_row, last_row + 1))
+        return cells
+
+    def _bound(self, lat, lon, row, column, ring):
+        """Get how far the closest stop outside the scanned rings can be
+
+        The scanned rings form a square of cells around the point; any other
+        stop is at least as far as the closest side of that square. A degree
+        of longitude shrinks towards the poles, so its length is taken at the
+        latitude of the square closest to a pole, and the result is lowered
+        by 1% as a great circle is a little shorter than a parallel.
+
+        Returns:
+            A distance in metres
+        """
+        size = self.cell_size
+        lat_gap = min(lat - (row - ring) * size, (row + ring + 1) * size - lat)
+        lon_gap = min(lon - (column - ring) * size, (column + ring + 1) * size - lon)
+        furthest = min(89.9, abs(lat) + (ring + 1) * size)
+
+        return (
+            0.99
+            * METRES_PER_DEGREE
+            * min(lat_gap, lon_gap * math.cos(math.radians(furthest)))
+        )
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+from luascli import metrics
+
+_trace = {
+    "enabled": False,
+    "start": 0.0,
+    "events": [],
+    "registered": False,
+}
+_trace_lock = threading.Lock()
+
+
+def enabled():
+    """Check if the calls are being traced
+
+    Returns:
+        True if trace events are recorded
+    """
+    return _trace["enabled"]
+
+
+def active():
+    """Check if events are being recorded, for the trace or for the metrics
+
+    Returns:
+        True if record() does anything
+    """
+    return _trace["enabled"] or metrics.enabled()
+
+
+def enable(at_exit=True):
+    """Start recording trace events, forgetting any previous ones
+
+    Args:
+        at_exit: print the report to stderr when the interpreter exits
+
+    Returns:
+        None
+    """
+    with _trace_lock:
+        _trace["enabled"] = True
+        _trace["start"] = time.perf_counter()
+        _trace["events"] = []
+        if at_exit and not _trace["registered"]:
+            atexit.register(report)
+            _trace["registered"] = True
+
+    return None
+
+
+def disable():
+    """Stop recording trace events and forget the recorded ones
+
+    Returns:
+        None
+    """
+    with _trace_lock:
+        _trace["enabled"] = False
+        _trace["events"] = []
+
+    return None
+
+
+def record(kind, **fields):
+    """Record a trace event, if tracing is enabled
+
+    The event also updates luascli.metrics when metrics are enabled.
+
+    Args:
+        kind: "http", "parse" or "cache"
+        fields: details of the event (url, status, bytes, duration, ...)
+
+    Returns:
+        None
+    """
+    if metrics.enabled():
+        metrics.observe_event(kind, fields)
+
+    if not _trace["enabled"]:
+        return None
+
+    fields["kind"] = kind
+    fields["at"] = time.perf_counter() - _trace["start"]
+    with _trace_lock:
+        _trace["events"].append(fields)
+
+    return None
+
+
+def timed(kind, name):
+    """Decorate a function taking a document so each call is traced
+
+    Args:
+        kind: kind of the recorded event
+        name: name of the document, e.g. stops
+
+    Returns:
+        A decorator
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(data, *args, **kwargs):
+            if not active():
+                return func(data, *args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(data, *args, **kwargs)
+            finally:
+                record(
+                    kind,
+                    name=name,
+                    bytes=len(data),
+                    duration=time.perf_counter() - start,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def get_events():
+    """Get the recorded trace events
+
+    Returns:
+        A list of dictionaries with the kind, the time since tracing started
+        ("at", in seconds) and the details of each event
+    """
+    with _trace_lock:
+        return [dict(event) for event in _trace["events"]]
+
+
+def format_report():
+    """Format the recorded events and the totals of each kind
+
+    Returns:
+        A list of lines
+    """
+    with _trace_lock:
+        events = list(_trace["events"])
+        total = time.perf_counter() - _trace["start"]
+
+    lines = []
+    http = {"count": 0, "bytes": 0, "duration": 0.0}
+    parse = {"count": 0, "duration": 0.0}
+    hits = {"hit": 0, "miss": 0}
+    for event in events:
+        prefix = "trace: {:>9.1f} ms  {:<6}".format(event["at"] * 1000, event["kind"])
+        if event["kind"] == "http":
+            http["count"] += 1
+            http["bytes"] += event["bytes"]
+            http["duration"] += event["duration"]
+            lines.append(
+                prefix
+                + "{} {} {} bytes {:.1f} ms".format(
+                    event["status"],
+                    event["url"],
+                    event["bytes"],
+                    event["duration"] * 1000,
+                )
+            )
+        elif event["kind"] == "parse":
+            parse["count"] += 1
+            parse["duration"] += event["duration"]
+            lines.append(
+                prefix
+                + "{} {} bytes {:.1f} ms".format(
+                    event["name"], event["bytes"], event["duration"] * 1000
+                )
+            )
+        else:
+            hits[event["result"]] = hits.get(event["result"], 0) + 1
+            lines.append(
+                prefix + "{} {} {}".format(event["result"], event["name"], event["key"])
+            )
+
+    lines.append(
+        "trace: http {} calls, {} bytes, {:.1f} ms".format(
+            http["count"], http["bytes"], http["duration"] * 1000
+        )
+    )
+    lines.append(
+        "trace: parse {} documents, {:.1f} ms".format(
+            parse["count"], parse["duration"] * 1000
+        )
+    )
+    lines.append(
+        "trace: cache {} hits, {} misses".format(
+            hits["hit"], sum(n for result, n in hits.items() if result != "hit")
+        )
+    )
+    lines.append("trace: total {:.1f} ms".format(total * 1000))
+
+    return lines
+
+
+def report(file=None):
+    """Print the trace report and stop tracing
+
+    Args:
+        file: file object to print to, defaults to sys.stderr
+
+    Returns:
+        None
+    """
+    if not _trace["enabled"]:
+        return None
+
+    lines = format_report()
+    disable()
+    print("\n".join(lines), file=file or sys.stderr)
+
+    return None
+
+
+if os.environ.get("LUASCLI_TRACE", "") not in ("", "0"):
+    enable()
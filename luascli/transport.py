@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import random
+import requests
+import threading
+import time
+from collections import OrderedDict, deque
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from luascli import config, httpcache, singleflight, trace
+from luascli.__version__ import __version__
+from luascli.exceptions import LuasServiceUnavailable
+
+_session = {"session": None}
+_session_lock = threading.Lock()
+_requests = singleflight.Group("http")
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_last_good = OrderedDict()
+_last_good_lock = threading.Lock()
+
+_latencies = {}
+_hedges = {"requests": 0, "hedged": 0, "won": 0}
+_hedges_lock = threading.Lock()
+
+
+def get_session():
+    """Get the HTTP session shared by every outbound call
+
+    The session keeps a pool of keep-alive connections per host, sized by
+    config.http["pool_connections"] and config.http["pool_size"], so repeated
+    calls to the same API reuse the TCP/TLS connection.
+
+    Returns:
+        A requests.Session object
+    """
+    with _session_lock:
+        if _session["session"] is None:
+            adapter = HTTPAdapter(
+                pool_connections=config.http["pool_connections"],
+                pool_maxsize=config.http["pool_size"],
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(
+                {
+                    "Accept-Encoding": "gzip, deflate",
+                    "User-Agent": "luascli/" + __version__,
+                }
+            )
+            _session["session"] = session
+
+        return _session["session"]
+
+
+def close_session():
+    """Close the shared HTTP session and its connection pool
+
+    Returns:
+        None
+    """
+    with _session_lock:
+        if _session["session"] is not None:
+            _session["session"].close()
+            _session["session"] = None
+
+    return None
+
+
+def get(url, timeout=None, hedge=False, revalidate=False):
+    """Send a GET request through the shared HTTP session
+
+    Concurrent requests for the same URL share one in-flight request and its
+    response, see luascli.singleflight.stats(). Responses are kept in the
+    on-disk HTTP cache when the server allows it, see luascli.httpcache.
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds, defaults to
+            config.http["connect_timeout"] and config.http["read_timeout"]
+        hedge: send a second identical request if the first one is slow,
+            when config.http["hedge"] is set - see _get_hedged()
+        revalidate: ask the server even if the cached response is fresh
+
+    Returns:
+        A requests.Response object
+    """
+    if timeout is None:
+        timeout = (config.http["connect_timeout"], config.http["read_timeout"])
+
+    if hedge and config.http["hedge"]:
+        return _requests.do(url, _get_hedged, url, timeout, revalidate)
+
+    return _requests.do(url, _get, url, timeout, revalidate)
+
+
+def _get_hedged(url, timeout, revalidate=False):
+    """Send a GET request and hedge it with a second one if it is slow
+
+    If the first request hasn't answered after the hedge delay of its host,
+    an identical request is sent and the first response to arrive is used.
+    Hedges are limited to config.http["hedge_ratio"] of the hedged requests
+    so a slow host doesn't get twice the load.
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds
+        revalidate: ask the server even if the cached response is fresh
+
+    Returns:
+        A requests.Response object
+    """
+    results = queue.Queue()
+
+    def send(index):
+        try:
+            results.put((index, True, _get(url, timeout, revalidate)))
+        except BaseException as e:
+            results.put((index, False, e))
+
+    with _hedges_lock:
+        _hedges["requests"] += 1
+
+    threading.Thread(target=send, args=(0,), daemon=True).start()
+    try:
+        outcomes = [results.get(timeout=hedge_delay(urlsplit(url).netloc))]
+    except queue.Empty:
+        outcomes = []
+
+    if not outcomes:
+        with _hedges_lock:
+            hedged = (
+                _hedges["hedged"] < config.http["hedge_ratio"] * _hedges["requests"]
+            )
+            if hedged:
+                _hedges["hedged"] += 1
+        if hedged:
+            threading.Thread(target=send, args=(1,), daemon=True).start()
+
+        for _ in range(2 if hedged else 1):
+            outcomes.append(results.get())
+            index, ok, value = outcomes[-1]
+            if ok:
+                if index == 1:
+                    with _hedges_lock:
+                        _hedges["won"] += 1
+                break
+
+    index, ok, value = outcomes[-1]
+    if ok:
+        return value
+
+    raise value
+
+
+def hedge_delay(host):
+    """Get how long to wait for a response before hedging a request
+
+    Args:
+        host: host name of the request
+
+    Returns:
+        The config.http["hedge_percentile"] percentile of the recent response
+        times of the host, or config.http["hedge_delay"] until
+        config.http["hedge_min_samples"] responses have been timed
+    """
+    with _hedges_lock:
+        samples = sorted(_latencies.get(host, ()))
+
+    if len(samples) < config.http["hedge_min_samples"]:
+        return config.http["hedge_delay"]
+
+    index = int(round(config.http["hedge_percentile"] / 100 * (len(samples) - 1)))
+    return samples[index]
+
+
+def _record_latency(host, seconds):
+    """Keep the response time of a request to compute the hedge delay"""
+    with _hedges_lock:
+        samples = _latencies.get(host)
+        if samples is None or samples.maxlen != config.http["hedge_window"]:
+            samples = _latencies[host] = deque(
+                samples or (), maxlen=config.http["hedge_window"]
+            )
+        samples.append(seconds)
+
+
+def get_hedge_stats():
+    """Get the counters of the hedged requests
+
+    Returns:
+        A dictionary with the number of hedged requests, of requests that were
+        sent twice and of hedges that answered before the first request
+    """
+    with _hedges_lock:
+        return dict(_hedges)
+
+
+def reset_hedges():
+    """Forget the response times and set the hedge counters back to zero
+
+    Returns:
+        None
+    """
+    with _hedges_lock:
+        _latencies.clear()
+        for counter in _hedges:
+            _hedges[counter] = 0
+
+    return None
+
+
+def _get(url, timeout, revalidate=False):
+    """Send a GET request with retries, behind the circuit breaker of its host
+
+    A fresh response of the on-disk HTTP cache is returned without any
+    request. A stale one with an ETag or a Last-Modified header is
+    revalidated with a conditional request, so an unchanged document costs
+    a 304 Not Modified instead of a full download.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    config.http["retries"] times with jittered exponential backoff. When a
+    host keeps failing, its breaker opens and requests fail fast for
+    config.http["breaker_reset"] seconds. In both cases the last successful
+    response of the URL is returned instead, if config.http["serve_stale"]
+    is set and it is no older than config.http["stale_max_age"] seconds
+    (config.http["forecast_stale_max_age"] for forecasts). Otherwise LuasServiceUnavailable, a ConnectionError, is raised
+    from the last connection error or timeout.
+
+    Args:
+        url: full URL of the request
+        timeout: (connect, read) timeout in seconds
+        revalidate: ask the server even if the cached response is fresh
+
+    Returns:
+        A requests.Response object
+    """
+    host = urlsplit(url).netloc
+
+    entry = None
+    kwargs = {}
+    if config.http_cache["enabled"]:
+        entry = httpcache.load(url)
+        if entry is not None:
+            if not revalidate and httpcache.is_fresh(entry, time.time()):
+                httpcache.touch(url)
+                trace.record("cache", name="http", key=url, result="hit")
+                return httpcache.to_response(entry)
+            headers = httpcache.validators(entry)
+            if headers:
+                kwargs["headers"] = headers
+        if "headers" not in kwargs:
+            trace.record("cache", name="http", key=url, result="miss")
+
+    if not _breaker_allows(host):
+        trace.record("http", url=url, status="open", bytes=0, duration=0.0)
+        return _stale_or_raise(url, LuasServiceUnavailable(host))
+
+    attempts = config.http["retries"] + 1
+    for attempt in range(attempts):
+        try:
+            start = time.monotonic()
+            response = get_session().get(url, timeout=timeout, **kwargs)
+            _record_latency(host, time.monotonic() - start)
+            if trace.active():
+                trace.record(
+                    "http",
+                    url=url,
+                    status=response.status_code,
+                    bytes=len(response.content),
+                    duration=time.monotonic() - start,
+                )
+            if response.status_code != 429 and response.status_code < 500:
+                _breaker_success(host)
+                if response.status_code == 304 and "headers" in kwargs:
+                    trace.record("cache", name="http", key=url, result="revalidated")
+                    entry = httpcache.revalidated(entry, response, time.time())
+                    response = httpcache.to_response(entry)
+                elif response.status_code == 200 and config.http_cache["enabled"]:
+                    httpcache.store(url, response, time.time())
+                if response.status_code == 200:
+                    _remember(url, response)
+                return response
+            cause = None
+        except (requests.ConnectionError, requests.Timeout) as e:
+            trace.record(
+                "http",
+                url=url,
+                status=type(e).__name__,
+                bytes=0,
+                duration=time.monotonic() - start,
+            )
+            cause = e
+
+        if attempt + 1 < attempts:
+            time.sleep(
+                random.uniform(
+                    0,
+                    min(
+                        config.http["max_backoff"], config.http["backoff"] * 2**attempt
+                    ),
+                )
+            )
+
+    _breaker_failure(host)
+    return _stale_or_raise(url, LuasServiceUnavailable(host), cause)
+
+
+def _breaker_allows(host):
+    """Check if the circuit breaker of a host lets a request through
+
+    Once the breaker has been open for config.http["breaker_reset"] seconds,
+    one trial request is let through; its outcome closes or re-opens it.
+
+    Args:
+        host: host name of the request
+
+    Returns:
+        True if the request may be sent, False to fail fast
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None or breaker["failures"] < config.http["breaker_threshold"]:
+            return True
+
+        now = time.monotonic()
+        if now - breaker["opened"] < config.http["breaker_reset"]:
+            return False
+
+        breaker["opened"] = now
+        return True
+
+
+def _breaker_success(host):
+    """Close the circuit breaker of a host after a successful request"""
+    with _breakers_lock:
+        _breakers.pop(host, None)
+
+
+def _breaker_failure(host):
+    """Count a failed request, opening the breaker past the threshold"""
+    with _breakers_lock:
+        breaker = _breakers.setdefault(host, {"failures": 0, "opened": 0.0})
+        breaker["failures"] += 1
+        if breaker["failures"] >= config.http["breaker_threshold"]:
+            breaker["opened"] = time.monotonic()
+
+
+def _remember(url, response):
+    """Keep the last successful response of a URL, for serve_stale"""
+    with _last_good_lock:
+        _last_good[url] = (time.time(), response)
+        _last_good.move_to_end(url)
+        while len(_last_good) > config.http["stale_entries"]:
+            _last_good.popitem(last=False)
+
+
+def _max_stale_age(url):
+    """Get how old a response of a URL can be to be served stale
+
+    Forecasts are only useful for a minute or so, so a frozen one isn't
+    shown as live for long.
+    """
+    if "action=forecast" in url:
+        return config.http["forecast_stale_max_age"]
+    return config.http["stale_max_age"]
+
+
+def _stale_or_raise(url, error, cause=None):
+    """Return the last successful response of a URL or raise the error
+
+    The response is taken from memory, or else from the on-disk HTTP cache,
+    if it is younger than _max_stale_age(). The error is raised from cause,
+    the connection error or timeout of the last attempt, if any.
+    """
+    if config.http["serve_stale"]:
+        oldest = time.time() - _max_stale_age(url)
+        with _last_good_lock:
+            received, response = _last_good.get(url, (None, None))
+        if response is not None and received >= oldest:
+            trace.record("cache", name="stale", key=url, result="hit")
+            return response
+
+        entry = httpcache.load(url) if config.http_cache["enabled"] else None
+        if entry is not None and entry.get("stored", 0) >= oldest:
+            trace.record("cache", name="stale", key=url, result="hit")
+            return httpcache.to_response(entry)
+
+    raise error from cause
+
+
+def get_breakers():
+    """Get the state of the circuit breaker of every failing host
+
+    Returns:
+        A dictionary keyed by host with the number of consecutive failures
+        and whether the breaker is open
+    """
+    with _breakers_lock:
+        return {
+            host: {
+                "failures": breaker["failures"],
+                "open": breaker["failures"] >= config.http["breaker_threshold"],
+            }
+            for host, breaker in _breakers.items()
+        }
+
+
+def reset_breakers():
+    """Close every circuit breaker and forget the last successful responses
+
+    Returns:
+        None
+    """
+    with _breakers_lock:
+        _breakers.clear()
+    with _last_good_lock:
+        _last_good.clear()
+
+    return None
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
 
-import requests
-from luascli.exceptions import AddressLocationNotFound
+import threading
+from luascli import cache, config, trace, transport
+from luascli.exceptions import AddressLocationNotFound, LuasCatalogNotFound
 
+ADDRESS_FILE = "addresses.json"
 
+_addresses = {"entries": None}
+_addresses_lock = threading.Lock()
+
+
+@trace.timed("parse", "xml")
 def xml_to_dict(xmldata):
     """Converts XML data into python dictionary
 
@@ -19,9 +26,84 @@ def xml_to_dict(xmldata):
     return doc
 
 
+def get_cached_address(lat, lon):
+    """Get an address from the local address cache
+
+    Args:
+        lat: latitude coordinate
+        lon: longitude coordinate
+
+    Returns:
+        A dictionary with the address, or None if it isn't cached
+    """
+    with _addresses_lock:
+        if _addresses["entries"] is None:
+            _addresses["entries"] = cache.load(ADDRESS_FILE) or {}
+        address = _addresses["entries"].get(lat + "," + lon)
+
+    trace.record(
+        "cache",
+        name="address",
+        key=lat + "," + lon,
+        result="miss" if address is None else "hit",
+    )
+    return dict(address) if address is not None else None
+
+
+def store_address(lat, lon, address):
+    """Store an address in the local address cache
+
+    Args:
+        lat: latitude coordinate
+        lon: longitude coordinate
+        address: dictionary with the address
+
+    Returns:
+        None
+    """
+    return store_addresses({lat + "," + lon: address})
+
+
+def store_addresses(addresses):
+    """Store many addresses in the local address cache at once
+
+    Entries written by other processes in the meantime are kept.
+
+    Args:
+        addresses: dictionary of addresses keyed by "lat,lon"
+
+    Returns:
+        None
+    """
+    with _addresses_lock:
+        entries = cache.load(ADDRESS_FILE) or {}
+        entries.update(_addresses["entries"] or {})
+        entries.update(addresses)
+        cache.store(ADDRESS_FILE, entries)
+        _addresses["entries"] = entries
+
+    return None
+
+
+def reset_address_cache():
+    """Drop the in-memory addresses so the next lookup reads the cache again
+
+    Returns:
+        None
+    """
+    with _addresses_lock:
+        _addresses["entries"] = None
+
+    return None
+
+
 def get_address_by_coordinates(lat, lon):
     """Get the address by coordinate - lat/logn
 
+    Addresses are served from the local address cache when possible, since
+    stop coordinates never change. In offline mode a cache miss raises
+    LuasCatalogNotFound instead of calling Nominatim.
+
     Args:
         lat: latitude coordinate
         lon: itude coordinate
@@ -30,16 +112,41 @@ def get_address_by_coordinates(lat, lon):
         A dictionary container the address based on lat/ coordinates or {} otherwise
     """
 
-    output = {}
-    resp = requests.get(
-        "https://nominatim.openstreetmap.org/reverse?format=xml&lat="
+    output = get_cached_address(lat, lon)
+    if output is not None:
+        return output
+
+    if config.catalog["offline"]:
+        raise LuasCatalogNotFound
+
+    resp = transport.get(
+        config.address_api["url"]
+        + "/reverse?format=xml&lat="
         + lat
         + "&lon="
         + lon
         + "&zoom=18&addressdetails=1"
     )
 
-    parsed_address = xml_to_dict(resp.text)
+    output = parse_address(resp.text, lat, lon)
+    store_address(lat, lon, output)
+    return output
+
+
+def parse_address(xmldata, lat, lon):
+    """Parse a Nominatim reverse geocoding document
+
+    Args:
+        xmldata: xml string
+        lat: latitude coordinate of the request
+        lon: longitude coordinate of the request
+
+    Returns:
+        A dictionary with the full address and its parts
+    """
+
+    output = {}
+    parsed_address = xml_to_dict(xmldata)
 
     if "error" in parsed_address["reversegeocode"].keys():
         raise AddressLocationNotFound(lat, lon)
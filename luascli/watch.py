@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import time
+from luascli import config, luas
+
+CURSOR_UP = "\x1b[{}A"
+CURSOR_DOWN = "\x1b[1B"
+CLEAR_LINE = "\r\x1b[2K"
+
+
+def render_rows(previous, rows):
+    """Build the terminal output that turns the previous rows into rows
+
+    Only the rows that changed are written again. The cursor is expected at
+    the start of the line below the previous rows and is left below the new
+    ones.
+
+    Args:
+        previous: rows currently on screen, or None on the first render
+        rows: rows to display
+
+    Returns:
+        A string with the rows and the ANSI cursor movements between them
+    """
+    if previous is None:
+        return "".join(row + "\n" for row in rows)
+
+    output = [CURSOR_UP.format(len(previous))] if previous else []
+    for i in range(max(len(previous), len(rows))):
+        if i >= len(rows):
+            output.append(CLEAR_LINE + CURSOR_DOWN)
+        elif i >= len(previous):
+            output.append(rows[i] + "\n")
+        elif rows[i] == previous[i]:
+            output.append(CURSOR_DOWN)
+        else:
+            output.append(CLEAR_LINE + rows[i] + "\n")
+
+    if len(rows) < len(previous):
+        output.append(CURSOR_UP.format(len(previous) - len(rows)))
+
+    return "".join(output)
+
+
+def watch_timetables(
+    stops,
+    echo,
+    interval=None,
+    max_interval=None,
+    max_workers=None,
+    sleep=time.sleep,
+    iterations=None,
+):
+    """Poll the timetables of some stops and redraw the rows that changed
+
+    The polling interval doubles, up to max_interval, while the timetables
+    don't change and goes back to interval as soon as they do. Only the rows
+    on screen are kept between polls.
+
+    Args:
+        stops: list of LUAS abbreviated stop names
+        echo: function that writes a string to the terminal
+        interval: seconds between polls, defaults to config.watch["interval"]
+        max_interval: longest backoff in seconds, defaults to
+            config.watch["max_interval"]
+        max_workers: maximum number of concurrent requests
+        sleep: function used to wait between polls
+        iterations: number of polls, or None to poll forever
+
+    Returns:
+        None
+    """
+    if interval is None:
+        interval = config.watch["interval"]
+    if max_interval is None:
+        max_interval = config.watch["max_interval"]
+
+    previous = None
+    delay = interval
+    count = 0
+    while iterations is None or count < iterations:
+        rows = luas.format_timetables(luas.get_timetables(stops, max_workers))
+        echo(render_rows(previous, rows))
+
+        if rows == previous:
+            delay = min(delay * 2, max(interval, max_interval))
+        else:
+            delay = interval
+
+        previous = rows
+        count += 1
+        if iterations is None or count < iterations:
+            sleep(delay)
+
+    return None
@@ -0,0 +1,82 @@
+from luascli import config, metrics, trace, transport
+import mock
+from luascli.luas import reset_stop_index
+from luascli.util import reset_address_cache
+from luascli.fares import reset_fare_matrix
+import pytest
+
+STOPS_XML = """
+<stops>
+<line name="Luas Red Line">
+    <stop abrev="TPT" isParkRide="0" isCycleRide="0" lat="53.34835" long="-6.22925833333333" pronunciation="The Point">The Point</stop>
+    <stop abrev="SDK" isParkRide="0" isCycleRide="0" lat="53.3488222222222" long="-6.23714722222222" pronunciation="Spencer Dock">Spencer Dock</stop>
+    <stop abrev="CIT" isParkRide="1" isCycleRide="1" lat="53.28783255" long="-6.418914583333" pronunciation="Citywest Campus">Citywest Campus</stop>
+    <stop abrev="JER" isParkRide="0" isCycleRide="0" lat="53.33369" long="-6.26227" pronunciation="James's">James's</stop>
+</line>
+<line name="Luas Green Line">
+    <stop abrev="BRO" isParkRide="0" isCycleRide="0" lat="53.37223956" long="-6.29768465" pronunciation="Broombridge">Broombridge</stop>
+    <stop abrev="RAN" isParkRide="0" isCycleRide="1" lat="53.32636" long="-6.25618" pronunciation="Ranelagh">Ranelagh</stop>
+</line>
+</stops>
+"""
+
+FARE_XML = """
+<farecalc>
+    <result peak="7.50" offpeak="6.90" zonesTravelled="3" />
+</farecalc>
+"""
+
+ADULT_FARE_XML = (
+    '<farecalc><result peak="3.00" offpeak="2.70" zonesTravelled="3" /></farecalc>'
+)
+
+CHILD_FARE_XML = (
+    '<farecalc><result peak="1.50" offpeak="1.50" zonesTravelled="3" /></farecalc>'
+)
+
+ADDRESS_XML = """
+<reversegeocode timestamp="Sun, 01 Nov 20 17:24:37 +0000" querystring="format=xml">
+    <result place_id="1" lat="53.32636" lon="-6.25618">Ranelagh, Dublin, D06 Y027, Ireland</result>
+    <addressparts>
+        <road>Ranelagh Road</road>
+        <city>Dublin</city>
+        <county>County Dublin</county>
+        <postcode>D06 Y027</postcode>
+        <country>Ireland</country>
+        <country_code>ie</country_code>
+    </addressparts>
+</reversegeocode>
+"""
+
+
+def fake_feed(url, *args, **kwargs):
+    """Answer a mocked requests.get() with the sample document of its action"""
+    response = mock.Mock()
+    if "action=farecalc" in url and "&adults=1&children=0" in url:
+        response.text = ADULT_FARE_XML
+    elif "action=farecalc" in url and "&adults=0&children=1" in url:
+        response.text = CHILD_FARE_XML
+    elif "action=farecalc" in url:
+        response.text = FARE_XML
+    elif "/reverse?" in url:
+        response.text = ADDRESS_XML
+    else:
+        response.text = STOPS_XML
+    return response
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Keep every test away from the user's cache directory and offline flag"""
+    monkeypatch.setitem(config.cache, "dir", str(tmp_path / "cache"))
+    monkeypatch.setitem(config.catalog, "offline", False)
+    monkeypatch.setitem(config.addresses, "min_interval", 0)
+    monkeypatch.setitem(config.http_cache, "enabled", False)
+    reset_stop_index()
+    reset_address_cache()
+    reset_fare_matrix()
+    transport.reset_breakers()
+    transport.reset_hedges()
+    trace.disable()
+    metrics.disable()
+    metrics.reset()
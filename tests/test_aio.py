@@ -0,0 +1,281 @@
+from luascli import aio, config
+from luascli.exceptions import (
+    LuasStopNotFound,
+    LuasCatalogNotFound,
+    LuasServiceUnavailable,
+)
+from benchmarks.stub_server import StubServer
+import asyncio
+import gzip
+import pytest
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Point the forecast and address APIs to a local stub server"""
+    server = StubServer().start()
+    monkeypatch.setitem(config.forecast_api, "url", server.url)
+    monkeypatch.setitem(config.address_api, "url", server.url)
+    yield server
+    server.stop()
+
+
+def run(coroutine):
+    """Run a coroutine in a new event loop, closing its pooled connections"""
+
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await aio.close()
+
+    return asyncio.run(main())
+
+
+def serve(responses, requests=None, connections=None):
+    """Start a server answering requests with the next raw response
+
+    Connections are kept open while the responses allow it. The request
+    lines received are appended to requests, and the connections accepted
+    to connections.
+    """
+
+    async def handle(reader, writer):
+        if connections is not None:
+            connections.append(writer)
+        while responses:
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            if requests is not None:
+                requests.append(request.split(b"\r\n")[0].decode("ascii"))
+            response = responses.pop(0)
+            writer.write(response)
+            await writer.drain()
+            if b"Content-Length" not in response and b"chunked" not in response:
+                break
+        writer.close()
+
+    return asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def fetch_from(responses, path="/", requests=None):
+    """Fetch a path from a server answering with responses"""
+    server = await serve(responses, requests)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return [await aio.fetch("http://127.0.0.1:%d%s" % (port, path), 5)]
+
+
+def test_get_status(stub):
+    """Test if forecasts are downloaded and parsed on the event loop"""
+    forecast = run(aio.get_forecast("ran"))
+    assert forecast["stop_abrev"] == "RAN"
+    assert forecast["stop"] == "Ranelagh"
+
+    status = run(aio.get_status("ran"))
+    assert status == "Red Line services operating normally"
+
+    timetable = run(aio.get_timetable("ran"))
+    assert set(timetable) == {"inbound", "outbound"}
+
+    records = run(aio.get_timetable_records("ran"))
+    assert records["inbound"][0].destination
+
+    with pytest.raises(LuasStopNotFound):
+        run(aio.get_status("somethingelse"))
+
+
+def test_shared_requests(stub):
+    """Test if concurrent calls for the same stop share one request"""
+
+    async def forecasts():
+        return await asyncio.gather(*[aio.get_status("ran") for _ in range(5)])
+
+    assert len(set(run(forecasts()))) == 1
+    assert stub.request_counts() == {"forecast": 1}
+
+
+def test_catalog_and_fare(stub):
+    """Test if stop and fare lookups can be awaited"""
+
+    async def lookups():
+        return await asyncio.gather(
+            aio.get_stops("green"),
+            aio.get_stop_detail("cit", "red"),
+            aio.find_line_by_stop("ran"),
+            aio.get_fare("cit", "jer", 2, 1),
+            aio.calculate_fare("cit", "jer", 0, 1),
+            aio.get_stop_records("green"),
+            aio.get_nearest_stops(53.32158875, -6.25519750, 1),
+        )
+
+    stops, detail, line, fare, calculated, records, nearest = run(lookups())
+    assert [r.abrev for r in records] == [s["abrev"] for s in stops]
+    assert "RAN" in [s["abrev"] for s in stops]
+    assert detail["text"] == "Citywest Campus"
+    assert line == "green"
+    assert fare[0]["fare_peak"] == "5.20"
+    assert fare[2]["text"] == "Jervis"
+    assert calculated["fare_peak"] == "1.00"
+    assert nearest[0].stop.abrev == "RAN"
+    assert stub.request_counts()["stops"] == 1
+
+    with pytest.raises(KeyError):
+        run(aio.get_stops("blue"))
+    for counts in ((-1, 0), (True, 0), (1, "2")):
+        with pytest.raises(ValueError):
+            run(aio.get_fare("cit", "jer", *counts))
+
+
+def test_get_address(stub):
+    """Test if addresses are downloaded once and then read from the cache"""
+    address = run(aio.get_address("ran"))
+    assert address["postcode"] == "D01 F5P2"
+
+    assert run(aio.get_address("ran")) == address
+    assert stub.request_counts()["reverse"] == 1
+
+
+def test_get_timetables(stub):
+    """Test if get_timetables awaits every stop and keeps the order"""
+    results = run(aio.get_timetables(["somethingelse", "ran"], 2))
+    assert [r["stop"] for r in results] == ["somethingelse", "ran"]
+    assert isinstance(results[0]["error"], LuasStopNotFound)
+    assert results[1]["error"] is None
+    assert "inbound" in results[1]["timetable"]
+
+
+def test_get_network(stub, monkeypatch):
+    """Test if the network snapshot misses the stops past the deadline"""
+    network = run(aio.get_network("green", 4))
+    assert network["messages"] == [
+        {
+            "message": "Red Line services operating normally",
+            "stops": [s["stop"] for s in network["stops"]],
+        }
+    ]
+    assert not any(s["missed"] or s["error"] for s in network["stops"])
+
+    stub.latency = 0.5
+    aio_network = run(aio.get_network("red", 4, deadline=0.1))
+    assert aio_network["messages"] == []
+    assert all(s["missed"] for s in aio_network["stops"])
+
+    monkeypatch.setitem(config.luas, "blue", {"full_name": "Luas Blue Line"})
+    assert run(aio.get_network("blue"))["stops"] == []
+
+
+def test_fetch_chunked_gzip(monkeypatch):
+    """Test if chunked, gzipped responses are decoded"""
+    body = gzip.compress("Ranelagh – Dublin".encode("iso-8859-15", "replace"))
+    response = (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/xml; charset=iso-8859-15\r\n"
+        b"Content-Encoding: gzip\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n"
+        + b"%x\r\n" % 10
+        + body[:10]
+        + b"\r\n"
+        + b"%x\r\n" % (len(body) - 10)
+        + body[10:]
+        + b"\r\n0\r\n\r\n"
+    )
+
+    assert run(fetch_from([response])) == [(200, "Ranelagh ? Dublin")]
+
+
+def test_fetch_retries(monkeypatch):
+    """Test if 5xx responses are retried until the retries run out"""
+    monkeypatch.setitem(config.http, "retries", 1)
+    monkeypatch.setitem(config.http, "backoff", 0)
+    unavailable = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n"
+    ok = b"HTTP/1.1 200 OK\r\n\r\n<ok />"
+
+    assert run(fetch_from([unavailable, ok])) == [(200, "<ok />")]
+
+    with pytest.raises(LuasServiceUnavailable):
+        run(fetch_from([unavailable, unavailable]))
+
+    monkeypatch.setitem(config.http, "retries", 0)
+    with pytest.raises(LuasServiceUnavailable) as error:
+        run(fetch_from([b"garbage\r\n\r\n"]))
+    assert isinstance(error.value.__cause__, ValueError)
+
+
+def test_fetch_keep_alive():
+    """Test if connections are reused, and replaced once the server closes them"""
+    ok = b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\n<ok />"
+    closed = b"HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 6\r\n\r\n<ok />"
+    requests = []
+    connections = []
+
+    async def fetches():
+        server = await serve([ok, ok, closed, ok], requests, connections)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            results = [
+                await aio.fetch("http://127.0.0.1:%d/%d" % (port, i)) for i in range(4)
+            ]
+            return results, aio._pool()
+
+    results, pool = run(fetches())
+    assert results == [(200, "<ok />")] * 4
+    assert requests == ["GET /%d HTTP/1.1" % i for i in range(4)]
+    assert len(connections) == 2
+    assert [len(idle) for idle in pool.values()] == [1]
+
+
+def test_fetch_redirect_and_proxy(monkeypatch):
+    """Test if redirects are followed and HTTP_PROXY is used"""
+    moved = b"HTTP/1.1 302 Found\r\nLocation: /b\r\nContent-Length: 0\r\n\r\n"
+    ok = b"HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\n<ok />"
+    requests = []
+
+    assert run(fetch_from([moved, ok], "/a", requests)) == [(200, "<ok />")]
+    assert requests == ["GET /a HTTP/1.1", "GET /b HTTP/1.1"]
+
+    async def proxied():
+        server = await serve([ok], requests)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("http_proxy", "http://user:pw@127.0.0.1:%d" % port)
+        monkeypatch.delenv("no_proxy", raising=False)
+        monkeypatch.delenv("NO_PROXY", raising=False)
+        async with server:
+            return await aio.fetch("http://luas.invalid/x?y=1")
+
+    assert run(proxied()) == (200, "<ok />")
+    assert requests[-1] == "GET http://luas.invalid/x?y=1 HTTP/1.1"
+
+    monkeypatch.setitem(config.http, "retries", 0)
+    refused = b"HTTP/1.1 407 Proxy Authentication Required\r\nContent-Length: 0\r\n\r\n"
+
+    async def tunnel():
+        server = await serve([refused], requests)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("https_proxy", "127.0.0.1:%d" % port)
+        async with server:
+            return await aio.fetch("https://luas.invalid/x")
+
+    with pytest.raises(LuasServiceUnavailable) as error:
+        run(tunnel())
+    assert requests[-1] == "CONNECT luas.invalid:443 HTTP/1.1"
+    assert isinstance(error.value.__cause__, OSError)
+
+    monkeypatch.setitem(config.aio, "max_redirects", 1)
+    monkeypatch.delenv("http_proxy")
+    with pytest.raises(LuasServiceUnavailable):
+        run(fetch_from([moved, moved]))
+
+
+def test_offline(stub, monkeypatch):
+    """Test if offline lookups don't download fares or addresses"""
+    run(aio.get_stops("red"))
+    monkeypatch.setitem(config.catalog, "offline", True)
+
+    with pytest.raises(LuasCatalogNotFound):
+        run(aio.get_fare("cit", "jer", 1))
+    with pytest.raises(LuasCatalogNotFound):
+        run(aio.get_address("ran"))
+    assert stub.request_counts() == {"stops": 1}
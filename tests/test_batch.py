@@ -0,0 +1,94 @@
+import io
+import json
+from luascli.batch import read_journeys, write_results, describe_error
+from luascli.exceptions import LuasStopNotFound, LuasStopsNotOnSameLine
+
+
+def test_read_csv_journeys():
+    """Test if CSV journeys are read with an optional header and defaults"""
+    lines = io.StringIO(
+        "from,to,adults,children\ncit,jer,2,1\n\ntpt, sdk\nran\ncit,jer,x,1\n"
+        "cit,jer,1.9,1\n"
+    )
+
+    assert list(read_journeys(lines)) == [
+        ("cit", "jer", 2, 1),
+        ("tpt", "sdk", 0, 0),
+        ("", "", None, None),
+        ("cit", "jer", "x", 1),
+        ("cit", "jer", "1.9", 1),
+    ]
+    assert list(read_journeys(["cit,jer,1,0"], "csv")) == [("cit", "jer", 1, 0)]
+
+
+def test_read_ndjson_journeys():
+    """Test if NDJSON journeys are detected and read line by line"""
+    lines = io.StringIO(
+        "\n"
+        '{"from": "cit", "to": "jer", "adults": 2, "children": "1"}\n'
+        '{"from": "tpt", "to": "sdk"}\n'
+        "not json\n"
+        "[1, 2]\n"
+        '{"from": "cit", "to": "jer", "adults": 1.9, "children": true}\n'
+        '{"from": "cit", "to": "jer", "adults": " 2", "children": "-1"}\n'
+    )
+
+    assert list(read_journeys(lines)) == [
+        ("cit", "jer", 2, 1),
+        ("tpt", "sdk", 0, 0),
+        ("", "", None, None),
+        ("", "", None, None),
+        ("cit", "jer", 1.9, True),
+        ("cit", "jer", 2, "-1"),
+    ]
+
+
+def test_write_results():
+    """Test if results are written as CSV or NDJSON with readable errors"""
+    results = [
+        {
+            "from": "cit",
+            "to": "jer",
+            "adults": 2,
+            "children": 1,
+            "fare_peak": "7.50",
+            "fare_offpeak": "6.90",
+            "zones_travelled": "3",
+            "error": None,
+        },
+        {
+            "from": "xyz",
+            "to": "jer",
+            "adults": 1,
+            "children": 0,
+            "fare_peak": None,
+            "fare_offpeak": None,
+            "zones_travelled": None,
+            "error": LuasStopNotFound("xyz"),
+        },
+    ]
+
+    output = io.StringIO()
+    assert write_results(iter(results), output) == {"journeys": 2, "failed": 1}
+    assert output.getvalue() == (
+        "from,to,adults,children,fare_peak,fare_offpeak,zones_travelled,error\n"
+        "cit,jer,2,1,7.50,6.90,3,\n"
+        "xyz,jer,1,0,,,,The Luas stop xyz doesn't exist.\n"
+    )
+
+    output = io.StringIO()
+    assert write_results(results, output, "ndjson") == {"journeys": 2, "failed": 1}
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert lines[0]["fare_peak"] == "7.50"
+    assert lines[0]["error"] is None
+    assert lines[1]["error"] == "The Luas stop xyz doesn't exist."
+
+
+def test_describe_error():
+    """Test if journey errors are described like the luas fare command does"""
+    assert (
+        describe_error(LuasStopsNotOnSameLine("cit", "ran"))
+        == "The Luas stops cit and ran are not on the same line."
+    )
+    assert describe_error(ValueError()).startswith("Invalid journey")
+    assert describe_error(ValueError("No fare")) == "No fare"
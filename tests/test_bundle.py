@@ -0,0 +1,83 @@
+from luascli.bundle import build_bundle, read_bundle, verify_bundle, import_bundle
+from luascli.exceptions import LuasBundleInvalid
+from luascli.luas import get_stop_detail, get_address, get_fare, reset_stop_index
+from luascli.util import reset_address_cache
+from luascli.fares import reset_fare_matrix
+from luascli import cache, config
+from conftest import fake_feed
+import gzip
+import json
+import mock
+import pytest
+
+
+@mock.patch("luascli.util.transport")
+@mock.patch("luascli.luas.transport")
+def test_build_and_import(mock_transport, mock_util_transport, tmp_path):
+    """Test if a bundle built online can be imported and used offline"""
+    mock_transport.get.side_effect = fake_feed
+    mock_util_transport.get.side_effect = fake_feed
+    path = str(tmp_path / "catalog.json.gz")
+
+    summary = build_bundle(path, addresses=True, fares_matrix=True)
+    assert summary["version"] == 1
+    assert summary["stops"] == {"red": 4, "green": 2}
+    assert summary["addresses"] == 6
+    assert summary["fares"] == 7
+    assert verify_bundle(path) == summary
+
+    # a new device with an empty cache
+    config.cache["dir"] = str(tmp_path / "device")
+    config.catalog["offline"] = True
+    reset_stop_index()
+    reset_address_cache()
+    reset_fare_matrix()
+
+    assert import_bundle(path) == summary
+    assert get_stop_detail("ran", "green")["text"] == "Ranelagh"
+    assert get_address("ran")["postcode"] == "D06 Y027"
+    assert get_fare("cit", "jer", 2, 1)[0]["fare_peak"] == "7.50"
+    assert mock_transport.get.call_count == 1 + 7 * 2
+    assert mock_util_transport.get.call_count == 6
+
+
+@mock.patch("luascli.luas.transport")
+def test_build_without_addresses(mock_transport, tmp_path):
+    """Test if addresses are only included on request"""
+    mock_transport.get.side_effect = fake_feed
+    path = str(tmp_path / "catalog.json.gz")
+
+    assert build_bundle(path)["addresses"] == 0
+    assert read_bundle(path)["fares"] == {}
+    assert read_bundle(path)["stops"]["red"][0]["abrev"] == "TPT"
+    assert cache.load("addresses.json") is None
+
+
+@mock.patch("luascli.luas.transport")
+def test_read_bundle_invalid(mock_transport, tmp_path):
+    """Test if corrupt, foreign or tampered bundles are rejected"""
+    mock_transport.get.side_effect = fake_feed
+    path = str(tmp_path / "catalog.json.gz")
+
+    with open(path, "w") as f:
+        f.write("not gzip")
+    with pytest.raises(LuasBundleInvalid):
+        read_bundle(path)
+
+    build_bundle(path)
+    with gzip.open(path, "rt") as f:
+        bundle = json.load(f)
+
+    for key, value, reason in [
+        ("format", "somethingelse", "not a luascli catalog bundle"),
+        ("version", 99, "unsupported bundle version 99"),
+        ("stops", {"red": []}, "checksum mismatch"),
+        ("addresses", None, "missing stops, addresses or fares"),
+        ("fares", [], "missing stops, addresses or fares"),
+    ]:
+        with gzip.open(path, "wt") as f:
+            json.dump(dict(bundle, **{key: value}), f)
+        with pytest.raises(LuasBundleInvalid) as e:
+            verify_bundle(path)
+        assert e.value.reason == reason
+        assert e.value.path == path
@@ -0,0 +1,47 @@
+from luascli import cache, config
+import os
+import time
+
+
+def test_store_and_load():
+    """Test if a stored document can be loaded back from the cache"""
+
+    data = {"red": [{"abrev": "TPT"}]}
+    cache.store("stops.json", data)
+
+    assert os.path.exists(cache.cache_path("stops.json"))
+    assert cache.load("stops.json") == data
+    assert cache.load("stops.json", ttl=60) == data
+
+
+def test_load_expired(monkeypatch):
+    """Test if load() ignores documents older than the ttl"""
+
+    cache.store("stops.json", {"red": []})
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 120)
+
+    assert cache.load("stops.json", ttl=60) is None
+    assert cache.load("stops.json") == {"red": []}
+
+
+def test_load_missing_or_corrupt():
+    """Test if load() returns None for missing or unreadable documents"""
+
+    assert cache.load("missing.json") is None
+
+    os.makedirs(os.path.dirname(cache.cache_path("bad.json")), exist_ok=True)
+    with open(cache.cache_path("bad.json"), "w") as f:
+        f.write("not json")
+
+    assert cache.load("bad.json") is None
+
+
+def test_store_unwritable(tmp_path, monkeypatch):
+    """Test if store() carries on when the cache directory can't be written"""
+
+    (tmp_path / "file").write_text("")
+    monkeypatch.setitem(config.cache, "dir", str(tmp_path / "file" / "cache"))
+
+    assert cache.store("stops.json", {"red": []}) is None
+    assert cache.load("stops.json") is None
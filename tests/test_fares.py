@@ -0,0 +1,70 @@
+from luascli.fares import (
+    fare_key,
+    get_fare_matrix,
+    store_fares,
+    reset_fare_matrix,
+    lookup_fare,
+    validate_counts,
+)
+from luascli import cache, config
+import pytest
+import time
+
+
+def test_fare_key():
+    """Test if both directions of a journey share one key"""
+
+    assert fare_key("cit", "JER") == "CIT:JER"
+    assert fare_key("jer", "cit") == "CIT:JER"
+
+
+def test_store_and_lookup_fare():
+    """Test if fares are stored locally and scaled by the number of passengers"""
+
+    assert lookup_fare("cit", "jer", 1, 0) is None
+
+    store_fares({"CIT:JER": ["3.00", "2.70", "1.50", "1.30", "3", time.time()]})
+    assert lookup_fare("jer", "cit", 2, 3) == {
+        "fare_peak": "10.50",
+        "fare_offpeak": "9.30",
+        "zones_travelled": "3",
+    }
+
+    # entries written by another process are kept
+    cache.store(
+        "fares.json", {"BRO:RAN": ["2.00", "1.80", "1.00", "1.00", "1", time.time()]}
+    )
+    store_fares({"SDK:TPT": ["2.00", "1.80", "1.00", "1.00", "1", time.time()]})
+    reset_fare_matrix()
+    assert sorted(get_fare_matrix()) == ["BRO:RAN", "CIT:JER", "SDK:TPT"]
+
+    store_fares({"CIT:JER": ["?", "2.70", "1.50", "1.30", "3", time.time()]})
+    assert lookup_fare("jer", "cit", 1, 0) is None
+
+
+def test_expired_fares(monkeypatch):
+    """Test if fares older than the ttl, or without a timestamp, are misses"""
+
+    fetched = time.time() - config.fares["ttl"] - 1
+    store_fares(
+        {
+            "CIT:JER": ["3.00", "2.70", "1.50", "1.30", "3", fetched],
+            "BRO:RAN": ["2.00", "1.80", "1.00", "1.00", "1"],
+        }
+    )
+    assert lookup_fare("cit", "jer", 1, 0) is None
+    assert lookup_fare("bro", "ran", 1, 0) is None
+
+    # offline, an old fare is better than none
+    monkeypatch.setitem(config.catalog, "offline", True)
+    assert lookup_fare("cit", "jer", 1, 0)["fare_peak"] == "3.00"
+    assert lookup_fare("bro", "ran", 1, 0)["fare_peak"] == "2.00"
+
+
+def test_validate_counts():
+    """Test if only non-negative ints are accepted as counts"""
+
+    assert validate_counts(0, 3) is None
+    for counts in ((True, 0), (0, False), (1.9, 0), ("2", 0), (None, 0), (1, -1)):
+        with pytest.raises(ValueError):
+            validate_counts(*counts)
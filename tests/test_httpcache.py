@@ -0,0 +1,103 @@
+from luascli import httpcache
+import os
+import requests
+
+
+def make_response(status, body=b"", headers=None):
+    """Build a requests.Response as the session would return it"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response.encoding = "utf-8"
+    response._content = body
+    return response
+
+
+def test_freshness():
+    """Test if Cache-Control, Expires and Age decide how long a response is fresh"""
+    now = 1000.0
+
+    assert httpcache.freshness({"Cache-Control": "max-age=60"}, now) == 1060.0
+    assert httpcache.freshness({"Cache-Control": "public, max-age=60"}, 0) == 60
+    assert httpcache.freshness({"Cache-Control": "max-age=60", "Age": "10"}, now) == (
+        1050.0
+    )
+    assert httpcache.freshness({"Cache-Control": "no-cache, max-age=60"}, now) == now
+    assert httpcache.freshness({"Cache-Control": "no-store"}, now) is None
+    assert httpcache.freshness({"Vary": "*"}, now) is None
+    assert httpcache.freshness({}, now) == now
+    assert (
+        httpcache.freshness(
+            {
+                "Date": "Sun, 01 Nov 2020 17:24:37 GMT",
+                "Expires": "Sun, 01 Nov 2020 17:25:37 GMT",
+            },
+            now,
+        )
+        == 1060.0
+    )
+    assert httpcache.freshness({"Expires": "0"}, now) == now
+
+
+def test_store_and_load():
+    """Test if responses are stored compressed and only when they're reusable"""
+    url = "https://luasforecasts.rpa.ie/xml/get.ashx?action=stops"
+    body = b"<stops>" + b"<stop />" * 1000 + b"</stops>"
+
+    # neither fresh nor revalidatable
+    assert httpcache.store(url, make_response(200, body), 1000.0) is None
+    assert httpcache.load(url) is None
+
+    headers = {"ETag": '"v1"', "Content-Type": "text/xml", "Server": "IIS"}
+    httpcache.store(url, make_response(200, body, headers), 1000.0)
+    entry = httpcache.load(url)
+    assert entry["content"] == body
+    assert entry["headers"] == {"ETag": '"v1"', "Content-Type": "text/xml"}
+    assert os.path.getsize(httpcache.entry_path(url)) < len(body) / 4
+    assert not httpcache.is_fresh(entry, 1000.0)
+    assert httpcache.validators(entry) == {"If-None-Match": '"v1"'}
+
+    response = httpcache.to_response(entry)
+    assert response.status_code == 200
+    assert response.text == body.decode("utf-8")
+    assert response.headers["etag"] == '"v1"'
+
+    # a 304 keeps the body and takes the new caching headers
+    entry = httpcache.revalidated(
+        entry, make_response(304, headers={"Cache-Control": "max-age=30"}), 2000.0
+    )
+    assert httpcache.load(url)["expires"] == 2030.0
+    assert httpcache.load(url)["content"] == body
+
+    # no-store drops the entry
+    httpcache.store(url, make_response(200, body, {"Cache-Control": "no-store"}), 0)
+    assert httpcache.load(url) is None
+
+
+def test_load_unreadable():
+    """Test if a corrupt entry is a cache miss"""
+    url = "http://a"
+    httpcache.store(url, make_response(200, b"x", {"ETag": "1"}), 0)
+    with open(httpcache.entry_path(url), "r+b") as f:
+        f.seek(-4, os.SEEK_END)
+        f.write(b"oops")
+
+    assert httpcache.load(url) is None
+
+
+def test_evict():
+    """Test if the least recently used entries are evicted first"""
+    for index, url in enumerate(["http://a", "http://b", "http://c"]):
+        httpcache.store(url, make_response(200, os.urandom(1000), {"ETag": "1"}), 0)
+        os.utime(httpcache.entry_path(url), (index, index))
+    httpcache.touch("http://a")
+    size = os.path.getsize(httpcache.entry_path("http://a"))
+
+    assert httpcache.evict(2 * size + 10) == 1
+    assert httpcache.load("http://b") is None
+    assert httpcache.load("http://a") is not None
+    assert httpcache.load("http://c") is not None
+
+    httpcache.clear()
+    assert httpcache.load("http://a") is None
+    assert httpcache.evict() == 0
@@ -1,30 +1,55 @@
 from luascli.luas import (
+    get_forecast,
     get_status,
     get_stops,
+    get_catalog,
+    get_stop_index,
+    reset_stop_index,
     get_stop_detail,
     print_stops,
     find_line_by_stop,
     get_address,
     get_timetable,
+    get_timetable_records,
+    get_timetables,
+    get_network,
+    format_network,
+    get_stop_records,
+    get_nearest_stops,
+    get_nearest_stops_batch,
+    precompute_addresses,
+    build_fare_matrix,
     calculate_fare,
+    calculate_fares,
+    get_fare,
+    resolve_journey,
     are_stops_on_same_line,
     is_not_valid_stop,
+    CATALOG_FILE,
 )
 import json
+import threading
+import time
 from mock import patch
+import mock
 from requests.exceptions import Timeout
 import pytest
 from luascli.exceptions import (
     LuasLineNotFound,
     LuasStopNotFound,
     LuasStopsNotOnSameLine,
+    LuasCatalogNotFound,
+    LuasServiceUnavailable,
 )
+from luascli import cache, config, fares, singleflight
+from luascli.records import Stop, Tram
+from conftest import STOPS_XML, fake_feed
 
 
-@patch("luascli.luas.requests")
-def test_get_status(mock_requests):
+@patch("luascli.luas.transport")
+def test_get_status(mock_transport):
     """Test if get_status() returns a valid status based on mocked data."""
-    mock_requests.get.return_value.text = """
+    mock_transport.get.return_value.text = """
         <stopInfo created="2020-10-28T21:51:58" stop="Ranelagh" stopAbv="RAN">
             <message>Green Line services operating normally</message>
             <direction name="Inbound"><tram dueMins="10" destination="Broombridge" /></direction>
@@ -33,29 +58,29 @@ def test_get_status(mock_requests):
     """
 
     status = get_status("ran")
-    mock_requests.get.assert_called_once()
+    mock_transport.get.assert_called_once()
     assert status == "Green Line services operating normally"
 
-    mock_requests.get.return_value.text = "<error></error>"
+    mock_transport.get.return_value.text = "<error></error>"
     with pytest.raises(LuasStopNotFound):
         get_status("somethingelse")
 
 
-@patch("luascli.luas.requests")
-def test_get_status_timeout(mock_requests):
+@patch("luascli.luas.transport")
+def test_get_status_timeout(mock_transport):
     """Test if get_status() raises a Timeout with a side effect."""
-    mock_requests.get.side_effect = Timeout
+    mock_transport.get.side_effect = Timeout
 
     with pytest.raises(Timeout):
         get_status("ran")
 
-    mock_requests.get.assert_called_once()
+    mock_transport.get.assert_called_once()
 
 
-@patch("luascli.luas.requests")
-def test_get_stops(mock_requests):
+@patch("luascli.luas.transport")
+def test_get_stops(mock_transport):
     """Test if get_stops() returns a valid list of stops based on mocked_data."""
-    mock_requests.get.return_value.text = """
+    mock_transport.get.return_value.text = """
     <stops>
     <line name="Luas Red Line">
         <stop abrev="TPT" isParkRide="0" isCycleRide="0" lat="53.34835" long="-6.22925833333333" pronunciation="The Point">The Point</stop>
@@ -90,30 +115,97 @@ def test_get_stops(mock_requests):
     assert len(actual) == len(expected)
     assert all([a == b for a, b in zip(actual, expected)])
 
+    # the catalog is now cached locally
+    assert get_stops("red") == actual
+    mock_transport.get.assert_called_once()
 
-@patch("luascli.luas.get_stops")
-def test_get_stop_detail(mock_get_stops):
+    with pytest.raises(KeyError):
+        get_stops("somethingelse")
+
+
+@patch("luascli.luas.transport")
+def test_get_catalog(mock_transport):
+    """Test if get_catalog() honours refresh and offline mode."""
+    mock_transport.get.return_value.text = STOPS_XML
+
+    catalog = get_catalog()
+    assert sorted(catalog.keys()) == ["green", "red"]
+    assert [s["abrev"] for s in catalog["green"]] == ["BRO", "RAN"]
+
+    get_catalog()
+    assert mock_transport.get.call_count == 1
+
+    get_catalog(refresh=True)
+    assert mock_transport.get.call_count == 2
+
+    config.catalog["offline"] = True
+    assert get_catalog(refresh=True) == catalog
+    assert mock_transport.get.call_count == 2
+
+
+@patch("luascli.luas.transport")
+def test_get_catalog_offline_without_cache(mock_transport):
+    """Test if get_catalog() never downloads the feed in offline mode."""
+    config.catalog["offline"] = True
+
+    with pytest.raises(LuasCatalogNotFound):
+        get_catalog()
+
+    mock_transport.get.assert_not_called()
+
+
+@patch("luascli.luas.transport")
+def test_get_catalog_rejects_incomplete_feed(mock_transport):
+    """Test if an empty or partial stops feed doesn't replace the catalog"""
+    mock_transport.get.return_value.text = "<stops></stops>"
+    with pytest.raises(LuasServiceUnavailable):
+        get_stops("red")
+    assert cache.load(CATALOG_FILE) is None
+
+    mock_transport.get.return_value.text = STOPS_XML
+    assert find_line_by_stop("jer") == "red"
+
+    mock_transport.get.return_value.text = STOPS_XML.split("<line name=")[0] + (
+        "<line name=" + STOPS_XML.split("<line name=")[1] + "</stops>"
+    )
+    with pytest.raises(LuasServiceUnavailable):
+        get_catalog(refresh=True)
+    reset_stop_index()
+    assert find_line_by_stop("ran") == "green"
+
+
+@patch("luascli.util.transport")
+@patch("luascli.luas.transport")
+def test_unwritable_cache(mock_transport, mock_util_transport, tmp_path):
+    """Test if lookups work from memory when the cache can't be written"""
+    mock_transport.get.side_effect = fake_feed
+    mock_util_transport.get.side_effect = fake_feed
+    (tmp_path / "file").write_text("")
+    config.cache["dir"] = str(tmp_path / "file" / "cache")
+
+    assert [s["abrev"] for s in get_stops("green")] == ["BRO", "RAN"]
+    assert get_address("ran")["postcode"] == "D06 Y027"
+    assert calculate_fare("cit", "jer", 2, 1)["fare_peak"] == "7.50"
+    assert find_line_by_stop("jer") == "red"
+
+
+@patch("luascli.luas.transport")
+def test_fare_counts(mock_transport):
+    """Test if every fare path rejects bool and non-int counts the same way"""
+    for counts in ((True, 0), (1, "2"), ("x", 1)):
+        with pytest.raises(ValueError):
+            get_fare("cit", "jer", *counts)
+        with pytest.raises(ValueError):
+            calculate_fare("cit", "jer", *counts)
+    mock_transport.get.assert_not_called()
+
+
+@patch("luascli.luas.transport")
+def test_get_stop_detail(mock_transport):
     """Test if get_stop_detail returns a stop dictionary based on mocked data."""
-    mock_get_stops.return_value = [
-        {
-            "abrev": "TPT",
-            "text": "The Point",
-            "park_ride": "0",
-            "cycle_ride": "0",
-            "lat": "53.34835",
-            "lon": "-6.22925833333333",
-        },
-        {
-            "abrev": "SDK",
-            "text": "Spencer Dock",
-            "park_ride": "0",
-            "cycle_ride": "0",
-            "lat": "53.3488222222222",
-            "lon": "-6.23714722222222",
-        },
-    ]
+    mock_transport.get.return_value.text = STOPS_XML
 
-    actual_dict = get_stop_detail("TPT", "Luas Red Line")
+    actual_dict = get_stop_detail("tpt", "red")
     expected_dict = {
         "abrev": "TPT",
         "text": "The Point",
@@ -130,7 +222,32 @@ def test_get_stop_detail(mock_get_stops):
 
     # Testing None case
     with pytest.raises(LuasStopNotFound):
-        actual_dict = get_stop_detail("FAKE", "Luas Red Line")
+        actual_dict = get_stop_detail("FAKE", "red")
+
+    # Testing a stop on another line
+    with pytest.raises(LuasStopNotFound):
+        actual_dict = get_stop_detail("RAN", "red")
+
+
+@patch("luascli.luas.transport")
+def test_stop_index(mock_transport):
+    """Test if every lookup helper shares one parse of the stops feed."""
+    mock_transport.get.return_value.text = STOPS_XML
+
+    index = get_stop_index()
+    assert index["ran"][0] == "green"
+    assert index["cit"][1]["text"] == "Citywest Campus"
+
+    assert find_line_by_stop("CIT") == "red"
+    assert get_stop_detail("Ran", "green")["abrev"] == "RAN"
+    assert is_not_valid_stop("somethingelse") is True
+    assert are_stops_on_same_line("tpt", "jer") is True
+    assert len(get_stops("red")) == 4
+    mock_transport.get.assert_called_once()
+
+    reset_stop_index()
+    find_line_by_stop("bro")
+    mock_transport.get.assert_called_once()
 
 
 @patch("luascli.luas.click")
@@ -179,11 +296,11 @@ def test_find_line_by_stop():
         find_line_by_stop("somethingelse")
 
 
-@patch("luascli.luas.requests")
-def test_get_timetable(mock_requests):
+@patch("luascli.luas.transport")
+def test_get_timetable(mock_transport):
     """Test if get_timetable returns returns the timetable for the luas stop"""
 
-    mock_requests.get.return_value.text = """
+    mock_transport.get.return_value.text = """
     <stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
     <message>Green Line services operating normally</message>
     <direction name="Inbound">
@@ -207,13 +324,13 @@ def test_get_timetable(mock_requests):
 
     assert actual_result == expected_result
 
-    mock_requests.get.return_value.text = """
+    mock_transport.get.return_value.text = """
     <somethingelse></somethingelse>
     """
     with pytest.raises(LuasStopNotFound):
         actual_result = get_timetable("ran")
 
-    mock_requests.get.return_value.text = """
+    mock_transport.get.return_value.text = """
     Not a valid xml
     """
     with pytest.raises(LuasStopNotFound):
@@ -298,3 +415,432 @@ def test_calculate_fare():
 
     with pytest.raises(LuasStopsNotOnSameLine):
         calculate_fare(begin_journey, end_journey, num_adults, num_children)
+
+
+@patch("luascli.luas.transport")
+def test_get_fare(mock_transport):
+    """Test if a fare costs one catalog fetch and one farecalc request"""
+    mock_transport.get.side_effect = fake_feed
+
+    fare, begin, end = get_fare("cit", "jer", 2, 1)
+    assert fare == {
+        "from": "cit",
+        "to": "jer",
+        "adults": 2,
+        "children": 1,
+        "fare_peak": "7.50",
+        "fare_offpeak": "6.90",
+        "zones_travelled": "3",
+    }
+    assert begin["text"] == "Citywest Campus"
+    assert end["text"] == "James's"
+
+    urls = [c.args[0] for c in mock_transport.get.call_args_list]
+    assert len(urls) == 2
+    assert "action=stops" in urls[0]
+    assert "action=farecalc" in urls[1]
+
+    # the catalog is already in memory for the next fare
+    assert calculate_fare("jer", "cit", 1)["fare_peak"] == "3.00"
+    assert mock_transport.get.call_count == 3
+
+
+@patch("luascli.luas.transport")
+def test_resolve_journey(mock_transport):
+    """Test if resolve_journey validates both stops without any fare request"""
+    mock_transport.get.side_effect = fake_feed
+
+    line, begin, end = resolve_journey("TPT", "sdk")
+    assert line == "red"
+    assert (begin["abrev"], end["abrev"]) == ("TPT", "SDK")
+
+    with pytest.raises(LuasStopNotFound) as e:
+        resolve_journey("somethingelse", "tpt")
+    assert e.value.stop == "somethingelse"
+
+    with pytest.raises(LuasStopNotFound) as e:
+        resolve_journey("tpt", "somethingelse")
+    assert e.value.stop == "somethingelse"
+
+    with pytest.raises(LuasStopsNotOnSameLine):
+        resolve_journey("tpt", "ran")
+
+    mock_transport.get.assert_called_once()
+
+
+@patch("luascli.luas.get_timetable")
+def test_get_timetables(mock_get_timetable):
+    """Test if get_timetables fetches stops concurrently and keeps their order"""
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fake_timetable(stop):
+        # every fetch waits for the others, so a serial run would time out
+        barrier.wait()
+        if stop == "somethingelse":
+            raise LuasStopNotFound(stop)
+        return {"inbound": [{"destination": stop, "dueMins": "1"}]}
+
+    mock_get_timetable.side_effect = fake_timetable
+
+    results = get_timetables(["ran", "somethingelse", "cit"], max_workers=3)
+    assert [r["stop"] for r in results] == ["ran", "somethingelse", "cit"]
+    assert results[0]["timetable"]["inbound"][0]["destination"] == "ran"
+    assert results[0]["error"] is None
+    assert results[1]["timetable"] is None
+    assert isinstance(results[1]["error"], LuasStopNotFound)
+    assert results[2]["timetable"]["inbound"][0]["destination"] == "cit"
+
+    assert get_timetables([]) == []
+
+
+@patch("luascli.luas.transport")
+def test_get_forecast(mock_transport):
+    """Test if get_forecast returns the message and the timetable of one request"""
+    mock_transport.get.return_value.text = """
+    <stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
+    <message>Green Line services operating normally</message>
+    <direction name="Inbound">
+        <tram dueMins="DUE" destination="Broombridge" />
+    </direction>
+    </stopInfo>
+    """
+
+    forecast = get_forecast("ran")
+    assert forecast == {
+        "stop": "Ranelagh",
+        "stop_abrev": "RAN",
+        "created": "2020-11-01T17:24:37",
+        "message": "Green Line services operating normally",
+        "timetable": {"inbound": [{"dueMins": "DUE", "destination": "Broombridge"}]},
+    }
+    mock_transport.get.assert_called_once()
+    assert "action=forecast&stop=ran" in mock_transport.get.call_args.args[0]
+
+    mock_transport.get.return_value.text = "<stopInfo />"
+    with pytest.raises(LuasStopNotFound) as e:
+        get_forecast("somethingelse")
+    assert e.value.stop == "somethingelse"
+
+
+@patch("luascli.util.transport")
+@patch("luascli.luas.transport")
+def test_precompute_addresses(mock_transport, mock_util_transport):
+    """Test if precompute_addresses fills the cache and can be resumed"""
+    mock_transport.get.side_effect = fake_feed
+    mock_util_transport.get.side_effect = fake_feed
+
+    results = precompute_addresses(max_workers=2)
+    assert [r["stop"] for r in results] == ["TPT", "SDK", "CIT", "JER", "BRO", "RAN"]
+    assert all(r["error"] is None for r in results)
+    assert results[5]["address"]["postcode"] == "D06 Y027"
+    assert mock_util_transport.get.call_count == 6
+
+    # every address is served from the cache now
+    assert get_address("ran")["road"] == "Ranelagh Road"
+    assert precompute_addresses() == results
+    assert mock_util_transport.get.call_count == 6
+
+
+@patch("luascli.luas.transport")
+def test_build_fare_matrix(mock_transport):
+    """Test if the fare matrix is built once and answers fares locally"""
+    mock_transport.get.side_effect = fake_feed
+    config.fares["save_every"] = 2
+
+    summary = build_fare_matrix(max_workers=3)
+    assert summary == {"pairs": 7, "fetched": 7, "skipped": 0, "failed": 0}
+    assert fares.get_fare_matrix()["CIT:JER"][:5] == [
+        "3.00",
+        "2.70",
+        "1.50",
+        "1.50",
+        "3",
+    ]
+    assert fares.is_fresh(fares.get_fare_matrix()["CIT:JER"])
+    assert mock_transport.get.call_count == 1 + 7 * 2
+
+    fares.reset_fare_matrix()
+    fare, begin, end = get_fare("jer", "cit", 2, 1)
+    assert fare["fare_peak"] == "7.50"
+    assert fare["fare_offpeak"] == "6.90"
+    assert fare["zones_travelled"] == "3"
+    assert calculate_fare("tpt", "sdk")["fare_peak"] == "0.00"
+    assert mock_transport.get.call_count == 1 + 7 * 2
+
+    # resumed builds skip the stored pairs
+    summary = build_fare_matrix()
+    assert summary == {"pairs": 7, "fetched": 0, "skipped": 7, "failed": 0}
+
+    # missing fares fall back to the network, never in offline mode
+    assert get_fare("cit", "cit")[0]["fare_peak"] == "7.50"
+    assert mock_transport.get.call_count == 2 + 7 * 2
+    config.catalog["offline"] = True
+    with pytest.raises(LuasCatalogNotFound):
+        get_fare("cit", "cit")
+    assert get_fare("sdk", "tpt", 1, 1)[0]["fare_offpeak"] == "4.20"
+
+
+@patch("luascli.luas.transport")
+def test_build_fare_matrix_failures(mock_transport):
+    """Test if failed pairs are reported and fetched again on the next build"""
+
+    def flaky_feed(url, *args, **kwargs):
+        if "from=RAN" in url or "to=RAN" in url:
+            raise TimeoutError
+        if "from=TPT&to=SDK" in url:
+            return mock.Mock(text="<farecalc />")
+        return fake_feed(url)
+
+    mock_transport.get.side_effect = flaky_feed
+
+    summary = build_fare_matrix(refresh=True)
+    assert summary == {"pairs": 7, "fetched": 5, "skipped": 0, "failed": 2}
+    assert "BRO:RAN" not in fares.get_fare_matrix()
+
+    mock_transport.get.side_effect = fake_feed
+    summary = build_fare_matrix()
+    assert summary == {"pairs": 7, "fetched": 2, "skipped": 5, "failed": 0}
+
+
+@patch("luascli.luas.transport")
+def test_calculate_fares(mock_transport):
+    """Test if batch fares are fetched once per stop pair and kept in order"""
+    mock_transport.get.side_effect = fake_feed
+    fares.store_fares({"SDK:TPT": ["2.00", "1.80", "1.00", "1.00", "1", time.time()]})
+
+    journeys = [
+        ("cit", "jer", 2, 1),
+        ("tpt", "sdk", 1, 1),
+        ("jer", "cit", 1, 0),
+        ("cit", "ran", 1, 0),
+        ("xyz", "jer", 1, 0),
+        ("cit", "jer", -1, 0),
+        ("", "", None, None),
+        ("CIT", "JER", 0, 2),
+        ("cit", "jer", True, 0),
+        ("cit", "jer", 1.9, 0),
+    ]
+    results = list(calculate_fares(iter(journeys), max_workers=2, window=2))
+
+    assert [(r["from"], r["to"]) for r in results] == [j[:2] for j in journeys]
+    assert results[0] == {
+        "from": "cit",
+        "to": "jer",
+        "adults": 2,
+        "children": 1,
+        "fare_peak": "7.50",
+        "fare_offpeak": "6.90",
+        "zones_travelled": "3",
+        "error": None,
+    }
+    assert results[1]["fare_peak"] == "3.00"
+    assert results[2]["fare_peak"] == "3.00"
+    assert results[7]["fare_offpeak"] == "3.00"
+    assert isinstance(results[3]["error"], LuasStopsNotOnSameLine)
+    assert isinstance(results[4]["error"], LuasStopNotFound)
+    assert isinstance(results[5]["error"], ValueError)
+    assert isinstance(results[6]["error"], ValueError)
+    assert isinstance(results[8]["error"], ValueError)
+    assert isinstance(results[9]["error"], ValueError)
+    assert results[3]["fare_peak"] is None
+
+    # one catalog and one adult and child fare for the only unknown pair
+    assert mock_transport.get.call_count == 3
+    fares.reset_fare_matrix()
+    assert fares.get_fare_matrix()["CIT:JER"][:5] == [
+        "3.00",
+        "2.70",
+        "1.50",
+        "1.50",
+        "3",
+    ]
+    assert fares.is_fresh(fares.get_fare_matrix()["CIT:JER"])
+
+    list(calculate_fares([("jer", "cit", 1, 1)]))
+    assert mock_transport.get.call_count == 3
+
+    # failed pairs are reported and not stored, unknown pairs aren't fetched offline
+    mock_transport.get.side_effect = TimeoutError
+    results = list(calculate_fares([("tpt", "jer", 1, 0)]))
+    assert isinstance(results[0]["error"], TimeoutError)
+    assert "JER:TPT" not in fares.get_fare_matrix()
+
+    config.catalog["offline"] = True
+    results = list(calculate_fares([("tpt", "jer", 1, 0), ("cit", "jer", 1, 0)]))
+    assert isinstance(results[0]["error"], LuasCatalogNotFound)
+    assert results[1]["error"] is None
+
+
+def network_feed(release):
+    """Answer forecasts with one message per line, TPT late and BRO missing"""
+
+    def feed(url, *args, **kwargs):
+        if "action=forecast" not in url:
+            return fake_feed(url)
+        stop = url.split("stop=")[1].split("&")[0]
+        if stop == "TPT":
+            release.wait(5)
+        if stop == "BRO":
+            raise TimeoutError("timed out")
+        message = "Services operating normally"
+        if stop == "JER":
+            message = "Lifts out of service"
+        return mock.Mock(
+            text='<stopInfo created="2020-11-01T17:24:37" stop="'
+            + stop
+            + '" stopAbv="'
+            + stop
+            + '"><message>'
+            + message
+            + '</message><direction name="Inbound">'
+            + '<tram dueMins="2" destination="Tallaght" /></direction></stopInfo>'
+        )
+
+    return feed
+
+
+@patch("luascli.luas.transport")
+def test_get_network(mock_transport):
+    """Test if a line snapshot collapses messages and marks late stops"""
+    release = threading.Event()
+    mock_transport.get.side_effect = network_feed(release)
+
+    try:
+        network = get_network("red", max_workers=2, deadline=0.5)
+        # the late stop must not keep the process alive
+        assert all(
+            thread.daemon
+            for thread in threading.enumerate()
+            if thread is not threading.main_thread()
+        )
+    finally:
+        release.set()
+
+    for call in mock_transport.get.call_args_list:
+        if "action=forecast" in call[0][0]:
+            assert 0 < call[1]["timeout"][0] <= 0.5
+
+    assert network["line"] == "red"
+    assert [r["stop"] for r in network["stops"]] == ["TPT", "SDK", "CIT", "JER"]
+    assert network["messages"] == [
+        {"message": "Services operating normally", "stops": ["SDK", "CIT"]},
+        {"message": "Lifts out of service", "stops": ["JER"]},
+    ]
+    assert network["stops"][0]["missed"] is True
+    assert network["stops"][0]["timetable"] is None
+    assert network["stops"][1] == {
+        "stop": "SDK",
+        "name": "Spencer Dock",
+        "timetable": {"inbound": [{"dueMins": "2", "destination": "Tallaght"}]},
+        "error": None,
+        "missed": False,
+    }
+
+    network = get_network("green", deadline=5)
+    assert isinstance(network["stops"][0]["error"], TimeoutError)
+    assert network["messages"] == [
+        {"message": "Services operating normally", "stops": ["RAN"]}
+    ]
+    lines = format_network(network)
+    assert lines[:3] == [
+        "Services operating normally (RAN)",
+        "",
+        "BRO - Broombridge",
+    ]
+    assert lines[3] == "Couldn't get the forecast: timed out"
+
+    with pytest.raises(KeyError):
+        get_network("blue")
+
+
+@patch("luascli.luas.transport")
+def test_get_forecast_coalesced(mock_transport):
+    """Test if concurrent forecasts of one stop share a single request"""
+    release = threading.Event()
+
+    def slow_feed(url, *args, **kwargs):
+        release.wait(5)
+        return mock.Mock(text="""
+            <stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
+            <message>Green Line services operating normally</message>
+            <direction name="Inbound"><tram dueMins="2" destination="Broombridge" /></direction>
+            </stopInfo>
+            """)
+
+    mock_transport.get.side_effect = slow_feed
+    singleflight.reset_stats()
+
+    def release_when_all_waiting():
+        while singleflight.stats()["forecast"]["calls"] < 4:
+            time.sleep(0.001)
+        release.set()
+
+    threading.Thread(target=release_when_all_waiting).start()
+    results = get_timetables(["ran", "RAN", "ran", "Ran"], max_workers=4)
+
+    assert mock_transport.get.call_count == 1
+    assert all(r["timetable"] == results[0]["timetable"] for r in results)
+    assert singleflight.stats()["forecast"] == {
+        "calls": 4,
+        "executed": 1,
+        "deduplicated": 3,
+    }
+
+
+@patch("luascli.luas.transport")
+def test_get_stop_records(mock_transport):
+    """Test if get_stop_records() returns shared typed records of a line"""
+    mock_transport.get.return_value.text = STOPS_XML
+
+    records = get_stop_records("green")
+    assert records == [
+        Stop("BRO", "Broombridge", False, False, 53.37223956, -6.29768465),
+        Stop("RAN", "Ranelagh", False, True, 53.32636, -6.25618),
+    ]
+    assert [r.as_dict() for r in records] == get_stops("green")
+    assert get_stop_records("green")[0] is records[0]
+    assert max(get_stop_records("red"), key=lambda s: s.lat).abrev == "SDK"
+    mock_transport.get.assert_called_once()
+
+    with pytest.raises(KeyError):
+        get_stop_records("blue")
+
+
+@patch("luascli.luas.transport")
+def test_get_timetable_records(mock_transport):
+    """Test if get_timetable_records() parses the due minutes"""
+    mock_transport.get.return_value.text = """
+        <stopInfo created="2020-10-28T21:51:58" stop="Ranelagh" stopAbv="RAN">
+            <message>Green Line services operating normally</message>
+            <direction name="Inbound"><tram dueMins="10" destination="Broombridge" /></direction>
+            <direction name="Outbound"><tram dueMins="7" destination="Bride's Glen" /><tram dueMins="DUE" destination="Sandyford" /></direction>
+        </stopInfo>
+    """
+
+    timetable = get_timetable_records("ran")
+    assert timetable["inbound"] == [Tram(10, "Broombridge")]
+    assert sorted(timetable["outbound"]) == [
+        Tram(0, "Sandyford"),
+        Tram(7, "Bride's Glen"),
+    ]
+
+
+@patch("luascli.luas.transport")
+def test_get_nearest_stops(mock_transport):
+    """Test if the nearest stops of one or many points come from one index"""
+    mock_transport.get.return_value.text = STOPS_XML
+
+    found = get_nearest_stops(53.3264, -6.2562)
+    assert [(f.line, f.stop.abrev) for f in found] == [
+        ("green", "RAN"),
+        ("red", "JER"),
+        ("red", "SDK"),
+    ]
+    assert found[0].distance < 10
+
+    assert get_nearest_stops(53.3264, -6.2562, 1, 10) == found[:1]
+    assert get_nearest_stops(53.3264, -6.2562, 3, 1) == []
+
+    batch = get_nearest_stops_batch([(53.3264, -6.2562), (53.2878, -6.4189)], 1)
+    assert [[f.stop.abrev for f in stops] for stops in batch] == [["RAN"], ["CIT"]]
+    mock_transport.get.assert_called_once()
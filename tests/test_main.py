@@ -1,4 +1,6 @@
 from click.testing import CliRunner
+import ast
+import json
 
 from luascli.main import luas
 from luascli.exceptions import (
@@ -6,8 +8,10 @@ from luascli.exceptions import (
     LuasLineNotFound,
     AddressLocationNotFound,
 )
+from luascli import config
+from conftest import STOPS_XML, fake_feed
 import mock
-
+import requests
 
 runner = CliRunner()
 
@@ -24,9 +28,32 @@ def test_stops():
     assert response.exit_code == 1
 
 
+@mock.patch("luascli.luas.transport")
+def test_refresh_and_offline(mock_transport):
+    """Test if luas refresh stores the catalog used by luas --offline"""
+    mock_transport.get.return_value.text = STOPS_XML
+
+    response = runner.invoke(luas, ["--offline", "stops", "red"])
+    assert response.exit_code == 4
+
+    response = runner.invoke(luas, ["--offline", "refresh"])
+    assert response.exit_code == 4
+    mock_transport.get.assert_not_called()
+
+    response = runner.invoke(luas, ["refresh"])
+    assert response.exit_code == 0
+    assert response.output == "Stop catalog refreshed: 6 stops\n"
+
+    response = runner.invoke(luas, ["--offline", "stops", "red"])
+    assert response.exit_code == 0
+    assert "Citywest Campus" in response.output
+    assert config.catalog["offline"] is True
+    mock_transport.get.assert_called_once()
+
+
 def test_status():
     """Test if running luas <line> status returns successfull with a valid result"""
-    with mock.patch("luascli.main.get_status") as mock_get_status:
+    with mock.patch("luascli.luas.get_status") as mock_get_status:
         mock_get_status.return_value = "Red Line services operating normally"
         response = runner.invoke(luas, ["status", "red"])
         assert response.exit_code == 0
@@ -40,7 +67,7 @@ def test_status():
     assert response.exit_code == 1
     assert response.output == "The stop somethingelse doesn't exist\n"
 
-    with mock.patch("luascli.main.get_status", side_effect=TimeoutError):
+    with mock.patch("luascli.luas.get_status", side_effect=TimeoutError):
         response = runner.invoke(luas, ["status", "somethingelse"])
         assert response.exit_code == 2
 
@@ -58,11 +85,11 @@ def test_map(mock_click):
     response = runner.invoke(luas, ["map", "ran"])
     assert response.exit_code == 0
 
-    with mock.patch("luascli.main.get_stop_detail", side_effect=LuasStopNotFound):
+    with mock.patch("luascli.luas.get_stop_detail", side_effect=LuasStopNotFound):
         response = runner.invoke(luas, ["map", "ran"])
         assert response.exit_code == 1
 
-    with mock.patch("luascli.main.find_line_by_stop", side_effect=LuasLineNotFound):
+    with mock.patch("luascli.luas.find_line_by_stop", side_effect=LuasLineNotFound):
         response = runner.invoke(luas, ["map", "somethingelse"])
         assert response.exit_code == 1
 
@@ -78,12 +105,12 @@ def test_address():
     assert response.exit_code == 0
     assert response.stdout.startswith("Full address: ") is True
 
-    with mock.patch("luascli.main.get_address", side_effect=LuasStopNotFound):
+    with mock.patch("luascli.luas.get_address", side_effect=LuasStopNotFound):
         response = runner.invoke(luas, ["address", "cit"])
         assert response.exit_code == 1
 
     with mock.patch(
-        "luascli.main.get_address", side_effect=AddressLocationNotFound("1", "2")
+        "luascli.luas.get_address", side_effect=AddressLocationNotFound("1", "2")
     ):
         response = runner.invoke(luas, ["address", "cit"])
         assert response.exit_code == 2
@@ -107,7 +134,7 @@ def test_timetable():
     response = runner.invoke(luas, ["time", "cit", "--format", "somethingelse"])
     assert response.exit_code == 3
 
-    with mock.patch("luascli.main.get_timetable", side_effect=LuasStopNotFound):
+    with mock.patch("luascli.luas.get_timetable", side_effect=LuasStopNotFound):
         response = runner.invoke(luas, ["time", "cit", "--format", "text"])
         assert response.exit_code == 1
 
@@ -181,3 +208,406 @@ def test_fare_calculator():
         ],
     )
     assert response.exit_code == 3
+
+
+@mock.patch("luascli.luas.transport")
+def test_fare_http_calls(mock_transport):
+    """Test if luas fare downloads the catalog once and calls farecalc once"""
+    mock_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["fare", "cit", "jer", "--adults", "2"])
+    assert response.exit_code == 0
+    assert response.stdout.startswith("From: Citywest Campus\nTo: James's\n")
+    assert mock_transport.get.call_count == 2
+
+    response = runner.invoke(luas, ["fare", "cit", "ran"])
+    assert response.exit_code == 1
+    assert response.stdout == "The Luas stops cit and ran are not on the same line.\n"
+    assert mock_transport.get.call_count == 2
+
+
+def test_timetable_many_stops():
+    """Test if luas time reports every stop in order, including failures"""
+
+    def fake_timetables(stops, max_workers):
+        return [
+            {"stop": "ran", "timetable": {"inbound": []}, "error": None},
+            {"stop": "xyz", "timetable": None, "error": LuasStopNotFound("xyz")},
+            {"stop": "cit", "timetable": None, "error": TimeoutError("timed out")},
+            {
+                "stop": "tpt",
+                "timetable": {
+                    "outbound": [{"destination": "Saggart", "dueMins": "DUE"}]
+                },
+                "error": None,
+            },
+        ]
+
+    with mock.patch("luascli.luas.get_timetables", side_effect=fake_timetables):
+        response = runner.invoke(luas, ["time", "ran", "xyz", "cit", "tpt"])
+        assert response.exit_code == 1
+        assert response.output == (
+            "RAN\n"
+            "Inbound\n"
+            "XYZ\n"
+            "The Luas stop xyz doesn't exist.\n"
+            "CIT\n"
+            "Couldn't get the timetable of the Luas stop cit: timed out\n"
+            "TPT\n"
+            "Outbound\n"
+            "\tDestination: Saggart - Due: DUE\n"
+        )
+
+        response = runner.invoke(
+            luas, ["time", "ran", "xyz", "cit", "tpt", "-f", "json"]
+        )
+        assert response.exit_code == 1
+        assert "The Luas stop xyz doesn't exist.\n" in response.stderr
+        assert "timed out" in response.stderr
+        assert response.stdout.startswith("{'ran': {'inbound': []},\n 'tpt'")
+        assert sorted(ast.literal_eval(response.stdout)) == ["ran", "tpt"]
+
+
+def test_network():
+    """Test if luas network prints a snapshot of the line and flags failures"""
+    snapshot = {
+        "line": "green",
+        "messages": [{"message": "Services operating normally", "stops": ["RAN"]}],
+        "stops": [
+            {
+                "stop": "BRO",
+                "name": "Broombridge",
+                "timetable": None,
+                "error": None,
+                "missed": True,
+            },
+            {
+                "stop": "RAN",
+                "name": "Ranelagh",
+                "timetable": {"inbound": []},
+                "error": None,
+                "missed": False,
+            },
+        ],
+    }
+
+    with mock.patch("luascli.luas.get_network", return_value=snapshot) as get:
+        response = runner.invoke(luas, ["network", "green", "-w", "2", "-d", "1.5"])
+        get.assert_called_once_with("green", 2, 1.5)
+        assert response.exit_code == 1
+        assert response.output == (
+            "\nLuas Green Line\n\n"
+            "Services operating normally (RAN)\n"
+            "\nBRO - Broombridge\nNo forecast before the deadline\n"
+            "\nRAN - Ranelagh\nInbound\n"
+        )
+
+        snapshot["stops"] = snapshot["stops"][1:]
+        response = runner.invoke(luas, ["network", "green", "-f", "json"])
+        assert response.exit_code == 0
+        assert response.output.startswith("{'line': 'green'")
+
+    response = runner.invoke(luas, ["network", "green", "-f", "xml"])
+    assert response.exit_code == 3
+
+    with mock.patch("luascli.luas.get_network", side_effect=KeyError("blue")):
+        response = runner.invoke(luas, ["network", "blue"])
+        assert response.exit_code == 1
+        assert response.output == "The line blue doesn't exist\n"
+
+
+@mock.patch("luascli.transport.get_session")
+def test_connection_errors(mock_get_session, monkeypatch):
+    """Test if timeouts of the real transport end in exit code 2"""
+    monkeypatch.setitem(config.http, "retries", 0)
+    monkeypatch.setitem(config.http, "serve_stale", False)
+    mock_get_session.return_value.get.side_effect = requests.ReadTimeout()
+
+    for command in (["status", "ran"], ["info", "ran"]):
+        response = runner.invoke(luas, command)
+        assert response.exit_code == 2
+        assert response.output.startswith("Can't connect to ")
+
+    mock_get_session.return_value.get.side_effect = requests.ConnectionError()
+    response = runner.invoke(luas, ["fare", "cit", "jer"])
+    assert response.exit_code == 2
+    assert response.output.startswith("Can't connect to ")
+
+
+@mock.patch("luascli.luas.transport")
+def test_info(mock_transport):
+    """Test if luas info prints the status and the timetable from one request"""
+    mock_transport.get.return_value.text = """
+    <stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
+    <message>Green Line services operating normally</message>
+    <direction name="Inbound"><tram dueMins="2" destination="Broombridge" /></direction>
+    <direction name="Outbound"><tram dueMins="7" destination="Bride's Glen" /></direction>
+    </stopInfo>
+    """
+
+    response = runner.invoke(luas, ["info", "ran"])
+    assert response.exit_code == 0
+    assert response.output == (
+        "Green Line services operating normally\n"
+        "Inbound\n"
+        "\tDestination: Broombridge - Due: 2\n"
+        "Outbound\n"
+        "\tDestination: Bride's Glen - Due: 7\n"
+    )
+    mock_transport.get.assert_called_once()
+
+    response = runner.invoke(luas, ["info", "ran", "--format", "json"])
+    assert response.exit_code == 0
+    assert response.output.startswith("{'created': '2020-11-01T17:24:37',")
+
+    response = runner.invoke(luas, ["info", "ran", "--format", "somethingelse"])
+    assert response.exit_code == 3
+
+    mock_transport.get.return_value.text = "<error></error>"
+    response = runner.invoke(luas, ["info", "somethingelse"])
+    assert response.exit_code == 1
+    assert response.output == "The Luas stop somethingelse doesn't exist.\n"
+
+
+@mock.patch("luascli.util.transport")
+@mock.patch("luascli.luas.transport")
+def test_address_all(mock_transport, mock_util_transport):
+    """Test if luas address --all stores every address for offline use"""
+    mock_transport.get.side_effect = fake_feed
+    mock_util_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["--offline", "address", "--all"])
+    assert response.exit_code == 4
+
+    response = runner.invoke(luas, ["address", "--all"])
+    assert response.exit_code == 0
+    assert response.output.startswith("TPT: Ranelagh, Dublin, D06 Y027, Ireland\n")
+    assert response.output.endswith("Addresses stored: 6, failed: 0\n")
+
+    response = runner.invoke(luas, ["--offline", "address", "ran"])
+    assert response.exit_code == 0
+    assert "Postcode: D06 Y027\n" in response.output
+    assert mock_util_transport.get.call_count == 6
+
+    response = runner.invoke(luas, ["address"])
+    assert response.exit_code == 2
+
+    mock_util_transport.get.side_effect = None
+    mock_util_transport.get.return_value.text = (
+        "<reversegeocode><error>Unable to geocode</error></reversegeocode>"
+    )
+    with mock.patch("luascli.util.get_cached_address", return_value=None), mock.patch(
+        "luascli.luas.get_cached_address", return_value=None
+    ):
+        response = runner.invoke(luas, ["address", "--all"])
+        assert response.exit_code == 2
+        assert response.output.startswith("TPT: Address location not found\n")
+        assert response.output.endswith("Addresses stored: 0, failed: 6\n")
+
+
+@mock.patch("luascli.luas.transport")
+def test_catalog(mock_transport, tmp_path):
+    """Test if luas catalog build/verify/import round trips a bundle"""
+    mock_transport.get.side_effect = fake_feed
+    path = str(tmp_path / "catalog.json.gz")
+
+    response = runner.invoke(luas, ["--offline", "catalog", "build", "-o", path])
+    assert response.exit_code == 4
+
+    response = runner.invoke(luas, ["catalog", "build", "-o", path])
+    assert response.exit_code == 0
+    assert response.output.startswith("Catalog bundle written to " + path + "\n")
+    assert "Red line stops: 4\nGreen line stops: 2\nAddresses: 0\nFares: 0\n" in (
+        response.output
+    )
+
+    response = runner.invoke(luas, ["catalog", "verify", path])
+    assert response.exit_code == 0
+    assert response.output.startswith("Catalog bundle " + path + " is valid\n")
+
+    config.cache["dir"] = str(tmp_path / "device")
+    response = runner.invoke(luas, ["--offline", "catalog", "import", path])
+    assert response.exit_code == 0
+    assert response.output.startswith("Catalog bundle " + path + " imported\n")
+
+    response = runner.invoke(luas, ["--offline", "stops", "green"])
+    assert response.exit_code == 0
+    assert "Ranelagh" in response.output
+    mock_transport.get.assert_called_once()
+
+    with open(path, "w") as f:
+        f.write("not gzip")
+    for command in ("verify", "import"):
+        response = runner.invoke(luas, ["catalog", command, path])
+        assert response.exit_code == 1
+        assert response.output.startswith("Invalid catalog bundle " + path + ": ")
+
+
+def test_timetable_watch():
+    """Test if luas time --watch hands the options over to the watch loop"""
+
+    with mock.patch("luascli.watch.watch_timetables") as mock_watch:
+        response = runner.invoke(
+            luas, ["time", "ran", "cit", "--watch", "-i", "5", "--max-interval", "60"]
+        )
+        assert response.exit_code == 0
+        args = mock_watch.call_args.args
+        assert args[0] == ("ran", "cit")
+        assert args[2:] == (5, 60, config.concurrency["max_workers"])
+
+        args[1]("Inbound\n")
+        assert response.output == ""
+
+        mock_watch.side_effect = KeyboardInterrupt
+        response = runner.invoke(luas, ["time", "ran", "--watch"])
+        assert response.exit_code == 0
+
+        response = runner.invoke(luas, ["time", "ran", "--watch", "-f", "json"])
+        assert response.exit_code == 3
+
+
+@mock.patch("luascli.luas.transport")
+def test_fare_matrix(mock_transport):
+    """Test if luas fare-matrix lets luas fare run offline"""
+    mock_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["--offline", "fare-matrix"])
+    assert response.exit_code == 4
+
+    response = runner.invoke(luas, ["fare-matrix", "--workers", "2"])
+    assert response.exit_code == 0
+    assert response.output == (
+        "Stop pairs: 7, fetched: 7, already stored: 0, failed: 0\n"
+    )
+
+    response = runner.invoke(
+        luas, ["--offline", "fare", "cit", "jer", "-a", "2", "-c", "1"]
+    )
+    assert response.exit_code == 0
+    assert "Fare peak: 7.50\n" in response.output
+    assert mock_transport.get.call_count == 1 + 7 * 2
+
+    response = runner.invoke(luas, ["--offline", "fare", "cit", "cit"])
+    assert response.exit_code == 4
+    assert response.output.startswith("No local fare available")
+
+    mock_transport.get.side_effect = TimeoutError
+    response = runner.invoke(luas, ["fare-matrix", "--refresh"])
+    assert response.exit_code == 2
+    assert response.output.endswith("failed: 7\n")
+
+
+@mock.patch("luascli.luas.transport")
+def test_fare_batch(mock_transport):
+    """Test if luas fare --batch streams the fares of a file of journeys"""
+    mock_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["fare"])
+    assert response.exit_code == 2
+
+    journeys = "from,to,adults,children\ncit,jer,2,1\njer,cit,1,0\n"
+    response = runner.invoke(luas, ["fare", "--batch", "-"], input=journeys)
+    assert response.exit_code == 0
+    assert response.stdout == (
+        "from,to,adults,children,fare_peak,fare_offpeak,zones_travelled,error\n"
+        "cit,jer,2,1,7.50,6.90,3,\n"
+        "jer,cit,1,0,3.00,2.70,3,\n"
+    )
+    assert response.stderr == "Journeys: 2, failed: 0\n"
+    assert mock_transport.get.call_count == 3
+
+    journeys = '{"from": "cit", "to": "ran"}\n{"from": "tpt", "to": "sdk"}\n'
+    response = runner.invoke(
+        luas, ["fare", "--batch", "-", "-f", "json", "-w", "1"], input=journeys
+    )
+    assert response.exit_code == 1
+    lines = response.stdout.splitlines()
+    assert json.loads(lines[0])["error"] == (
+        "The Luas stops cit and ran are not on the same line."
+    )
+    assert json.loads(lines[1])["zones_travelled"] == "3"
+    assert response.stderr == "Journeys: 2, failed: 1\n"
+
+    response = runner.invoke(luas, ["fare", "--batch", "-", "-f", "xml"], input="")
+    assert response.exit_code == 3
+
+
+def test_serve():
+    """Test if luas serve starts the HTTP server on the requested port"""
+
+    with mock.patch("luascli.server.make_server") as mock_make_server:
+        httpd = mock_make_server.return_value
+        httpd.server_address = ("127.0.0.1", 9000)
+        httpd.server_port = 9000
+        httpd.serve_forever.side_effect = KeyboardInterrupt
+
+        response = runner.invoke(luas, ["serve", "--port", "9000"])
+        assert response.exit_code == 0
+        assert response.output == "Serving on http://127.0.0.1:9000\n"
+        mock_make_server.assert_called_once_with("127.0.0.1", 9000)
+        httpd.server_close.assert_called_once()
+
+        with mock.patch("luascli.metrics.enable") as mock_enable:
+            response = runner.invoke(luas, ["serve"])
+            assert response.exit_code == 0
+            mock_enable.assert_not_called()
+
+            response = runner.invoke(luas, ["serve", "--metrics"])
+            assert response.exit_code == 0
+            mock_enable.assert_called_once_with()
+
+
+@mock.patch("luascli.luas.transport")
+def test_trace(mock_transport):
+    """Test if --trace prints the breakdown of the command to stderr"""
+    mock_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["--trace", "stops", "red"])
+    assert response.exit_code == 0
+    assert "parse stops" in response.stderr
+    assert "miss disk stops.json" in response.stderr
+    assert "trace: total" in response.stderr
+
+    response = runner.invoke(luas, ["stops", "red"])
+    assert response.exit_code == 0
+    assert "trace:" not in response.stderr
+
+
+@mock.patch("luascli.luas.transport")
+def test_nearest(mock_transport):
+    """Test if luas nearest lists the closest stops of a location"""
+    mock_transport.get.side_effect = fake_feed
+
+    response = runner.invoke(luas, ["nearest", "53.3264", "-6.2562", "-n", "2"])
+    assert response.exit_code == 0
+    lines = response.output.splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith(" m  RAN  Ranelagh (green line)")
+    assert lines[1].endswith(" m  JER  James's (red line)")
+
+    response = runner.invoke(luas, ["nearest", "-f", "json", "53.3264", "-6.2562"])
+    assert response.exit_code == 0
+    assert "'abrev': 'RAN'" in response.output
+    assert "'line': 'green'" in response.output
+
+    response = runner.invoke(luas, ["nearest", "53.3264", "west"])
+    assert response.exit_code == 2
+
+    response = runner.invoke(luas, ["nearest", "53.3264", "-6.2562", "-n", "0"])
+    assert response.exit_code == 2
+
+
+@mock.patch("luascli.luas.transport")
+def test_workers_range(mock_transport):
+    """Test if a number of workers below 1 is rejected before any request"""
+    for args in (
+        ["time", "cit", "-w", "0"],
+        ["network", "red", "-w", "0"],
+        ["fare-matrix", "-w", "-1"],
+        ["fare", "--batch", "-", "-w", "0"],
+    ):
+        response = runner.invoke(luas, args, input="cit,jer,1,0\n")
+        assert response.exit_code == 2
+        assert "Invalid value" in response.output
+
+    mock_transport.get.assert_not_called()
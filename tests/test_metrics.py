@@ -0,0 +1,110 @@
+from luascli import luas, metrics, trace
+from luascli.exceptions import LuasStopNotFound
+from conftest import fake_feed
+import mock
+import pytest
+
+
+def test_registry():
+    """Test if counters and histograms are kept per name and labels"""
+    registry = metrics.Registry()
+    registry.inc("requests", {"endpoint": "stops"})
+    registry.inc("requests", {"endpoint": "stops"}, 2)
+    registry.inc("requests", {"endpoint": "forecast"})
+    registry.observe("duration", {"endpoint": "stops"}, 0.003)
+    registry.observe("duration", {"endpoint": "stops"}, 20)
+
+    snapshot = registry.snapshot()
+    assert snapshot["counters"]["requests"] == [
+        {"labels": {"endpoint": "forecast"}, "value": 1},
+        {"labels": {"endpoint": "stops"}, "value": 3},
+    ]
+    histogram = snapshot["histograms"]["duration"][0]
+    assert histogram["count"] == 2
+    assert histogram["sum"] == 20.003
+    assert histogram["buckets"]["0.001"] == 0
+    assert histogram["buckets"]["0.005"] == 1
+    assert histogram["buckets"]["10.0"] == 1
+    assert histogram["buckets"]["+Inf"] == 2
+
+    registry.reset()
+    assert registry.snapshot()["counters"] == {}
+
+
+def test_endpoint():
+    """Test if upstream URLs are labelled by action or path"""
+    assert metrics.endpoint("https://a/xml/get.ashx?action=stops&encrypt=false") == (
+        "stops"
+    )
+    assert metrics.endpoint("https://a/reverse?format=xml&lat=1&lon=2") == "reverse"
+
+
+@mock.patch("luascli.luas.transport")
+def test_disabled(mock_transport):
+    """Test if nothing is collected unless metrics are enabled"""
+    mock_transport.get.side_effect = fake_feed
+
+    luas.get_stops("red")
+    trace.record("http", url="http://a/x", status=200, bytes=1, duration=0.1)
+    assert metrics.snapshot() == {
+        "counters": {},
+        "histograms": {},
+        "cache_hit_ratio": {},
+    }
+
+
+@mock.patch("luascli.luas.transport")
+def test_instrumented(mock_transport):
+    """Test if calls, errors by exception type, parses and cache lookups count"""
+    mock_transport.get.side_effect = fake_feed
+    metrics.enable()
+
+    luas.get_stops("red")
+    luas.get_stops("green")
+    with pytest.raises(LuasStopNotFound):
+        luas.get_stop_detail("ran", "red")
+    trace.record("http", url="http://a/reverse", status=200, bytes=1, duration=0.1)
+
+    counters = metrics.snapshot()["counters"]
+    assert {"labels": {"function": "get_stops"}, "value": 2} in counters[
+        "luascli_calls_total"
+    ]
+    assert counters["luascli_errors_total"] == [
+        {
+            "labels": {"exception": "LuasStopNotFound", "function": "get_stop_detail"},
+            "value": 1,
+        }
+    ]
+    assert counters["luascli_http_requests_total"] == [
+        {"labels": {"endpoint": "reverse", "status": "200"}, "value": 1}
+    ]
+    histograms = metrics.snapshot()["histograms"]
+    assert histograms["luascli_parse_duration_seconds"][0]["labels"] == {
+        "document": "stops"
+    }
+    assert metrics.snapshot()["cache_hit_ratio"] == {"disk": 0.0}
+
+
+def test_to_prometheus():
+    """Test if the registry is exported in the Prometheus text format"""
+    metrics.enable()
+    trace.record("http", url="http://a/reverse", status=200, bytes=1, duration=0.02)
+    trace.record("cache", name="fares", key="CIT:JER", result="hit")
+    trace.record("cache", name="fares", key="CIT:TPT", result="miss")
+
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE luascli_http_requests_total counter" in lines
+    assert 'luascli_http_requests_total{endpoint="reverse",status="200"} 1' in lines
+    assert "# TYPE luascli_http_request_duration_seconds histogram" in lines
+    assert (
+        'luascli_http_request_duration_seconds_bucket{endpoint="reverse",le="0.01"} 0'
+        in lines
+    )
+    assert (
+        'luascli_http_request_duration_seconds_bucket{endpoint="reverse",le="0.025"} 1'
+        in lines
+    )
+    assert 'luascli_http_request_duration_seconds_count{endpoint="reverse"} 1' in lines
+    assert 'luascli_cache_lookups_total{cache="fares",result="hit"} 1' in lines
+    assert metrics.snapshot()["cache_hit_ratio"] == {"fares": 0.5}
+    assert '"cache_hit_ratio"' in metrics.to_json()
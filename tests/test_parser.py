@@ -0,0 +1,83 @@
+from luascli.parser import parse_stops, parse_forecast, parse_fare
+from luascli.util import xml_to_dict
+from xml.parsers.expat import ExpatError
+from conftest import STOPS_XML, FARE_XML
+import pytest
+
+
+def test_parse_stops():
+    """Test if parse_stops returns the stop records of every line"""
+
+    lines = parse_stops(STOPS_XML)
+    assert sorted(lines.keys()) == ["Luas Green Line", "Luas Red Line"]
+    assert lines["Luas Green Line"][1] == {
+        "abrev": "RAN",
+        "text": "Ranelagh",
+        "park_ride": "0",
+        "cycle_ride": "1",
+        "lat": "53.32636",
+        "lon": "-6.25618",
+    }
+
+    # same records as the generic xmltodict conversion
+    doc = xml_to_dict(STOPS_XML)
+    red = doc["stops"]["line"][0]["stop"]
+    assert [s["abrev"] for s in lines["Luas Red Line"]] == [s["@abrev"] for s in red]
+    assert [s["lon"] for s in lines["Luas Red Line"]] == [s["@long"] for s in red]
+
+    assert parse_stops("<somethingelse />") == {}
+
+    with pytest.raises(ExpatError):
+        parse_stops("Not a valid xml")
+
+
+def test_parse_forecast():
+    """Test if parse_forecast normalises single trams and missing elements"""
+
+    forecast = parse_forecast("""
+        <stopInfo created="2020-10-28T21:51:58" stop="Ranelagh" stopAbv="RAN">
+            <message>
+                Green Line services operating normally
+            </message>
+            <direction name="Inbound"><tram dueMins="10" destination="Broombridge" /></direction>
+            <direction name="Outbound">
+                <tram dueMins="DUE" destination="Sandyford" />
+                <tram dueMins="7" destination="Bride's Glen" />
+            </direction>
+        </stopInfo>
+        """)
+    assert forecast == {
+        "stop": "Ranelagh",
+        "stop_abrev": "RAN",
+        "created": "2020-10-28T21:51:58",
+        "message": "Green Line services operating normally",
+        "timetable": {
+            "inbound": [{"dueMins": "10", "destination": "Broombridge"}],
+            "outbound": [
+                {"dueMins": "DUE", "destination": "Sandyford"},
+                {"dueMins": "7", "destination": "Bride's Glen"},
+            ],
+        },
+    }
+
+    forecast = parse_forecast(
+        '<stopInfo stop="Ranelagh"><direction name="Inbound" /></stopInfo>'
+    )
+    assert forecast["message"] is None
+    assert forecast["timetable"] == {"inbound": []}
+
+    assert parse_forecast("<error><message>Oops</message></error>") is None
+
+    with pytest.raises(ExpatError):
+        parse_forecast("Not a valid xml")
+
+
+def test_parse_fare():
+    """Test if parse_fare returns the fares and the zones travelled"""
+
+    assert parse_fare(FARE_XML) == {
+        "fare_peak": "7.50",
+        "fare_offpeak": "6.90",
+        "zones_travelled": "3",
+    }
+    assert parse_fare("<farecalc />") is None
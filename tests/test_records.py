@@ -0,0 +1,80 @@
+from luascli.records import Stop, Tram, stop_records, timetable_records
+import pytest
+
+STOP = {
+    "abrev": "CIT",
+    "text": "Citywest Campus",
+    "park_ride": "1",
+    "cycle_ride": "0",
+    "lat": "53.28783255",
+    "lon": "-6.418914583333",
+}
+
+
+def test_stop():
+    """Test if a stop dictionary becomes a typed record and back"""
+    stop = Stop.from_dict(STOP)
+    assert stop == ("CIT", "Citywest Campus", True, False, 53.28783255, -6.418914583333)
+    assert stop.lat == 53.28783255
+    assert stop.park_ride is True
+    assert stop.as_dict() == STOP
+    assert not hasattr(stop, "__dict__")
+
+    with pytest.raises(AttributeError):
+        stop.lat = 0.0
+
+    empty = Stop.from_dict({})
+    assert empty == ("", "", False, False, 0.0, 0.0)
+
+
+def test_tram():
+    """Test if due minutes are integers with DUE mapped to 0"""
+    assert Tram.from_dict({"dueMins": "DUE", "destination": "Tallaght"}) == (
+        0,
+        "Tallaght",
+    )
+    assert Tram.from_dict({"dueMins": "12", "destination": "Saggart"}).due == 12
+    assert Tram.from_dict({"dueMins": "", "destination": "No trams forecast"}) == (
+        None,
+        "No trams forecast",
+    )
+
+    for tram in (
+        {"dueMins": "DUE", "destination": "Tallaght"},
+        {"dueMins": "5", "destination": "Tallaght"},
+        {"dueMins": "", "destination": "No trams forecast"},
+    ):
+        assert Tram.from_dict(tram).as_dict() == tram
+
+
+def test_conversions():
+    """Test if whole stop lists and timetables are converted in order"""
+    assert stop_records([STOP, dict(STOP, abrev="FOR")])[1].abrev == "FOR"
+
+    timetable = timetable_records(
+        {
+            "inbound": [
+                {"dueMins": "9", "destination": "The Point"},
+                {"dueMins": "DUE", "destination": "Connolly"},
+            ],
+            "outbound": [],
+        }
+    )
+    assert sorted(timetable["inbound"]) == [Tram(0, "Connolly"), Tram(9, "The Point")]
+    assert timetable["outbound"] == []
+
+
+def test_tram_ordering():
+    """Test if trams without a due time sort after the others"""
+    trams = [Tram(None, "No trams forecast"), Tram(3, "a"), Tram(0, "b")]
+    assert sorted(trams) == [
+        Tram(0, "b"),
+        Tram(3, "a"),
+        Tram(None, "No trams forecast"),
+    ]
+    assert max(trams) == Tram(None, "No trams forecast")
+    assert Tram(None, "a") > Tram(12, "b") >= Tram(12, "b")
+    assert Tram(0, "b") <= Tram(3, "a")
+    assert Tram(3, "a") == (3, "a")
+    with pytest.raises(TypeError):
+        Tram(3, "a") < 3
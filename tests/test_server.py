@@ -0,0 +1,185 @@
+from luascli import metrics
+from luascli.server import make_server, TTLCache
+from luascli.exceptions import LuasServiceUnavailable
+from conftest import fake_feed
+import json
+import mock
+import pytest
+import threading
+import time
+import urllib.error
+import urllib.request
+
+FORECAST_XML = """
+<stopInfo created="2020-11-01T17:24:37" stop="Ranelagh" stopAbv="RAN">
+<message>Green Line services operating normally</message>
+<direction name="Inbound"><tram dueMins="2" destination="Broombridge" /></direction>
+</stopInfo>
+"""
+
+
+@pytest.fixture
+def server():
+    """Run luas serve on a free port for the duration of a test"""
+    httpd = make_server("127.0.0.1", 0)
+    httpd.RequestHandlerClass.cache = TTLCache()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:" + str(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def get(url):
+    """Return the status and the decoded JSON body of a GET request"""
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def feed(url, *args, **kwargs):
+    if "action=forecast" in url:
+        if "stop=ran" not in url.lower():
+            return mock.Mock(text="<error />")
+        return mock.Mock(text=FORECAST_XML)
+    return fake_feed(url)
+
+
+@mock.patch("luascli.util.transport")
+@mock.patch("luascli.luas.transport")
+def test_endpoints(mock_transport, mock_util_transport, server):
+    """Test if every endpoint answers JSON from the luascli.luas functions"""
+    mock_transport.get.side_effect = feed
+    mock_util_transport.get.side_effect = feed
+
+    status, body = get(server + "/stops/red")
+    assert status == 200
+    assert [s["abrev"] for s in body] == ["TPT", "SDK", "CIT", "JER"]
+
+    assert get(server + "/status/ran") == (
+        200,
+        {"message": "Green Line services operating normally"},
+    )
+    assert get(server + "/timetable/RAN") == (
+        200,
+        {"inbound": [{"dueMins": "2", "destination": "Broombridge"}]},
+    )
+    assert get(server + "/forecast/ran")[1]["created"] == "2020-11-01T17:24:37"
+
+    status, body = get(server + "/fare?from=cit&to=jer&adults=2&children=1")
+    assert status == 200
+    assert body["fare_peak"] == "7.50"
+
+    status, body = get(server + "/address/ran")
+    assert status == 200
+    assert body["postcode"] == "D06 Y027"
+
+    # one stops, forecast, fare and address request: the rest is cached
+    urls = [c.args[0] for c in mock_transport.get.call_args_list]
+    assert len([u for u in urls if "action=forecast" in u]) == 1
+    assert len([u for u in urls if "action=stops" in u]) == 1
+    assert len([u for u in urls if "action=farecalc" in u]) == 1
+    get(server + "/fare?from=cit&to=jer&adults=2&children=1")
+    assert mock_transport.get.call_count == len(urls)
+
+
+@mock.patch("luascli.luas.transport")
+def test_errors(mock_transport, server):
+    """Test if errors are reported with a JSON body and a matching status"""
+    mock_transport.get.side_effect = feed
+
+    assert get(server + "/somethingelse")[0] == 404
+    assert get(server + "/stops/blue")[0] == 404
+    assert get(server + "/status/somethingelse")[0] == 404
+    assert get(server + "/address/somethingelse")[0] == 404
+    assert get(server + "/fare?from=cit&to=ran")[0] == 400
+    assert get(server + "/fare?from=cit&to=jer&adults=x")[0] == 400
+    assert get(server + "/fare?from=cit")[0] == 400
+
+    mock_transport.get.side_effect = TimeoutError("timed out")
+    status, body = get(server + "/timetable/ran")
+    assert status == 502
+    assert body == {"error": "Upstream error: timed out"}
+
+    mock_transport.get.side_effect = LuasServiceUnavailable("luasforecasts.rpa.ie")
+    status, body = get(server + "/timetable/cit")
+    assert status == 503
+    assert body == {"error": "Upstream unavailable: luasforecasts.rpa.ie"}
+
+
+def test_ttl_cache():
+    """Test if results expire, failures aren't cached and the size is bounded"""
+    cache = TTLCache(max_entries=2)
+    func = mock.Mock(side_effect=[1, 2, ValueError, 3, 4])
+
+    assert cache.get("a", 60, func) == 1
+    assert cache.get("a", 60, func) == 1
+    assert cache.get("b", 0, func) == 2
+    with pytest.raises(ValueError):
+        cache.get("b", 60, func)
+    assert cache.get("b", 60, func) == 3
+    assert cache.get("c", 60, func) == 4
+    assert list(cache.entries) == ["b", "c"]
+
+
+@mock.patch("luascli.luas.transport")
+def test_metrics(mock_transport, server):
+    """Test if /metrics serves the registry once metrics are enabled"""
+    mock_transport.get.side_effect = feed
+
+    assert get(server + "/metrics")[0] == 404
+
+    metrics.enable()
+    get(server + "/timetable/ran")
+    get(server + "/status/somethingelse")
+
+    with urllib.request.urlopen(server + "/metrics") as response:
+        assert response.headers["Content-Type"].startswith("text/plain")
+        text = response.read().decode("utf-8")
+    assert 'luascli_calls_total{function="get_forecast"} 2' in text
+    assert (
+        'luascli_errors_total{exception="LuasStopNotFound",function="get_forecast"} 1'
+        in text
+    )
+
+    status, body = get(server + "/metrics?format=json")
+    assert status == 200
+    assert body["counters"]["luascli_calls_total"] == [
+        {"labels": {"function": "get_forecast"}, "value": 2}
+    ]
+
+
+@mock.patch("luascli.luas.transport")
+def test_nearest(mock_transport, server):
+    """Test if /nearest lists the closest stops with their distance"""
+    mock_transport.get.side_effect = feed
+
+    status, body = get(server + "/nearest?lat=53.3264&lon=-6.2562&n=2")
+    assert status == 200
+    assert [(s["abrev"], s["line"]) for s in body] == [("RAN", "green"), ("JER", "red")]
+    assert body[0]["distance"] < 10
+
+    assert get(server + "/nearest?lat=53.3264")[0] == 400
+    assert get(server + "/nearest?lat=53.3264&lon=west")[0] == 400
+    assert get(server + "/nearest?lat=53.3264&lon=-6.2562&n=0")[0] == 400
+
+
+def test_concurrent_clients(server):
+    """Test if a burst of clients is accepted without waiting for a SYN retry"""
+    results = []
+
+    def client():
+        results.append(get(server + "/unknown")[0])
+
+    threads = [threading.Thread(target=client) for _ in range(64)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [404] * 64
+    assert time.monotonic() - start < 1
@@ -0,0 +1,80 @@
+from luascli import singleflight
+import pytest
+import threading
+import time
+
+
+def run_concurrently(group, key, func, callers):
+    """Call group.do() from several threads while the first call is running"""
+    results = [None] * callers
+
+    def caller(i):
+        try:
+            results[i] = group.do(key, func)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def test_do_coalesces_concurrent_calls():
+    """Test if concurrent callers share one call and its result"""
+    group = singleflight.Group("test-coalesce")
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return {"message": "Green Line services operating normally"}
+
+    def release_when_all_waiting():
+        while group.counters["calls"] < 5:
+            time.sleep(0.001)
+        release.set()
+
+    threading.Thread(target=release_when_all_waiting).start()
+    results = run_concurrently(group, "ran", func, 5)
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert group.counters == {"calls": 5, "executed": 1, "deduplicated": 4}
+    assert singleflight.stats()["test-coalesce"] == group.counters
+
+    # nothing is kept once the call is over
+    assert group.do("ran", lambda: "again") == "again"
+    assert group.counters["executed"] == 2
+
+    singleflight.reset_stats()
+    assert group.counters == {"calls": 0, "executed": 0, "deduplicated": 0}
+
+
+def test_do_shares_errors():
+    """Test if every coalesced caller receives the exception of the call"""
+    group = singleflight.Group("test-errors")
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+        raise TimeoutError("timed out")
+
+    def release_when_all_waiting():
+        while group.counters["calls"] < 3:
+            time.sleep(0.001)
+        release.set()
+
+    threading.Thread(target=release_when_all_waiting).start()
+    results = run_concurrently(group, "ran", func, 3)
+
+    assert all(isinstance(result, TimeoutError) for result in results)
+    assert group.counters["executed"] == 1
+
+    with pytest.raises(ValueError):
+        group.do("ran", int, "x")
+    assert group.calls == {}
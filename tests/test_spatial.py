@@ -0,0 +1,60 @@
+from luascli.records import Stop
+from luascli.spatial import StopGrid, haversine
+import math
+import random
+import pytest
+
+STOPS = [
+    ("red", Stop("TPT", "The Point", False, False, 53.34835, -6.22925833333333)),
+    ("red", Stop("SDK", "Spencer Dock", False, False, 53.3488222222222, -6.23714722)),
+    ("red", Stop("CIT", "Citywest Campus", True, True, 53.28783255, -6.418914583333)),
+    ("red", Stop("JER", "James's", False, False, 53.33369, -6.26227)),
+    ("green", Stop("BRO", "Broombridge", False, False, 53.37223956, -6.29768465)),
+    ("green", Stop("RAN", "Ranelagh", False, True, 53.32636, -6.25618)),
+]
+
+
+def brute_force(lat, lon, k):
+    return sorted(haversine(lat, lon, s.lat, s.lon) for _, s in STOPS)[:k]
+
+
+def test_haversine():
+    """Test if distances follow the great circle"""
+    assert haversine(53.34835, -6.22926, 53.34835, -6.22926) == 0
+    assert haversine(0, 0, 0, 1) == pytest.approx(111195, rel=1e-4)
+    assert haversine(0, 0, 0, 180) == pytest.approx(math.pi * 6371008.8)
+    assert haversine(53.34835, -6.22926, 53.32636, -6.25618) == pytest.approx(
+        3029, abs=1
+    )
+
+
+@pytest.mark.parametrize("cell_size", [0.001, 0.02, 1])
+def test_nearest(cell_size):
+    """Test if the grid finds the same stops as a scan of every stop"""
+    grid = StopGrid(STOPS, cell_size)
+    generator = random.Random(0)
+    points = [
+        (generator.uniform(53.2, 53.5), generator.uniform(-6.5, -6.0))
+        for _ in range(200)
+    ] + [(0.0, 0.0), (89.0, 170.0), (-45.0, -6.3)]
+
+    for lat, lon in points:
+        for k in (1, 3, 10):
+            found = grid.nearest(lat, lon, k)
+            assert [f.distance for f in found] == pytest.approx(
+                brute_force(lat, lon, k)
+            )
+
+
+def test_nearest_options():
+    """Test if results carry the line and respect count and max_distance"""
+    grid = StopGrid(STOPS, 0.02)
+
+    found = grid.nearest(53.3264, -6.2562, 2)
+    assert [(f.line, f.stop.abrev) for f in found] == [("green", "RAN"), ("red", "JER")]
+    assert found[0].distance < 10
+    assert found == sorted(found)
+
+    assert [f.stop.abrev for f in grid.nearest(53.3264, -6.2562, 5, 500)] == ["RAN"]
+    assert grid.nearest(53.3264, -6.2562, 0) == []
+    assert StopGrid([], 0.02).nearest(53.3264, -6.2562, 3) == []
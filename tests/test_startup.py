@@ -0,0 +1,23 @@
+from luascli.__version__ import __version__
+from benchmarks.bench_startup import COMMANDS, HEAVY_MODULES, import_times
+
+# luascli.main takes about 30ms to import without the command dependencies,
+# against 170ms when it pulled in requests and luascli.luas
+IMPORT_BUDGET_US = 100000
+
+
+def test_import_budget():
+    """Test if importing the command line stays within its time budget"""
+
+    code = dict(COMMANDS)["import"]
+    best = min(import_times(code)[0]["luascli.main"] for _ in range(3))
+    assert best < IMPORT_BUDGET_US
+
+
+def test_help_is_lazy():
+    """Test if --help and --version don't import the command dependencies"""
+
+    for option in ("--help", "--version"):
+        modules, elapsed, output = import_times(dict(COMMANDS)[option])
+        assert [m for m in HEAVY_MODULES if m in modules] == []
+    assert output.endswith("version " + __version__ + "\n")
@@ -0,0 +1,52 @@
+from luascli import cache, trace
+from luascli.parser import parse_fare
+from conftest import FARE_XML
+import io
+
+
+def test_record_disabled():
+    """Test if nothing is recorded unless tracing is enabled"""
+
+    trace.record("cache", name="disk", key="stops.json", result="hit")
+    assert parse_fare(FARE_XML)["fare_peak"] == "7.50"
+    assert trace.enabled() is False
+    assert trace.get_events() == []
+
+
+def test_record():
+    """Test if HTTP calls, parse times and cache lookups are recorded"""
+    trace.enable(at_exit=False)
+
+    trace.record("http", url="http://a/x", status=200, bytes=120, duration=0.25)
+    parse_fare(FARE_XML)
+    assert cache.load("stops.json") is None
+    cache.store("stops.json", {})
+    assert cache.load("stops.json") == {}
+
+    events = trace.get_events()
+    assert [e["kind"] for e in events] == ["http", "parse", "cache", "cache"]
+    assert events[1]["name"] == "farecalc"
+    assert events[1]["bytes"] == len(FARE_XML)
+    assert [e["result"] for e in events[2:]] == ["miss", "hit"]
+    assert events[0]["at"] <= events[1]["at"]
+
+    lines = trace.format_report()
+    assert "200 http://a/x 120 bytes 250.0 ms" in lines[0]
+    assert lines[-4] == "trace: http 1 calls, 120 bytes, 250.0 ms"
+    assert lines[-3].startswith("trace: parse 1 documents, ")
+    assert lines[-2] == "trace: cache 1 hits, 1 misses"
+    assert lines[-1].startswith("trace: total ")
+
+
+def test_report():
+    """Test if the report is printed once and tracing stops"""
+    trace.enable(at_exit=False)
+    trace.record("cache", name="fares", key="CIT:JER", result="miss")
+
+    output = io.StringIO()
+    trace.report(output)
+    assert "miss fares CIT:JER" in output.getvalue()
+    assert trace.enabled() is False
+
+    trace.report(output)
+    assert output.getvalue().count("trace: total") == 1
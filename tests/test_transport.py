@@ -0,0 +1,314 @@
+from luascli import config, singleflight, trace, transport
+from luascli.exceptions import LuasServiceUnavailable
+import mock
+import pytest
+import requests
+import threading
+import time
+
+
+def test_get_session(monkeypatch):
+    """Test if one pooled session is shared and can be closed"""
+
+    monkeypatch.setitem(config.http, "pool_size", 3)
+    transport.close_session()
+    try:
+        session = transport.get_session()
+        assert transport.get_session() is session
+
+        adapter = session.get_adapter("https://luasforecasts.rpa.ie")
+        assert adapter._pool_maxsize == 3
+        assert session.get_adapter("http://localhost") is adapter
+        assert "gzip" in session.headers["Accept-Encoding"]
+        assert session.headers["User-Agent"].startswith("luascli/")
+
+        transport.close_session()
+        assert transport.get_session() is not session
+    finally:
+        transport.close_session()
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get(mock_get_session):
+    """Test if get() sends the request with the configured timeouts"""
+    mock_get_session.return_value.get.return_value.status_code = 200
+
+    transport.get("https://luasforecasts.rpa.ie/xml/get.ashx")
+    mock_get_session.return_value.get.assert_called_once_with(
+        "https://luasforecasts.rpa.ie/xml/get.ashx",
+        timeout=(config.http["connect_timeout"], config.http["read_timeout"]),
+    )
+
+    transport.get("https://nominatim.openstreetmap.org/reverse", timeout=1)
+    mock_get_session.return_value.get.assert_called_with(
+        "https://nominatim.openstreetmap.org/reverse", timeout=1
+    )
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_coalesced(mock_get_session):
+    """Test if concurrent requests for the same URL share one response"""
+    release = threading.Event()
+    mock_get_session.return_value.get.side_effect = lambda url, timeout: (
+        release.wait(5) and mock.Mock(text=url, status_code=200)
+    )
+    singleflight.reset_stats()
+
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(transport.get("http://a")))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    while singleflight.stats()["http"]["calls"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert mock_get_session.return_value.get.call_count == 1
+    assert [r.text for r in responses] == ["http://a"] * 3
+    assert singleflight.stats()["http"]["deduplicated"] == 2
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Record the backoff delays instead of sleeping"""
+    delays = []
+    monkeypatch.setattr(transport.time, "sleep", delays.append)
+    return delays
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_retries(mock_get_session, no_sleep):
+    """Test if failed requests are retried with a capped backoff"""
+    ok = mock.Mock(status_code=200)
+    mock_get_session.return_value.get.side_effect = [
+        requests.ConnectionError(),
+        mock.Mock(status_code=503),
+        ok,
+    ]
+
+    assert transport.get("http://a/x") is ok
+    assert mock_get_session.return_value.get.call_count == 3
+    assert len(no_sleep) == 2
+    assert 0 <= no_sleep[0] <= config.http["backoff"]
+    assert 0 <= no_sleep[1] <= config.http["backoff"] * 2
+    assert transport.get_breakers() == {}
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_gives_up(mock_get_session, no_sleep):
+    """Test if get() raises once the retries are exhausted"""
+    mock_get_session.return_value.get.return_value = mock.Mock(status_code=500)
+
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get("http://a/x")
+    assert mock_get_session.return_value.get.call_count == config.http["retries"] + 1
+
+    mock_get_session.return_value.get.side_effect = requests.Timeout()
+    with pytest.raises(LuasServiceUnavailable) as error:
+        transport.get("http://a/x")
+    assert isinstance(error.value.__cause__, requests.Timeout)
+    assert transport.get_breakers() == {"a": {"failures": 2, "open": False}}
+
+    mock_get_session.return_value.get.side_effect = None
+    mock_get_session.return_value.get.return_value = mock.Mock(status_code=404)
+    assert transport.get("http://a/x").status_code == 404
+    assert transport.get_breakers() == {}
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_breaker(mock_get_session, no_sleep, monkeypatch):
+    """Test if the breaker fails fast and lets a trial request through"""
+    monkeypatch.setitem(config.http, "retries", 0)
+    monkeypatch.setitem(config.http, "breaker_threshold", 2)
+    clock = [1000.0]
+    monkeypatch.setattr(transport.time, "monotonic", lambda: clock[0])
+    mock_get_session.return_value.get.side_effect = requests.ConnectionError()
+
+    for _ in range(2):
+        with pytest.raises(LuasServiceUnavailable):
+            transport.get("http://a/x")
+    assert transport.get_breakers() == {"a": {"failures": 2, "open": True}}
+
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get("http://a/x")
+    assert mock_get_session.return_value.get.call_count == 2
+
+    clock[0] += config.http["breaker_reset"]
+    ok = mock.Mock(status_code=200)
+    mock_get_session.return_value.get.side_effect = [ok]
+    assert transport.get("http://a/x") is ok
+    assert transport.get_breakers() == {}
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_serves_stale(mock_get_session, no_sleep, monkeypatch):
+    """Test if the last good response is returned while the host fails"""
+    monkeypatch.setitem(config.http, "retries", 0)
+    ok = mock.Mock(status_code=200)
+    mock_get_session.return_value.get.side_effect = [ok, requests.ConnectionError()]
+
+    assert transport.get("http://a/x") is ok
+    assert transport.get("http://a/x") is ok
+
+    # a frozen forecast isn't shown as live for long
+    forecast = "http://a/get.ashx?action=forecast&stop=ran"
+    mock_get_session.return_value.get.side_effect = [ok, requests.ConnectionError()]
+    assert transport.get(forecast) is ok
+    now = time.time()
+    monkeypatch.setattr(
+        transport.time,
+        "time",
+        lambda: now + config.http["forecast_stale_max_age"] + 1,
+    )
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get(forecast)
+
+    mock_get_session.return_value.get.side_effect = requests.ConnectionError()
+    assert transport.get("http://a/x") is ok
+    monkeypatch.setattr(
+        transport.time, "time", lambda: now + config.http["stale_max_age"] + 1
+    )
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get("http://a/x")
+
+    monkeypatch.setitem(config.http, "serve_stale", False)
+    mock_get_session.return_value.get.side_effect = requests.ConnectionError()
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get("http://a/x")
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_hedged(mock_get_session, monkeypatch):
+    """Test if a slow request is hedged and the first response is used"""
+    monkeypatch.setitem(config.http, "hedge", True)
+    monkeypatch.setitem(config.http, "hedge_delay", 0.01)
+    monkeypatch.setitem(config.http, "hedge_ratio", 0.5)
+    release = threading.Event()
+    fast = mock.Mock(status_code=200)
+    slow = mock.Mock(status_code=200)
+    responses = [slow, fast]
+
+    def send(url, timeout):
+        response = responses.pop(0)
+        if response is slow:
+            release.wait(5)
+        return response
+
+    mock_get_session.return_value.get.side_effect = send
+
+    assert transport.get("http://a/x", hedge=True) is fast
+    assert transport.get_hedge_stats() == {"requests": 1, "hedged": 1, "won": 1}
+    release.set()
+
+    # the hedge budget is spent: the next slow request waits for its response
+    responses[:] = [slow]
+    release.clear()
+    threading.Timer(0.05, release.set).start()
+    assert transport.get("http://a/x", hedge=True) is slow
+    assert transport.get_hedge_stats() == {"requests": 2, "hedged": 1, "won": 1}
+
+    # without the opt-in config.http["hedge"], requests are never hedged
+    monkeypatch.setitem(config.http, "hedge", False)
+    responses[:] = [fast]
+    assert transport.get("http://a/x", hedge=True) is fast
+    assert transport.get_hedge_stats()["requests"] == 2
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_hedged_error(mock_get_session, monkeypatch):
+    """Test if an error is raised when neither request succeeds"""
+    monkeypatch.setitem(config.http, "hedge", True)
+    monkeypatch.setitem(config.http, "retries", 0)
+    mock_get_session.return_value.get.return_value = mock.Mock(status_code=404)
+
+    assert transport.get("http://a/x", hedge=True).status_code == 404
+
+    mock_get_session.return_value.get.side_effect = requests.ConnectionError()
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get("http://a/x", hedge=True)
+
+
+def test_hedge_delay(monkeypatch):
+    """Test if the hedge delay follows the recent response times of a host"""
+    monkeypatch.setitem(config.http, "hedge_min_samples", 10)
+    monkeypatch.setitem(config.http, "hedge_percentile", 90)
+    monkeypatch.setitem(config.http, "hedge_window", 20)
+
+    assert transport.hedge_delay("a") == config.http["hedge_delay"]
+    for i in range(40):
+        transport._record_latency("a", i / 100)
+    assert transport.hedge_delay("a") == 0.37
+    assert transport.hedge_delay("b") == config.http["hedge_delay"]
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_traced(mock_get_session, no_sleep, monkeypatch):
+    """Test if every attempt is recorded when tracing is enabled"""
+    monkeypatch.setitem(config.http, "retries", 1)
+    mock_get_session.return_value.get.side_effect = [
+        requests.Timeout(),
+        mock.Mock(status_code=200, content=b"<stops/>"),
+    ]
+    trace.enable(at_exit=False)
+
+    transport.get("http://a/x")
+    events = trace.get_events()
+    assert [(e["status"], e["bytes"]) for e in events] == [("Timeout", 0), (200, 8)]
+    assert all(e["url"] == "http://a/x" for e in events)
+
+
+@mock.patch("luascli.transport.get_session")
+def test_get_cached(mock_get_session, monkeypatch):
+    """Test if cached responses are reused while fresh and revalidated after"""
+    monkeypatch.setitem(config.http_cache, "enabled", True)
+    url = "https://luasforecasts.rpa.ie/xml/get.ashx?action=stops"
+    session = mock_get_session.return_value
+
+    def respond(status, body=b"", headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers or {})
+        response._content = body
+        return response
+
+    session.get.return_value = respond(
+        200, b"<stops />", {"ETag": '"v1"', "Cache-Control": "max-age=60"}
+    )
+    assert transport.get(url).text == "<stops />"
+    assert transport.get(url).text == "<stops />"
+    assert session.get.call_count == 1
+
+    # a forced revalidation costs a 304, not the document
+    session.get.return_value = respond(304, headers={"Cache-Control": "max-age=0"})
+    response = transport.get(url, revalidate=True)
+    assert response.status_code == 200
+    assert response.text == "<stops />"
+    session.get.assert_called_with(
+        url,
+        timeout=(config.http["connect_timeout"], config.http["read_timeout"]),
+        headers={"If-None-Match": '"v1"'},
+    )
+
+    # stale now, so the next call revalidates and gets the new document
+    session.get.return_value = respond(200, b"<stops>2</stops>", {"ETag": '"v2"'})
+    assert transport.get(url).text == "<stops>2</stops>"
+    assert session.get.call_count == 3
+
+    # another process, or a restart, still has the entry for serve_stale
+    transport.reset_breakers()
+    session.get.side_effect = requests.ConnectionError
+    monkeypatch.setitem(config.http, "retries", 0)
+    assert transport.get(url).text == "<stops>2</stops>"
+
+    # but not once it is older than the stale limit
+    transport.reset_breakers()
+    now = time.time()
+    monkeypatch.setattr(
+        transport.time, "time", lambda: now + config.http["stale_max_age"] + 1
+    )
+    with pytest.raises(LuasServiceUnavailable):
+        transport.get(url)
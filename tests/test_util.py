@@ -1,6 +1,14 @@
-from luascli.util import xml_to_dict, get_address_by_coordinates
-from luascli.exceptions import AddressLocationNotFound
+from luascli.util import (
+    xml_to_dict,
+    get_address_by_coordinates,
+    get_cached_address,
+    reset_address_cache,
+)
+from luascli.exceptions import AddressLocationNotFound, LuasCatalogNotFound
+from luascli import config
+from conftest import ADDRESS_XML
 import json
+import mock
 import pytest
 
 
@@ -45,3 +53,37 @@ def test_get_address_by_coordinates():
 
     with pytest.raises(AddressLocationNotFound):
         get_address_by_coordinates("1234", "5678")
+
+
+@mock.patch("luascli.util.transport")
+def test_get_address_by_coordinates_cache(mock_transport):
+    """Test if addresses are cached locally by coordinates"""
+    mock_transport.get.return_value.text = ADDRESS_XML
+
+    assert get_cached_address("53.32636", "-6.25618") is None
+
+    address = get_address_by_coordinates("53.32636", "-6.25618")
+    assert address["postcode"] == "D06 Y027"
+    assert address["full_address"] == "Ranelagh, Dublin, D06 Y027, Ireland"
+    mock_transport.get.assert_called_once()
+
+    # served from memory, then from the cache file
+    assert get_address_by_coordinates("53.32636", "-6.25618") == address
+    reset_address_cache()
+    assert get_address_by_coordinates("53.32636", "-6.25618") == address
+    mock_transport.get.assert_called_once()
+
+    # errors are not cached
+    mock_transport.get.return_value.text = (
+        "<reversegeocode><error>Unable to geocode</error></reversegeocode>"
+    )
+    for _ in range(2):
+        with pytest.raises(AddressLocationNotFound):
+            get_address_by_coordinates("1234", "5678")
+    assert mock_transport.get.call_count == 3
+
+    config.catalog["offline"] = True
+    assert get_address_by_coordinates("53.32636", "-6.25618") == address
+    with pytest.raises(LuasCatalogNotFound):
+        get_address_by_coordinates("1234", "5678")
+    assert mock_transport.get.call_count == 3
@@ -0,0 +1,83 @@
+from luascli.watch import render_rows, watch_timetables, CURSOR_DOWN, CLEAR_LINE
+from luascli.exceptions import LuasStopNotFound
+import mock
+
+
+def test_render_rows():
+    """Test if render_rows only rewrites the rows that changed"""
+
+    rows = ["Inbound", "\tDestination: Broombridge - Due: 2"]
+    assert render_rows(None, rows) == "Inbound\n\tDestination: Broombridge - Due: 2\n"
+    assert render_rows(rows, rows) == "\x1b[2A" + CURSOR_DOWN + CURSOR_DOWN
+
+    changed = ["Inbound", "\tDestination: Broombridge - Due: DUE"]
+    assert render_rows(rows, changed) == (
+        "\x1b[2A" + CURSOR_DOWN + CLEAR_LINE + "\tDestination: Broombridge - Due: DUE\n"
+    )
+
+    longer = changed + ["\tDestination: Broombridge - Due: 12"]
+    assert render_rows(changed, longer) == (
+        "\x1b[2A" + CURSOR_DOWN + CURSOR_DOWN + "\tDestination: Broombridge - Due: 12\n"
+    )
+
+    assert render_rows(longer, ["Inbound"]) == (
+        "\x1b[3A"
+        + CURSOR_DOWN
+        + CLEAR_LINE
+        + CURSOR_DOWN
+        + CLEAR_LINE
+        + CURSOR_DOWN
+        + "\x1b[2A"
+    )
+    assert render_rows([], ["Inbound"]) == "Inbound\n"
+
+
+@mock.patch("luascli.luas.get_timetables")
+def test_watch_timetables(mock_get_timetables):
+    """Test if watch_timetables redraws changes and backs off while idle"""
+
+    def results(due):
+        return [
+            {
+                "stop": "ran",
+                "timetable": {
+                    "inbound": [{"destination": "Broombridge", "dueMins": due}]
+                },
+                "error": None,
+            }
+        ]
+
+    mock_get_timetables.side_effect = [
+        results("2"),
+        results("2"),
+        results("2"),
+        results("2"),
+        results("DUE"),
+        [{"stop": "ran", "timetable": None, "error": LuasStopNotFound("ran")}],
+    ]
+    output = []
+    delays = []
+
+    watch_timetables(
+        ["ran"],
+        output.append,
+        interval=10,
+        max_interval=30,
+        max_workers=2,
+        sleep=delays.append,
+        iterations=6,
+    )
+
+    assert delays == [10, 20, 30, 30, 10]
+    assert output[0] == "Inbound\n\tDestination: Broombridge - Due: 2\n"
+    assert output[1] == "\x1b[2A" + CURSOR_DOWN + CURSOR_DOWN
+    assert output[4].endswith(CLEAR_LINE + "\tDestination: Broombridge - Due: DUE\n")
+    assert output[5] == (
+        "\x1b[2A"
+        + CLEAR_LINE
+        + "The Luas stop ran doesn't exist.\n"
+        + CLEAR_LINE
+        + CURSOR_DOWN
+        + "\x1b[1A"
+    )
+    mock_get_timetables.assert_called_with(["ran"], 2)